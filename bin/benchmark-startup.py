@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measure the startup time of presto-admin: the time to import it, and the
+time to run commands that do not connect to any node, each in a new python
+process. The commands run with a topology of their own in a temporary
+configuration directory, so topology show runs its task without prompting.
+
+The task modules are only imported to run their command, so what remains
+is mostly importing Fabric and Paramiko, which presto-admin needs to parse
+its options and to patch Fabric. import fabric.api is measured as that
+floor: locally it takes about 150 ms, --help about 170 ms and topology show,
+which also imports and runs its task, about 230 ms, so startup cannot get
+down to tens of milliseconds without replacing Fabric.
+
+Usage: bin/benchmark-startup.py [runs]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARKS = [
+    ('import fabric.api', ['-c', 'import fabric.api']),
+    ('import prestoadmin', ['-c', 'import prestoadmin']),
+    ('import prestoadmin.main', ['-c', 'import prestoadmin.main']),
+    ('presto-admin --help', ['-m', 'prestoadmin.main', '--help']),
+    ('presto-admin -d topology show',
+     ['-m', 'prestoadmin.main', '-d', 'topology', 'show']),
+    ('presto-admin topology show',
+     ['-m', 'prestoadmin.main', 'topology', 'show']),
+]
+
+TOPOLOGY = {'username': 'root', 'port': 22, 'coordinator': 'localhost',
+            'workers': ['localhost']}
+
+
+def time_command(args, environment):
+    with open(os.devnull, 'r+') as devnull:
+        start = time.time()
+        subprocess.call([sys.executable] + args, cwd=ROOT_DIR,
+                        env=environment, stdin=devnull, stdout=devnull,
+                        stderr=devnull)
+        return (time.time() - start) * 1000
+
+
+def main(runs):
+    config_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(config_dir, 'config.json'), 'w') as config:
+            json.dump(TOPOLOGY, config)
+        environment = dict(os.environ, PRESTO_ADMIN_CONFIG_DIR=config_dir)
+        print('%-32s %10s %10s' % ('Benchmark', 'min ms', 'median ms'))
+        for name, args in BENCHMARKS:
+            timings = sorted(time_command(args, environment)
+                             for _ in range(runs))
+            print('%-32s %10.1f %10.1f' % (name, timings[0],
+                                           timings[len(timings) // 2]))
+    finally:
+        shutil.rmtree(config_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
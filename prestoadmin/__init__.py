@@ -60,40 +60,20 @@ ADDITIONAL_TASK_MODULES = {
                       'plugin']}
 
 
+#
+# The task modules are not imported here, since importing them is most of
+# the startup time of presto-admin. main lists their tasks from their source
+# and only imports the module of the command being run.
+#
+TASK_MODULES = []
 if cfg_mode is not None:
-    atms = for_mode(cfg_mode, ADDITIONAL_TASK_MODULES)
-    for atm in atms:
+    for atm in for_mode(cfg_mode, ADDITIONAL_TASK_MODULES):
         try:
             module, subcommand_name = atm
         except ValueError:
             module = atm
             subcommand_name = atm
-
-        __all__.append(subcommand_name)
-
-        components = module.split('.')
-
-        if len(components) == 1:
-            # The simple case...
-            # import <module> as <subcommand_name>
-            globals()[subcommand_name] = __import__(module, globals())
-        else:
-            # The complicated case:
-            # import foo.bar doesn't actually import foo.bar; it imports foo.
-            # This is why, for example, you can't to the following:
-
-            # >>> import os.path
-            # >>> path.join('foo', 'bar', 'baz', 'zot')
-            #
-            # Doing the equivalent of import yarn_slider.slider as slider
-            # results in the global slider variable being assigned to the
-            # yarn_slider module, which is NOT what we want.
-            # Instead, we need to recursively traverse the submodules until we
-            # get to the one we're interested in.
-            submodule = __import__(module, globals())
-            for c in components[1:]:
-                submodule = submodule.__dict__[c]
-            globals()[subcommand_name] = submodule
+        TASK_MODULES.append((module, subcommand_name))
 
 
 env.roledefs = {
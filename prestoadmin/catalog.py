@@ -24,14 +24,14 @@ from fabric.context_managers import hide
 from fabric.contrib import files
 from fabric.operations import sudo, os, get
 
-from prestoadmin.deploy import secure_create_directory
+from prestoadmin.deploy import deploy_changed
 from prestoadmin.standalone.config import StandaloneConfig, \
     PRESTO_STANDALONE_USER_GROUP
 from prestoadmin.util import constants
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.exception import ConfigFileNotFoundError, \
     ConfigurationError
-from prestoadmin.util.fabricapi import put_secure
+from prestoadmin.util.journal import resumable
 from prestoadmin.util.filesystem import ensure_directory_exists
 from prestoadmin.util.local_config_util import get_catalog_directory
 
@@ -45,10 +45,11 @@ COULD_NOT_REMOVE = 'Could not remove catalog'
 # that should not be world readable
 def deploy_files(filenames, local_dir, remote_dir, user_group, mode=0600):
     _LOGGER.info('Deploying configurations for ' + str(filenames))
-    secure_create_directory(remote_dir, PRESTO_STANDALONE_USER_GROUP)
+    bundle_files = {}
     for name in filenames:
-        put_secure(user_group, mode, os.path.join(local_dir, name), remote_dir,
-                   use_sudo=True)
+        with open(os.path.join(local_dir, name)) as catalog_file:
+            bundle_files[name] = catalog_file.read()
+    return deploy_changed(bundle_files, remote_dir, user_group, mode)
 
 
 def gather_catalogs(local_config_dir, allow_overwrite=False):
@@ -84,6 +85,7 @@ def validate(filenames):
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def add(name=None):
     """
@@ -100,6 +102,22 @@ def add(name=None):
     Parameters:
         name - Name of the catalog to be added
     """
+    filenames = get_catalog_files(name)
+    if not filenames:
+        return
+    print('Deploying %s catalog configurations on: %s ' %
+          (', '.join(filenames), env.host))
+
+    deploy_files(filenames, get_catalog_directory(),
+                 constants.REMOTE_CATALOG_DIR, PRESTO_STANDALONE_USER_GROUP)
+
+
+def get_catalog_files(name=None):
+    """
+    Return the sorted file names of the catalog name, or of all the catalogs
+    in the catalog directory, once they are validated, or None if there are
+    none to deploy
+    """
     catalog_dir = get_catalog_directory()
     if name:
         filename = name + '.properties'
@@ -130,14 +148,11 @@ def add(name=None):
         return
     filenames.sort()
     _LOGGER.info('Adding catalog configurations: ' + str(filenames))
-    print('Deploying %s catalog configurations on: %s ' %
-          (', '.join(filenames), env.host))
-
-    deploy_files(filenames, catalog_dir,
-                 constants.REMOTE_CATALOG_DIR, PRESTO_STANDALONE_USER_GROUP)
+    return filenames
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def remove(name):
     """
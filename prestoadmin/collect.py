@@ -18,26 +18,39 @@ Module for gathering various debug information for incident reporting
 using presto-admin
 """
 
+import base64
+import glob
+import inspect
 import logging
 import json
+import pipes
+import re
 import shutil
 import tarfile
+import time
 
 import requests
-from fabric.contrib.files import append
 from fabric.context_managers import settings, hide
-from fabric.operations import os, get, run
+from fabric.operations import os, get, sudo
 from fabric.tasks import execute
 from fabric.api import env, runs_once, task
 from fabric.utils import abort, warn
 
 from prestoadmin.prestoclient import PrestoClient
-from prestoadmin.server import get_presto_version, get_catalog_info_from
+from prestoadmin.server import get_catalog_info_from
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util.constants import REMOTE_CONF_DIR, JVM_CONFIG
 from prestoadmin.util.filesystem import ensure_directory_exists
-from prestoadmin.util.local_config_util import get_log_directory
+from prestoadmin.util.gc_log import GC_LOG_FILE_MARKER, \
+    GC_LOG_LINE_FILTER, JAVA8_GC_LOG_OPTIONS, compute_gc_statistics, \
+    find_gc_log_path, format_ranking, parse_gc_log
+from prestoadmin.util.local_config_util import get_log_directory, \
+    get_config_directory
+from prestoadmin.util.thread_dump import format_hottest_frames, \
+    parse_jfr_top_frames, parse_jstack_top_frames
+from prestoadmin.util import remote_system_info
 from prestoadmin.util.remote_config_util import lookup_server_log_file,\
-    lookup_launcher_log_file,  lookup_port, lookup_catalog_directory
+    lookup_launcher_log_file,  lookup_port
 from prestoadmin.standalone.config import StandaloneConfig
 import prestoadmin.util.fabricapi as fabricapi
 import prestoadmin
@@ -46,22 +59,60 @@ import prestoadmin
 TMP_PRESTO_DEBUG = '/tmp/presto-debug/'
 TMP_PRESTO_DEBUG_REMOTE = '/tmp/presto-debug-remote'
 OUTPUT_FILENAME_FOR_LOGS = '/tmp/presto-debug-logs.tar.gz'
+OUTPUT_FILENAME_FOR_LOG_DELTAS = '/tmp/presto-debug-logs-delta-%s.tar.gz'
+LOGS_INDEX_FILE_NAME = 'collect_logs_index.json'
 OUTPUT_FILENAME_FOR_SYS_INFO = '/tmp/presto-debug-sysinfo.tar.gz'
+OUTPUT_FILENAME_FOR_THREAD_DUMPS = '/tmp/presto-debug-thread-dumps.tar.gz'
+OUTPUT_FILENAME_FOR_JFR = '/tmp/presto-debug-jfr.tar.gz'
 PRESTOADMIN_LOG_NAME = 'presto-admin.log'
 _LOGGER = logging.getLogger(__name__)
 QUERY_REQUEST_EXT = 'v1/query/'
 NODES_REQUEST_EXT = 'v1/node'
-
-__all__ = ['logs', 'query_info', 'system_info']
+DEFAULT_GREP_MAX_MATCHES = 1000
+LOG_TIMESTAMP_REGEX = '^[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T'
+GC_ANALYSIS_FILE_NAME = 'gc_analysis.json'
+DEFAULT_THREAD_DUMP_COUNT = 3
+DEFAULT_THREAD_DUMP_INTERVAL = 5
+# Sampling starts at the same time on all the nodes, a few seconds after the
+# command is run so that every node has been reached by then. The nodes are
+# reached one after the other, so the delay grows with their number.
+SAMPLING_START_DELAY = 5
+SAMPLING_START_DELAY_PER_HOST = 0.1
+SAMPLING_LATE_REGEX = re.compile(r'Started sampling (\d+) seconds late')
+JFR_WRITE_TIMEOUT = 30
+HOTTEST_FRAMES_LIMIT = 20
+# The brackets keep pgrep from matching the shell running the command.
+PRESTO_SERVER_PROCESS_PATTERN = 'com.facebook.presto.server.[P]restoServer'
+
+__all__ = ['logs', 'grep', 'gc_analysis', 'thread_dumps', 'jfr',
+           'query_info', 'system_info']
 
 
 @task
 @runs_once
 @requires_config(StandaloneConfig)
-def logs():
+def logs(collection_mode=None):
     """
     Gather all the server logs and presto-admin log and create a tar file.
+
+    If 'incremental' is specified, only the log data appended since the
+    previous incremental collection and any newly rotated log files are
+    downloaded. The offsets already collected from each host are kept in a
+    local index, and the downloaded data is written to a timestamped delta
+    archive.
+
+    Parameters:
+        collection_mode - [incremental]
     """
+    if collection_mode is None:
+        collect_all_logs()
+    elif collection_mode.lower() == 'incremental':
+        collect_log_deltas()
+    else:
+        abort('Invalid Argument. Possible values: incremental')
+
+
+def collect_all_logs():
     downloaded_logs_location = os.path.join(TMP_PRESTO_DEBUG, "logs")
     ensure_directory_exists(downloaded_logs_location)
 
@@ -74,6 +125,52 @@ def logs():
     print 'logs archive created: ' + OUTPUT_FILENAME_FOR_LOGS
 
 
+def collect_log_deltas():
+    downloaded_logs_location = os.path.join(TMP_PRESTO_DEBUG, 'logs-delta')
+    shutil.rmtree(downloaded_logs_location, ignore_errors=True)
+    ensure_directory_exists(downloaded_logs_location)
+
+    index = load_logs_index()
+
+    print 'Downloading new log data from all the nodes...'
+    results = execute(get_remote_log_deltas, downloaded_logs_location, index,
+                      roles=env.roles)
+    for host, host_index in results.iteritems():
+        if isinstance(host_index, dict):
+            index[host] = host_index
+
+    copy_admin_log(downloaded_logs_location)
+
+    output_filename = OUTPUT_FILENAME_FOR_LOG_DELTAS % \
+        time.strftime('%Y%m%dT%H%M%S')
+    make_tarfile(output_filename, downloaded_logs_location)
+    store_logs_index(index)
+    print 'logs delta archive created: ' + output_filename
+
+
+def get_logs_index_path():
+    return os.path.join(get_config_directory(), LOGS_INDEX_FILE_NAME)
+
+
+def load_logs_index():
+    try:
+        with open(get_logs_index_path()) as index_file:
+            return json.load(index_file)
+    except IOError:
+        return {}
+    except ValueError:
+        warn('Ignoring corrupted log collection index %s' %
+             get_logs_index_path())
+        return {}
+
+
+def store_logs_index(index):
+    index_path = get_logs_index_path()
+    ensure_directory_exists(os.path.dirname(index_path))
+    with open(index_path, 'w') as index_file:
+        index_file.write(json.dumps(index, indent=4))
+
+
 def copy_admin_log(log_folder):
     shutil.copy(os.path.join(get_log_directory(), PRESTOADMIN_LOG_NAME), log_folder)
 
@@ -114,6 +211,397 @@ def get_files(remote_path, local_path):
         warn('remote path ' + remote_path + ' not found on ' + env.host)
 
 
+def get_remote_log_deltas(dest_path, index):
+    """
+    Download the log data appended on env.host since the offsets recorded in
+    index, and return the updated index entries for env.host.
+
+    Files are tracked by inode so that a log renamed by rotation is not
+    downloaded a second time. The data is saved as
+    <file name>.<inode>.<offset>, so the deltas from successive archives can
+    be merged by concatenating the parts of a file in offset order, and the
+    parts of a log that replaced a rotated one do not overwrite those of the
+    rotated log.
+    """
+    remote_logs = [lookup_server_log_file(env.host) + '*',
+                   lookup_launcher_log_file(env.host) + '*']
+    _LOGGER.debug('Logs to be archived incrementally on host ' + env.host +
+                  ': ' + str(remote_logs))
+    remote_files = stat_remote_files(remote_logs)
+    deltas = plan_log_deltas(remote_files, index.get(env.host, {}))
+
+    if deltas:
+        fetch_log_deltas(deltas, dest_path)
+    else:
+        print 'No new log data on ' + env.host
+
+    return dict((inode, {'path': path, 'size': size, 'offset': size})
+                for inode, size, path in remote_files)
+
+
+def stat_remote_files(remote_paths):
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        output = sudo('stat -L -c "%%i %%s %%n" %s 2>/dev/null' %
+                      ' '.join(remote_paths))
+    remote_files = []
+    for line in output.splitlines():
+        try:
+            inode, size, path = line.strip().split(' ', 2)
+            remote_files.append((inode, int(size), path))
+        except ValueError:
+            _LOGGER.debug('Ignoring unexpected stat output: ' + line)
+    return remote_files
+
+
+def plan_log_deltas(remote_files, host_index):
+    """
+    Return (path, inode, offset, length) for each file with data that has not
+    been collected yet. A file whose inode is unknown, or which is now smaller
+    than the collected offset (i.e. it was truncated), is downloaded from the
+    start.
+    """
+    deltas = []
+    for inode, size, path in remote_files:
+        offset = 0
+        if inode in host_index and host_index[inode]['offset'] <= size:
+            offset = host_index[inode]['offset']
+        if size > offset:
+            deltas.append((path, inode, offset, size - offset))
+    return deltas
+
+
+def fetch_log_deltas(deltas, dest_path):
+    staging_dir = os.path.join(TMP_PRESTO_DEBUG_REMOTE, 'logs-delta')
+    remote_tar = staging_dir + '.tar.gz'
+    # The length is bounded with head so that data appended while the
+    # command runs is left for the next collection.
+    copy_commands = ['tail -c +%d "%s" | head -c %d > "%s/%s.%s.%d"' %
+                     (offset + 1, path, length, staging_dir,
+                      os.path.basename(path), inode, offset)
+                     for path, inode, offset, length in deltas]
+    sudo('rm -rf "%(dir)s" && mkdir -p "%(dir)s" && %(copy)s && '
+         'tar -czf "%(tar)s" -C "%(dir)s" . && rm -rf "%(dir)s"' %
+         {'dir': staging_dir, 'copy': ' && '.join(copy_commands),
+          'tar': remote_tar})
+
+    download_host_archive(remote_tar, dest_path)
+
+
+def download_host_archive(remote_tar, dest_path):
+    """
+    Download a tar archive created on the current host, extract it into a
+    directory named after the host under dest_path and remove the archive
+    from both sides.
+    """
+    path_with_host_name = os.path.join(dest_path, env.host)
+    ensure_directory_exists(path_with_host_name)
+    local_tar = os.path.join(dest_path, env.host + '.tar.gz')
+    try:
+        get(remote_tar, local_tar, use_sudo=True)
+    finally:
+        sudo('rm -f "%s"' % remote_tar)
+
+    tar = tarfile.open(local_tar, 'r:gz')
+    try:
+        tar.extractall(path_with_host_name)
+    finally:
+        tar.close()
+    os.remove(local_tar)
+    return path_with_host_name
+
+
+@task
+@requires_config(StandaloneConfig)
+def grep(pattern, since=None, until=None,
+         max_matches=DEFAULT_GREP_MAX_MATCHES):
+    """
+    Search the server and launcher logs on all nodes for lines matching the
+    given pattern and print the matching lines prefixed with the host name.
+
+    The search runs on every node in parallel, including in rotated and
+    compressed logs, and only the matching lines are transferred.
+
+    Parameters:
+        pattern - Extended regular expression to search for
+        since - (optional) Only search log entries logged at or after this
+                time, in the timestamp format of the logs, e.g.
+                2017-01-31T10:00
+        until - (optional) Only search log entries logged before this time
+        max_matches - (optional) Maximum number of matching lines to print
+                      for each node. The default is 1000.
+    """
+    try:
+        max_matches = int(max_matches)
+    except ValueError:
+        abort('Invalid max_matches %s. It must be an integer.' % max_matches)
+
+    remote_logs = [lookup_server_log_file(env.host),
+                   lookup_launcher_log_file(env.host)]
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        output = sudo(build_grep_command(remote_logs, pattern, since, until,
+                                         max_matches))
+
+    lines = output.splitlines()
+    for line in lines:
+        print('[%s] %s' % (env.host, line))
+    if len(lines) >= max_matches:
+        print('[%s] Stopped after %d matching lines' % (env.host, max_matches))
+
+
+def build_grep_command(remote_logs, pattern, since=None, until=None,
+                       max_matches=DEFAULT_GREP_MAX_MATCHES):
+    """
+    Build a shell command that prints at most max_matches lines matching
+    pattern from the given logs and their rotated copies.
+
+    Log files last modified before since cannot contain any entry in the time
+    window, so they are not read at all. Within the remaining files, a line
+    without a timestamp (e.g. a stack trace) belongs to the window of the
+    last timestamped line before it in the same file.
+    """
+    find_commands = []
+    for remote_log in remote_logs:
+        find_command = 'find %s -maxdepth 1 -type f -name %s' % (
+            pipes.quote(os.path.dirname(remote_log)),
+            pipes.quote(os.path.basename(remote_log) + '*'))
+        if since:
+            find_command += ' -newermt %s' % pipes.quote(since)
+        find_commands.append(find_command)
+
+    time_filter = ''
+    if since or until:
+        conditions = []
+        if since:
+            conditions.append('$1 >= %s' % _awk_string(since))
+        if until:
+            conditions.append('$1 < %s' % _awk_string(until))
+        time_filter = " | awk 'BEGIN { keep = 1 } $0 ~ /%s/ { keep = (%s) } " \
+                      "keep'" % (LOG_TIMESTAMP_REGEX, ' && '.join(conditions))
+
+    command = 'files=$( ( %s ) 2>/dev/null | sort -u ); ' \
+              '[ -n "$files" ] || exit 0; ' \
+              'ls -1tr $files | while read f; do zcat -f "$f" 2>/dev/null%s; ' \
+              'done | ' % ('; '.join(find_commands), time_filter)
+    command += 'grep -E -e %s | head -n %d' % (pipes.quote(pattern),
+                                               max_matches)
+    return command
+
+
+def _awk_string(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace("'", "'\\''")
+
+
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def gc_analysis():
+    """
+    Analyze the garbage collection logs of the Presto server on all nodes and
+    print the nodes ordered from the worst to the best.
+
+    For each node, the pause time percentiles, the longest pause, the number
+    of full GCs and humongous allocations and the allocation rate are
+    computed from the GC log configured in jvm.config. The log is filtered
+    with grep on the node, so only the relevant lines are transferred, and
+    parsed locally. The statistics are also written to
+    /tmp/presto-debug/gc_analysis.json.
+
+    Nodes without GC logging enabled are reported and skipped.
+    """
+    results = execute(get_gc_statistics, roles=env.roles)
+    statistics_by_host = dict((host, statistics) for host, statistics
+                              in results.items()
+                              if isinstance(statistics, dict))
+    if not statistics_by_host:
+        abort('No GC logs were found on any node')
+
+    print(format_ranking(statistics_by_host))
+
+    ensure_directory_exists(TMP_PRESTO_DEBUG)
+    report_path = os.path.join(TMP_PRESTO_DEBUG, GC_ANALYSIS_FILE_NAME)
+    with open(report_path, 'w') as report:
+        json.dump(statistics_by_host, report, indent=4, sort_keys=True)
+    print('GC analysis written to ' + report_path)
+
+
+def get_gc_statistics():
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        jvm_config = sudo('cat ' + os.path.join(REMOTE_CONF_DIR, JVM_CONFIG))
+    gc_log_path = None
+    if jvm_config.succeeded:
+        gc_log_path = find_gc_log_path(jvm_config.splitlines())
+    if gc_log_path is None:
+        warn('GC logging is not enabled on %s. Add the following to '
+             'jvm.config and restart the server to enable it: %s'
+             % (env.host, ' '.join(JAVA8_GC_LOG_OPTIONS)))
+        return None
+
+    # The path may be a glob, and rotated logs share its prefix, so it must
+    # not be quoted.
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        output = sudo('ls -1tr %s* 2>/dev/null | while read f; do '
+                      'echo %s"$f"; grep -h -E %s "$f"; done'
+                      % (gc_log_path, pipes.quote(GC_LOG_FILE_MARKER),
+                         pipes.quote(GC_LOG_LINE_FILTER)))
+    return compute_gc_statistics(parse_gc_log(output.splitlines()))
+
+
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def thread_dumps(count=DEFAULT_THREAD_DUMP_COUNT,
+                 interval=DEFAULT_THREAD_DUMP_INTERVAL):
+    """
+    Take thread dumps of the Presto server on all nodes at the same time and
+    print the stack frames most often found running across the cluster.
+
+    The dumps are taken with jstack as the presto user and compressed on the
+    nodes, then downloaded in parallel into an archive with a directory for
+    each node.
+
+    Parameters:
+        count - (optional) Number of thread dumps to take on each node. The
+                default is 3.
+        interval - (optional) Seconds to wait between thread dumps. The
+                   default is 5.
+    """
+    count = _parse_int('count', count, 1)
+    interval = _parse_int('interval', interval, 0)
+    sampling_command = ('for i in $(seq 1 %(count)d); do '
+                        '"$jdk/jstack" $pid > thread-dump-$i.txt || exit 1; '
+                        '[ $i -eq %(count)d ] || sleep %(interval)d; done'
+                        % {'count': count, 'interval': interval})
+    collect_stack_samples('thread-dumps', sampling_command,
+                          'thread-dump-*.txt', parse_jstack_top_frames,
+                          OUTPUT_FILENAME_FOR_THREAD_DUMPS)
+
+
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def jfr(seconds):
+    """
+    Record the Presto server on all nodes with Java Flight Recorder at the
+    same time and print the stack frames most often found running across
+    the cluster.
+
+    The recordings are made with jcmd as the presto user and compressed on
+    the nodes, then downloaded in parallel into an archive with a directory
+    for each node. The stack frames are summarized from the execution
+    samples if the JDK running the server provides the jfr tool.
+
+    Parameters:
+        seconds - Duration of the recording in seconds
+    """
+    seconds = _parse_int('seconds', seconds, 1)
+    sampling_command = (
+        '"$jdk/jcmd" $pid JFR.start name=presto-admin duration=%(seconds)ds '
+        'filename=$PWD/recording.jfr || exit 1; sleep %(seconds)d; '
+        'for i in $(seq 1 %(timeout)d); do [ -s recording.jfr ] && break; '
+        'sleep 1; done; [ ! -x "$jdk/jfr" ] || "$jdk/jfr" print '
+        '--events jdk.ExecutionSample recording.jfr > execution-samples.txt'
+        % {'seconds': seconds, 'timeout': JFR_WRITE_TIMEOUT})
+    collect_stack_samples('jfr', sampling_command, 'execution-samples.txt',
+                          parse_jfr_top_frames, OUTPUT_FILENAME_FOR_JFR)
+
+
+def _parse_int(name, value, minimum):
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        abort('Invalid %s. It must be an integer of at least %d.'
+              % (name, minimum))
+    return value
+
+
+def collect_stack_samples(name, sampling_command, sample_file_pattern,
+                          parse_top_frames, output_filename):
+    downloaded_location = os.path.join(TMP_PRESTO_DEBUG, name)
+    shutil.rmtree(downloaded_location, ignore_errors=True)
+    ensure_directory_exists(downloaded_location)
+
+    host_count = len(fabricapi.get_host_list())
+    start_time = int(time.time() + SAMPLING_START_DELAY +
+                     host_count * SAMPLING_START_DELAY_PER_HOST)
+    print 'Sampling the Presto server on all the nodes...'
+    # Every node must be sampling by start_time, so none of them may wait
+    # for a place in the pool
+    with settings(pool_size=host_count):
+        results = execute(get_stack_samples, name, sampling_command,
+                          start_time, downloaded_location, roles=env.roles)
+
+    frames_by_host = {}
+    for host, host_location in results.iteritems():
+        if not isinstance(host_location, basestring):
+            continue
+        frames = []
+        for sample_file in glob.glob(os.path.join(host_location,
+                                                  sample_file_pattern)):
+            with open(sample_file) as samples:
+                frames.extend(parse_top_frames(samples))
+        frames_by_host[host] = frames
+
+    make_tarfile(output_filename, downloaded_location)
+    print name + ' archive created: ' + output_filename
+    if any(frames_by_host.values()):
+        print 'Hottest stack frames across the cluster:'
+        print format_hottest_frames(frames_by_host, HOTTEST_FRAMES_LIMIT)
+    else:
+        print 'No running stack frames were sampled'
+
+
+def get_stack_samples(name, sampling_command, start_time, dest_path):
+    remote_dir = '/tmp/presto-debug-remote-' + name
+    remote_tar = remote_dir + '.tar.gz'
+    # The node reports a late start itself as well, which also catches a
+    # node with a clock ahead of the local one
+    seconds_late = int(time.time()) - start_time
+    with settings(warn_only=True):
+        result = sudo(build_sampling_command(remote_dir, remote_tar,
+                                             start_time, sampling_command),
+                      user='presto')
+    if result.failed:
+        warn('Could not sample the Presto server on %s: %s'
+             % (env.host, result))
+        return None
+    late_match = SAMPLING_LATE_REGEX.search(result)
+    if late_match:
+        seconds_late = max(seconds_late, int(late_match.group(1)))
+    if seconds_late > 0:
+        warn('Sampling started %d seconds late on %s, so its samples are not '
+             'from the same time as those of the other nodes'
+             % (seconds_late, env.host))
+    return download_host_archive(remote_tar, dest_path)
+
+
+def build_sampling_command(remote_dir, remote_tar, start_time,
+                           sampling_command):
+    """
+    Build a shell command that finds the Presto server process and the JDK
+    tools of the JVM running it, waits until start_time, runs
+    sampling_command in an empty directory and archives the directory into
+    remote_tar. The sampling command can use $pid and $jdk. If start_time
+    has already passed, the command prints how many seconds late it is.
+    """
+    return ('pid=$(pgrep -u presto -f %(pattern)s | head -n 1); '
+            '[ -n "$pid" ] || { echo "Presto server is not running"; '
+            'exit 1; }; '
+            'bin=$(dirname $(readlink -f /proc/$pid/exe)); jdk=$bin; '
+            '[ -x "$jdk/jcmd" ] || jdk=$bin/../../bin; '
+            'rm -rf %(dir)s && mkdir -p %(dir)s && cd %(dir)s || exit 1; '
+            'delay=$((%(start)d - $(date +%%s))); '
+            'if [ $delay -ge 0 ]; then sleep $delay; else '
+            'echo "Started sampling $((-delay)) seconds late"; fi; '
+            '%(sampling)s; '
+            'cd / && tar -czf %(tar)s -C %(dir)s . && rm -rf %(dir)s'
+            % {'pattern': pipes.quote(PRESTO_SERVER_PROCESS_PATTERN),
+               'dir': remote_dir, 'start': start_time,
+               'sampling': sampling_command, 'tar': remote_tar})
+
+
 def request_url(url_extension):
     host = env.host
     port = lookup_port(host)
@@ -201,7 +689,6 @@ def system_info():
 
     _LOGGER.debug('Gathered catalog information in file: ' + catalog_file_name)
 
-    execute(get_catalog_configs, downloaded_sys_info_loc, roles=env.roles)
     execute(get_system_info, downloaded_sys_info_loc, roles=env.roles)
 
     make_tarfile(OUTPUT_FILENAME_FOR_SYS_INFO, downloaded_sys_info_loc)
@@ -209,40 +696,55 @@ def system_info():
 
 
 def get_system_info(download_location):
-
-    run("mkdir -p " + TMP_PRESTO_DEBUG_REMOTE)
-
-    version_file_name = os.path.join(TMP_PRESTO_DEBUG_REMOTE, 'version_info.txt')
-    run('rm -f ' + version_file_name)
-
-    append(version_file_name, "platform information : " +
-           get_platform_information() + '\n')
-    append(version_file_name, 'Java version: ' + get_java_version() + '\n')
-    append(version_file_name, 'Presto-admin version: ' +
-           prestoadmin.__version__ + '\n')
-    append(version_file_name, 'Presto server version: ' +
-           get_presto_version() + '\n')
-
-    _LOGGER.debug('Gathered version information in file: ' + version_file_name)
-
-    get_files(version_file_name, download_location)
-
-
-def get_catalog_configs(dest_path):
-    remote_catalog_dir = lookup_catalog_directory(env.host)
-    _LOGGER.debug('catalogs to be archived on host ' + env.host + ': ' + remote_catalog_dir)
-    get_files(remote_catalog_dir, dest_path)
-
-
-def get_platform_information():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        platform_info = run('uname -a')
-        _LOGGER.debug('platform info: ' + platform_info)
-        return platform_info
+    with settings(hide('stdout', 'warnings'), warn_only=True):
+        output = sudo(build_system_info_command())
+    if output.failed:
+        warn('Unable to gather system information on %s: %s'
+             % (env.host, output))
+        return
+    # Skip anything the login prints before the report, such as a sudo
+    # lecture, and anything printed after it
+    try:
+        report = json.JSONDecoder().raw_decode(output, output.index('{'))[0]
+    except ValueError:
+        warn('Unable to gather system information on %s, unexpected '
+             'output: %s' % (env.host, output))
+        return
+    report['presto_admin_version'] = prestoadmin.__version__
+    write_system_info(report, os.path.join(download_location, env.host))
 
 
-def get_java_version():
-    with settings(hide('warnings', 'stdout'), warn_only=True):
-        version = run('java -version')
-        _LOGGER.debug('java version: ' + version)
-        return version
+def build_system_info_command():
+    """
+    Build a shell command that runs the remote_system_info script with the
+    python of the node. The script is passed base64 encoded so that it needs
+    neither quoting nor a temporary file.
+    """
+    script = base64.b64encode(inspect.getsource(remote_system_info))
+    return ('py=$(command -v python || command -v python3 || '
+            'command -v python2); echo %s | base64 -d | "$py" -' % script)
+
+
+def write_system_info(report, host_location):
+    catalog_location = os.path.join(host_location, 'catalog')
+    ensure_directory_exists(catalog_location)
+    for name, catalog in report['catalogs'].items():
+        with open(os.path.join(catalog_location, name), 'w') as out_file:
+            out_file.write(catalog.pop('content').encode('utf-8'))
+
+    with open(os.path.join(host_location, 'system_info.json'), 'w') \
+            as out_file:
+        out_file.write(json.dumps(report, indent=4, sort_keys=True))
+
+    rpm_versions = report['rpm_versions']
+    presto_version = rpm_versions.get('presto',
+                                      rpm_versions.get('presto-server-rpm', ''))
+    with open(os.path.join(host_location, 'version_info.txt'), 'w') \
+            as out_file:
+        out_file.write('platform information : %s\n' %
+                       report['platform']['uname'])
+        out_file.write('Java version: %s\n' % report['java_version'])
+        out_file.write('Presto-admin version: %s\n' %
+                       report['presto_admin_version'])
+        out_file.write('Presto server version: %s\n' % presto_version)
+    _LOGGER.debug('Gathered system information in ' + host_location)
@@ -15,34 +15,59 @@
 """
 Module for various configuration management tasks using presto-admin
 """
+import difflib
+import hashlib
 import logging
 import os
+import pipes
+import sys
+import tarfile
+import tempfile
 from StringIO import StringIO
 from contextlib import closing
 
+from fabric.context_managers import hide, settings
 from fabric.contrib import files
-from fabric.decorators import task, serial
+from fabric.decorators import runs_once, task
 from fabric.operations import get, sudo
 from fabric.state import env
+from fabric.tasks import execute
 from fabric.utils import abort, warn
 
 import prestoadmin.deploy
 from prestoadmin.standalone.config import StandaloneConfig
-from prestoadmin.util import constants
+from prestoadmin.util import backup_store, constants, fold, stream
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util.fabricapi import get_coordinator_role, \
+    get_host_list, prepared_by
+from prestoadmin.util.journal import resumable
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_catalog_directory, \
+    get_config_directory
 from prestoadmin.util.constants import CONFIG_PROPERTIES, LOG_PROPERTIES, \
     JVM_CONFIG, NODE_PROPERTIES
 
 __all__ = ['show']
 
 ALL_CONFIG = [CONFIG_PROPERTIES, LOG_PROPERTIES, JVM_CONFIG, NODE_PROPERTIES]
+CONFIG_TYPES = {'node': NODE_PROPERTIES, 'jvm': JVM_CONFIG,
+                'config': CONFIG_PROPERTIES, 'log': LOG_PROPERTIES}
 
 _LOGGER = logging.getLogger(__name__)
 
-__all__ = ['deploy', 'show']
+__all__ = ['backup', 'deploy', 'diff', 'restore', 'show']
+
+MANIFEST_SEPARATOR = '--presto-admin-hashes--'
+# Where the configuration of the hosts being upgraded is streamed to
+CONFIG_TAR_DIR_NAME = 'upgrade'
+
+# The snapshot to restore, found once by prepare_restore
+_restore_snapshot = None
 
 
 @task
+@prepared_by(prestoadmin.deploy.prepare_role_confs)
+@resumable
 @requires_config(StandaloneConfig)
 def deploy(rolename=None):
     """
@@ -74,6 +99,344 @@ def deploy(rolename=None):
             abort("Invalid Argument. Possible values: coordinator, workers")
 
 
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def diff():
+    """
+    Show how the configuration deployed on each node differs from the local
+    configuration, as unified diffs.
+
+    The files in /etc/presto and /etc/presto/catalog are hashed on all the
+    nodes in parallel, and the nodes whose files have the same hashes are
+    grouped. Only the files that differ are fetched, from one node of each
+    group. The node.id of node.properties is left out, since it is set on
+    each node.
+    """
+    prestoadmin.deploy.prepare_role_confs()
+    catalog_files = read_local_catalogs()
+    hashes_by_host = execute(get_remote_hashes, hosts=get_host_list())
+
+    groups = {}
+    for host, hashes in hashes_by_host.items():
+        if not isinstance(hashes, dict):
+            warn('Could not hash the configuration files on %s' % host)
+            continue
+        expected = expected_files(host, catalog_files)
+        key = (host_role(host), tuple(sorted(
+            manifest(expected, hashes).items())))
+        groups.setdefault(key, []).append(host)
+
+    up_to_date = []
+    to_fetch = {}
+    for (role, host_manifest), hosts in groups.items():
+        host = min(hosts, key=fold.natural_key)
+        expected = expected_files(host, catalog_files)
+        differing = differing_files(expected, dict(host_manifest))
+        if differing:
+            to_fetch[host] = (hosts, expected, differing)
+        else:
+            up_to_date.extend(hosts)
+
+    fetched = {}
+    if to_fetch:
+        fetched = execute(fetch_files, dict(
+            (host, names) for host, (_, _, names) in to_fetch.items()),
+            hosts=sorted(to_fetch, key=fold.natural_key))
+    for host in sorted(to_fetch, key=fold.natural_key):
+        hosts, expected, differing = to_fetch[host]
+        remote_files = fetched.get(host)
+        if not isinstance(remote_files, dict):
+            continue
+        print('%s\n%s\n%s' % (fold.SEPARATOR,
+                              ', '.join(fold.compress_hosts(hosts)),
+                              fold.SEPARATOR))
+        for name in differing:
+            print(format_diff(name, expected.get(name),
+                              remote_files.get(name), host))
+    if up_to_date:
+        print('Configuration is up to date on: ' +
+              ', '.join(fold.compress_hosts(up_to_date)))
+
+
+def host_role(host):
+    if host in get_coordinator_role():
+        return 'coordinator'
+    return 'workers'
+
+
+def read_local_catalogs():
+    """
+    Return the content of each local catalog file by its path relative to
+    the remote configuration directory
+    """
+    catalog_subdir = os.path.relpath(constants.REMOTE_CATALOG_DIR,
+                                     constants.REMOTE_CONF_DIR)
+    catalog_dir = get_catalog_directory()
+    catalog_files = {}
+    if not os.path.isdir(catalog_dir):
+        return catalog_files
+    for name in os.listdir(catalog_dir):
+        with open(os.path.join(catalog_dir, name)) as catalog_file:
+            catalog_files[os.path.join(catalog_subdir, name)] = \
+                catalog_file.read()
+    return catalog_files
+
+
+def expected_files(host, catalog_files):
+    """
+    Return the content of each file that the local configuration deploys to
+    host
+    """
+    expected = prestoadmin.deploy.render_conf(
+        prestoadmin.deploy.get_role_conf(host_role(host)))
+    expected.update(catalog_files)
+    return expected
+
+
+def get_remote_hashes():
+    return prestoadmin.deploy.remote_hashes(constants.REMOTE_CONF_DIR)
+
+
+def manifest(expected, hashes):
+    """
+    Return the hash of each file of the host with the given remote hashes
+    that is compared with the expected files, which is the same on the hosts
+    whose configuration is the same: None for the expected files that are
+    missing, and the node.properties hash without the node.id
+    """
+    result = dict((name, hashes.get(prestoadmin.deploy.hash_name(name,
+                                                                 content)))
+                  for name, content in expected.items())
+    for name, digest in hashes.items():
+        if name not in expected and os.path.basename(name) not in \
+                (NODE_PROPERTIES, prestoadmin.deploy.WITHOUT_NODE_ID):
+            result[name] = digest
+    return result
+
+
+def differing_files(expected, host_manifest):
+    return sorted(name for name, digest in host_manifest.items()
+                  if name not in expected or digest !=
+                  hashlib.sha256(expected[name]).hexdigest())
+
+
+def fetch_files(names_by_host):
+    """
+    Return the content of the files names_by_host gives for the current
+    host, by their path relative to the remote configuration directory, or
+    None for the files it does not have
+    """
+    contents = {}
+    for name in names_by_host[env.host]:
+        with closing(StringIO()) as file_content_buffer:
+            remote_path = os.path.join(constants.REMOTE_CONF_DIR, name)
+            if files.exists(remote_path, use_sudo=True):
+                get(remote_path, file_content_buffer, use_sudo=True)
+                contents[name] = file_content_buffer.getvalue()
+            else:
+                contents[name] = None
+    return contents
+
+
+def format_diff(name, local_content, remote_content, host):
+    """
+    Return the unified diff of the local file name to that on host, without
+    the node.id of node.properties unless the local file sets it
+    """
+    if local_content is not None and remote_content is not None and \
+            os.path.basename(name) == NODE_PROPERTIES and \
+            not prestoadmin.deploy.sets_node_id(local_content):
+        remote_content = ''.join(
+            line for line in remote_content.splitlines(True)
+            if not line.startswith('node.id='))
+    return ''.join(difflib.unified_diff(
+        (local_content or '').splitlines(True),
+        (remote_content or '').splitlines(True),
+        'local/' + name if local_content is not None else '/dev/null',
+        '%s/%s' % (host, name) if remote_content is not None
+        else '/dev/null')).rstrip('\n')
+
+
+@task
+@runs_once
+@requires_config(StandaloneConfig)
+def backup():
+    """
+    Back up the configuration directory /etc/presto of every node to a new
+    snapshot on the host running presto-admin.
+
+    The content of the files is stored by its hash under
+    ~/.prestoadmin/backups, once however many nodes and snapshots have it,
+    and only the files whose content is not stored yet are fetched. Use
+    configuration restore to restore a snapshot.
+    """
+    snapshot = backup_store.new_snapshot()
+    execute(backup_host, snapshot, hosts=get_host_list())
+    print('Configuration backed up to snapshot ' + snapshot)
+
+
+def prepare_restore(snapshot=None):
+    """
+    Find the snapshot to restore, the latest one by default, before any
+    node is changed
+    """
+    global _restore_snapshot
+    _restore_snapshot = find_snapshot(snapshot)
+
+
+def find_snapshot(snapshot=None):
+    if snapshot is None:
+        snapshot = backup_store.latest_snapshot()
+        if snapshot is None:
+            abort('There is no configuration backup to restore. Run '
+                  'configuration backup first.')
+    elif not backup_store.has_snapshot(snapshot):
+        abort('No configuration backup %s. The backups are: %s' % (
+            snapshot, ', '.join(backup_store.list_snapshots()) or 'none'))
+    return snapshot
+
+
+@task
+@prepared_by(prepare_restore)
+@resumable
+@requires_config(StandaloneConfig)
+def restore(snapshot=None):
+    """
+    Restore the configuration directory /etc/presto of the nodes from a
+    snapshot taken by configuration backup or server upgrade, on all the
+    nodes in parallel. The files that are not in the snapshot are removed.
+
+    Parameters:
+        snapshot - (optional) the snapshot to restore. The latest one is
+            restored if not specified.
+    """
+    snapshot = _restore_snapshot or find_snapshot(snapshot)
+    entries = backup_store.read_manifest(snapshot, env.host)
+    if entries is None:
+        warn('Snapshot %s has no configuration for %s' % (snapshot, env.host))
+        return
+    print('Restoring configuration snapshot %s on: %s' % (snapshot,
+                                                          env.host))
+    bundle_path = build_snapshot_bundle(entries)
+    try:
+        prestoadmin.deploy.deploy_bundle(bundle_path,
+                                         constants.REMOTE_CONF_DIR,
+                                         keep_existing=False)
+    finally:
+        os.remove(bundle_path)
+
+
+def backup_host(snapshot):
+    """
+    Record the configuration directory of the current host in snapshot,
+    fetching the files whose content is not stored yet
+    """
+    entries = get_remote_manifest()
+    missing = dict((entry['sha256'], entry['path']) for entry in entries
+                   if entry['type'] == 'f' and
+                   not backup_store.has_blob(entry['sha256']))
+    if missing:
+        stored = fetch_blobs(sorted(missing.values()))
+        changed = set(missing) - stored
+        if changed:
+            abort('The files %s on %s changed while being backed up' % (
+                ', '.join(sorted(missing[digest] for digest in changed)),
+                env.host))
+    backup_store.write_manifest(snapshot, env.host, entries)
+    _LOGGER.info('Backed up %d files of %s, %d of them new' % (
+        sum(1 for entry in entries if entry['type'] == 'f'), env.host,
+        len(missing)))
+    return snapshot
+
+
+def get_remote_manifest():
+    """
+    Return the entries of the files and directories in the configuration
+    directory of the current host, for backup_store.write_manifest
+    """
+    with settings(hide('stdout'), warn_only=True):
+        result = sudo(
+            "cd {dir} && find . -mindepth 1 -printf '%y %m %u:%g %P\\n' && "
+            "echo {separator} && find . -type f -exec sha256sum {{}} +".format(
+                dir=constants.REMOTE_CONF_DIR, separator=MANIFEST_SEPARATOR))
+    if result.failed:
+        abort('Could not list the configuration files in %s on %s' %
+              (constants.REMOTE_CONF_DIR, env.host))
+    listing, _, hashes = result.partition(MANIFEST_SEPARATOR)
+    digests = {}
+    for line in hashes.splitlines():
+        digest, _, path = line.strip().partition('  ./')
+        if path:
+            digests[path] = digest
+    entries = []
+    for line in listing.splitlines():
+        parts = line.strip().split(' ', 3)
+        if len(parts) != 4:
+            continue
+        file_type, mode, owner, path = parts
+        if file_type == 'f' and path in digests:
+            entries.append({'path': path, 'type': 'f', 'mode': mode,
+                            'owner': owner, 'sha256': digests[path]})
+        elif file_type == 'd':
+            entries.append({'path': path, 'type': 'd', 'mode': mode,
+                            'owner': owner})
+        else:
+            _LOGGER.info('Not backing up %s on %s, which is not a regular '
+                         'file or a directory' % (path, env.host))
+    return entries
+
+
+def fetch_blobs(paths):
+    """
+    Fetch the files at paths in the configuration directory of the current
+    host into the backup store, as one archive, and return their hashes
+    """
+    result = sudo(
+        'tarfile=`mktemp /tmp/presto_backup-XXXXXXX.tar.gz`; '
+        'tar -c -z -C %s -f "${tarfile}" -- %s && echo "${tarfile}"' % (
+            constants.REMOTE_CONF_DIR,
+            ' '.join(pipes.quote(path) for path in paths)))
+    remote_tar = result.splitlines()[-1].strip()
+    fd, local_tar = tempfile.mkstemp(suffix='.tar.gz')
+    os.close(fd)
+    try:
+        get(remote_tar, local_tar, use_sudo=True)
+        sudo('rm -f "%s"' % remote_tar)
+        stored = set()
+        with closing(tarfile.open(local_tar)) as archive:
+            for member in archive:
+                if member.isfile():
+                    stored.add(backup_store.add_blob(
+                        archive.extractfile(member).read()))
+        return stored
+    finally:
+        os.remove(local_tar)
+
+
+def build_snapshot_bundle(entries):
+    """
+    Write the files of a snapshot to a local archive, with their modes and
+    owners, and return its path
+    """
+    fd, bundle_path = tempfile.mkstemp(suffix='.tar.gz')
+    with os.fdopen(fd, 'wb') as bundle_file:
+        with closing(tarfile.open(fileobj=bundle_file,
+                                  mode='w:gz')) as archive:
+            for entry in sorted(entries, key=lambda item: item['path']):
+                info = tarfile.TarInfo(entry['path'])
+                info.mode = int(entry['mode'], 8)
+                info.uname, _, info.gname = entry['owner'].partition(':')
+                if entry['type'] == 'd':
+                    info.type = tarfile.DIRTYPE
+                    archive.addfile(info)
+                else:
+                    content = backup_store.read_blob(entry['sha256'])
+                    info.size = len(content)
+                    archive.addfile(info, StringIO(content))
+    return bundle_path
+
+
 """
 gather/deploy_config_directory are used for server upgrade when we want to
 preserve any existing configuration files across the upgrade exactly as they
@@ -99,7 +462,21 @@ def gather_config_directory():
     archive larger than we can fit in a single bash command (~2MB on a
     good day), meaning if /etc/presto contains any large files, we'd end
     up having to send the archive to a temp file anyway.
+
+    That last one is no longer true of the hosts that commands can be
+    streamed to: the archive is streamed into a local file instead, and the
+    local path is returned.
     """
+    if stream.can_stream():
+        local_tar = _local_config_tar()
+        ensure_directory_exists(os.path.dirname(local_tar))
+        result = stream.stream_out('tar -c -z -C %s .' % (
+            constants.REMOTE_CONF_DIR,), local_tar)
+        if result.failed:
+            abort('Could not archive the configuration of %s: %s' %
+                  (env.host, result))
+        return local_tar
+
     result = sudo(
         'tarfile=`mktemp /tmp/presto_config-XXXXXXX.tar`; '
         'tar -c -z -C %s -f "${tarfile}" . && echo "${tarfile}"' % (
@@ -107,7 +484,20 @@ def gather_config_directory():
     return result
 
 
+def _local_config_tar():
+    return os.path.join(get_config_directory(), CONFIG_TAR_DIR_NAME,
+                        env.host + '.tar.gz')
+
+
 def deploy_config_directory(tarfile):
+    if tarfile == _local_config_tar():
+        result = stream.stream_in(tarfile, 'tar -C "%s" -x -z' % (
+            constants.REMOTE_CONF_DIR,))
+        if result.failed:
+            abort('Could not restore the configuration of %s: %s' %
+                  (env.host, result))
+        os.remove(tarfile)
+        return
     sudo('tar -C "%s" -x -v -f "%s" ; rm "%s"' %
          (constants.REMOTE_CONF_DIR, tarfile, tarfile))
 
@@ -125,20 +515,41 @@ def configuration_fetch(file_name, config_destination, should_warn=True):
 
 
 def configuration_show(file_name, should_warn=True):
+    """
+    Return the text that shows the configuration file file_name of the
+    current host, or None if it has none
+    """
     with closing(StringIO()) as file_content_buffer:
         file_path = configuration_fetch(file_name, file_content_buffer,
                                         should_warn)
         if file_path is None:
-            return
+            return None
         config_values = file_content_buffer.getvalue()
-        file_content_buffer.close()
-        print ("\n%s: Configuration file at %s:" % (env.host, file_path))
-        print config_values
+    if fold.is_enabled():
+        # The host is in the header of the folded output
+        return "\nConfiguration file at %s:\n%s\n" % (
+            file_path, config_values)
+    return "\n%s: Configuration file at %s:\n%s\n" % (
+        env.host, file_path, config_values)
+
+
+def gather_configuration(files_to_show):
+    """
+    Return the text that shows the configuration files of the current host,
+    for the parent process to print
+
+    Parameters:
+        files_to_show - a list of (file name, whether to warn if it is
+            missing)
+    """
+    shown = [configuration_show(file_name, should_warn)
+             for file_name, should_warn in files_to_show]
+    return ''.join(text for text in shown if text is not None)
 
 
 @task
+@runs_once
 @requires_config(StandaloneConfig)
-@serial
 def show(config_type=None):
     """
     Print to the user the contents of the configuration files deployed
@@ -147,25 +558,29 @@ def show(config_type=None):
     printed.  No warning will be printed for a missing log.properties since
     it is not a required configuration file.
 
+    The files are fetched from the nodes in parallel and printed by node,
+    in the order of the nodes in the topology.
+
     Parameters:
         config_type: [node|jvm|config|log]
     """
-    file_name = ''
     if config_type is None:
-        configuration_show(NODE_PROPERTIES)
-        configuration_show(JVM_CONFIG)
-        configuration_show(CONFIG_PROPERTIES)
-        configuration_show(LOG_PROPERTIES, should_warn=False)
+        files_to_show = [(NODE_PROPERTIES, True), (JVM_CONFIG, True),
+                         (CONFIG_PROPERTIES, True), (LOG_PROPERTIES, False)]
+    elif config_type.lower() in CONFIG_TYPES:
+        files_to_show = [(CONFIG_TYPES[config_type.lower()], True)]
     else:
-        if config_type.lower() == 'node':
-            file_name = NODE_PROPERTIES
-        elif config_type.lower() == 'jvm':
-            file_name = JVM_CONFIG
-        elif config_type.lower() == 'config':
-            file_name = CONFIG_PROPERTIES
-        elif config_type.lower() == 'log':
-            file_name = LOG_PROPERTIES
-        else:
-            abort("Invalid Argument. Possible values: node, jvm, config, log")
+        abort("Invalid Argument. Possible values: node, jvm, config, log")
+        return
 
-        configuration_show(file_name)
+    hosts = get_host_list()
+    results = execute(gather_configuration, files_to_show, hosts=hosts)
+    for host in hosts:
+        output = results.get(host)
+        if not isinstance(output, basestring):
+            continue
+        if fold.is_enabled():
+            fold.add_output(output, host=host)
+            fold.end_host(host)
+        else:
+            sys.stdout.write(output)
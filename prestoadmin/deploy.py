@@ -17,23 +17,82 @@
 Common module for deploying the presto configuration
 """
 
+import hashlib
 import logging
 import os
-
-from fabric.contrib import files
-from fabric.context_managers import settings
-from fabric.contrib.files import exists
-from fabric.operations import sudo, abort
+import tarfile
+import tempfile
+import time
+from StringIO import StringIO
+from contextlib import closing
+
+from fabric.context_managers import hide, settings
+from fabric.operations import put, sudo, abort
 from fabric.api import env
 
-from prestoadmin.util import constants
+from prestoadmin.util import constants, tracing
 from prestoadmin.standalone.config import PRESTO_STANDALONE_USER_GROUP
+from prestoadmin.util.exception import ConfigurationError
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_config_directory
 import coordinator as coord
 import prestoadmin.util.fabricapi as util
 import workers as w
 
 _LOGGER = logging.getLogger(__name__)
 
+BUNDLE_DIR_NAME = 'bundles'
+# Bundles are named by their content, and removed after this many seconds
+BUNDLE_MAX_AGE = 24 * 60 * 60
+MISSING_OWNER_CODE = 42
+# Name under which remote_hashes gives the hash of node.properties without
+# its node.id
+WITHOUT_NODE_ID = 'node.properties#without-node.id'
+
+
+# The configuration of each role, rendered and validated in the parent
+# process before a task is dispatched to the hosts. The processes that run
+# the task on each host inherit it rather than each reading the local
+# configuration directory again.
+_role_confs = {}
+
+
+def prepare_role_confs(rolename=None):
+    """
+    Render and validate the configuration of the roles that have hosts to
+    deploy it to, or of rolename only, and abort on an invalid configuration
+    before connecting to any host. Default files are written for the missing
+    ones here, once.
+
+    Parameters:
+        rolename - [coordinator|workers]; any other value is left for the
+            task to reject
+    """
+    _role_confs.clear()
+    roles = ['coordinator', 'workers'] if rolename is None \
+        else [rolename.lower()]
+    try:
+        if 'coordinator' in roles and util.get_coordinator_role():
+            _role_confs['coordinator'] = coord.Coordinator().get_conf()
+        # Workers that are also the coordinator get its configuration
+        if 'workers' in roles and set(util.get_worker_role()) - \
+                set(util.get_coordinator_role()):
+            _role_confs['workers'] = w.Worker().get_conf()
+    except ConfigurationError as e:
+        abort(e.message)
+
+
+def get_role_conf(rolename):
+    """
+    Return the configuration of rolename, as prepared by prepare_role_confs,
+    or read now if it was not
+    """
+    if rolename in _role_confs:
+        return _role_confs[rolename]
+    if rolename == 'coordinator':
+        return coord.Coordinator().get_conf()
+    return w.Worker().get_conf()
+
 
 def coordinator():
     """
@@ -41,10 +100,41 @@ def coordinator():
     """
     if env.host in util.get_coordinator_role():
         _LOGGER.info("Setting coordinator configuration for " + env.host)
-        configure_presto(coord.Coordinator().get_conf(),
+        configure_presto(get_role_conf('coordinator'),
                          constants.REMOTE_CONF_DIR)
 
 
+def role_conf():
+    """
+    Return the configuration of the role of the current host, the
+    coordinator configuration if it is both a coordinator and a worker, or
+    None if it is neither
+    """
+    if env.host in util.get_coordinator_role():
+        return get_role_conf('coordinator')
+    if env.host in util.get_worker_role():
+        return get_role_conf('workers')
+    return None
+
+
+def role_bundle(catalog_dir, catalog_names):
+    """
+    Deploy the configuration of the role of the current host along with the
+    catalogs catalog_names in catalog_dir, as one bundle
+    """
+    conf = role_conf()
+    bundle_files = render_conf(conf) if conf is not None else {}
+    catalog_subdir = os.path.relpath(constants.REMOTE_CATALOG_DIR,
+                                     constants.REMOTE_CONF_DIR)
+    for name in catalog_names:
+        with open(os.path.join(catalog_dir, name)) as catalog_file:
+            bundle_files[os.path.join(catalog_subdir, name)] = \
+                catalog_file.read()
+    print("Deploying configuration on: " + env.host)
+    with tracing.phase('configure'):
+        deploy_bundle(build_bundle(bundle_files), constants.REMOTE_CONF_DIR)
+
+
 def workers():
     """
     Deploy workers configuration to the worker nodes.
@@ -53,14 +143,224 @@ def workers():
     if env.host in util.get_worker_role() and env.host \
             not in util.get_coordinator_role():
         _LOGGER.info("Setting worker configuration for " + env.host)
-        configure_presto(w.Worker().get_conf(), constants.REMOTE_CONF_DIR)
+        configure_presto(get_role_conf('workers'), constants.REMOTE_CONF_DIR)
 
 
 def configure_presto(conf, remote_dir):
     print("Deploying configuration on: " + env.host)
-    deploy(dict((name, output_format(content)) for (name, content)
-                in conf.iteritems() if name != "node.properties"), remote_dir)
-    deploy_node_properties(output_format(conf['node.properties']), remote_dir)
+    with tracing.phase('configure'):
+        deploy_changed(render_conf(conf), remote_dir)
+
+
+def render_conf(conf):
+    """
+    Return the content of each configuration file in conf
+    """
+    return dict((name, output_format(content) + '\n')
+                for (name, content) in conf.iteritems())
+
+
+def build_bundle(bundle_files, user_group=PRESTO_STANDALONE_USER_GROUP,
+                 mode=0600):
+    """
+    Write the files to a local archive, owned by user_group and with the
+    given mode, and return its path. The archive is named by its content, so
+    the hosts that get the same files share the one archive.
+
+    Parameters:
+        bundle_files - a dictionary of the path of each file in the archive to
+            its content
+    """
+    digest = hashlib.sha1(user_group + oct(mode))
+    for name in sorted(bundle_files):
+        digest.update('%s\0%d\0%s' % (name, len(bundle_files[name]),
+                                      bundle_files[name]))
+    bundle_dir = os.path.join(get_config_directory(), BUNDLE_DIR_NAME)
+    bundle_path = os.path.join(bundle_dir, digest.hexdigest() + '.tar.gz')
+    if os.path.exists(bundle_path):
+        return bundle_path
+
+    ensure_directory_exists(bundle_dir)
+    remove_old_bundles(bundle_dir)
+    user, group = user_group.split(':')
+    fd, temp_path = tempfile.mkstemp(dir=bundle_dir)
+    with os.fdopen(fd, 'wb') as bundle_file:
+        with closing(tarfile.open(fileobj=bundle_file,
+                                  mode='w:gz')) as archive:
+            directories = set()
+            for name in sorted(bundle_files):
+                parent = os.path.dirname(name)
+                while parent and parent not in directories:
+                    directories.add(parent)
+                    archive.addfile(_tar_info(parent, user, group, 0755,
+                                              tarfile.DIRTYPE))
+                    parent = os.path.dirname(parent)
+                info = _tar_info(name, user, group, mode, tarfile.REGTYPE)
+                info.size = len(bundle_files[name])
+                archive.addfile(info, StringIO(bundle_files[name]))
+    # Other processes deploying the same files may be writing it too
+    os.rename(temp_path, bundle_path)
+    return bundle_path
+
+
+def _tar_info(name, user, group, mode, file_type):
+    info = tarfile.TarInfo(name)
+    info.type = file_type
+    info.mode = mode
+    info.uname = user
+    info.gname = group
+    info.mtime = time.time()
+    return info
+
+
+def remove_old_bundles(bundle_dir):
+    now = time.time()
+    for name in os.listdir(bundle_dir):
+        path = os.path.join(bundle_dir, name)
+        try:
+            if now - os.path.getmtime(path) > BUNDLE_MAX_AGE:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def remote_hashes(remote_dir):
+    """
+    Return the sha256 of each file under remote_dir on the current host, by
+    its path relative to remote_dir, or None if they could not be hashed.
+    The node.properties hash leaves out the node.id, which is set on the
+    host rather than deployed.
+    """
+    command = (
+        "cd {dir} 2>/dev/null || exit 0; "
+        "find . -type f -exec sha256sum {{}} + || exit 1; "
+        "if [ -f node.properties ]; then "
+        "echo \"$(sed '/^node.id=/d' node.properties | sha256sum "
+        "| cut -d ' ' -f 1)  ./{without_node_id}\"; fi").format(
+            dir=remote_dir, without_node_id=WITHOUT_NODE_ID)
+    with settings(hide('stdout', 'running'), warn_only=True):
+        result = sudo(command)
+    if result.failed:
+        _LOGGER.info('Could not hash the files in %s on %s' %
+                     (remote_dir, env.host))
+        return None
+    hashes = {}
+    for line in result.splitlines():
+        digest, _, path = line.strip().partition('  ./')
+        if path:
+            hashes[path] = digest
+    return hashes
+
+
+def changed_files(bundle_files, hashes):
+    """
+    Return the names of the bundle files whose content differs from the
+    remote files with the given hashes, or that are missing
+    """
+    changed = []
+    for name, content in bundle_files.iteritems():
+        if hashes.get(hash_name(name, content)) != \
+                hashlib.sha256(content).hexdigest():
+            changed.append(name)
+    return sorted(changed)
+
+
+def hash_name(name, content):
+    """
+    Return the name under which remote_hashes gives the hash to compare with
+    the file name with the given content
+    """
+    if os.path.basename(name) == 'node.properties' and \
+            not sets_node_id(content):
+        return os.path.join(os.path.dirname(name), WITHOUT_NODE_ID)
+    return name
+
+
+def sets_node_id(content):
+    return any(line.startswith('node.id=') for line in content.splitlines())
+
+
+def deploy_changed(bundle_files, remote_dir,
+                   user_group=PRESTO_STANDALONE_USER_GROUP, mode=0600):
+    """
+    Deploy the bundle files whose content differs from that of the files in
+    remote_dir on the current host, and leave remote_dir alone if none do.
+    Return the names of the files deployed.
+    """
+    hashes = remote_hashes(remote_dir)
+    changed = sorted(bundle_files) if hashes is None \
+        else changed_files(bundle_files, hashes)
+    if not changed:
+        _LOGGER.info('Configuration is up to date on: ' + env.host)
+        return []
+    _LOGGER.info('Updating %s on: %s' % (', '.join(changed), env.host))
+    deploy_bundle(build_bundle(dict((name, bundle_files[name])
+                                    for name in changed),
+                               user_group, mode),
+                  remote_dir, user_group)
+    return changed
+
+
+def deploy_bundle(bundle_path, remote_dir,
+                  user_group=PRESTO_STANDALONE_USER_GROUP, keep_existing=True):
+    """
+    Transfer the bundle to the current host and replace remote_dir with a
+    copy of it with the bundle extracted over it, so that the files of the
+    bundle all change together. The files in remote_dir that are not in the
+    bundle are kept, unless keep_existing is False, and so is the node.id of
+    the node.properties in remote_dir, or a new one is generated, unless the
+    bundle sets it.
+
+    The copy keeps the owner and mode of remote_dir; a new remote_dir is
+    owned by root with mode 755, as mkdir would make it. The copy replaces
+    remote_dir with two renames, moving remote_dir aside and then the copy
+    in its place, as there is no portable way to swap two directories at
+    once. Between the renames, which take no time next to the copy, there
+    is no remote_dir, but never a partly updated one, and if the command
+    is killed in between the previous remote_dir is left next to it with a
+    .old suffix.
+    """
+    _LOGGER.info('Deploying bundle %s to %s' % (bundle_path, remote_dir))
+    user, group = user_group.split(':')
+    remote_bundle = os.path.join(constants.REMOTE_COPY_DIR,
+                                 'presto-admin-' +
+                                 os.path.basename(bundle_path))
+    put(bundle_path, remote_bundle)
+    node_properties = os.path.join(remote_dir, 'node.properties')
+    command = (
+        "getent passwd {user} >/dev/null || exit {missing_owner_code}; "
+        "set -e; "
+        "staging=$(mktemp -d {parent}/.{base}.staging-XXXXXX); "
+        "trap 'rm -rf \"$staging\" {bundle}' EXIT; "
+        "if {keep_existing} && [ -d {dir} ]; then "
+        "cp -a {dir}/. \"$staging\"; fi; "
+        "node_id=$(sed -n 's/^node.id=//p' {node_properties} 2>/dev/null "
+        "| head -n 1); "
+        "tar -C \"$staging\" --same-owner -x -z -f {bundle}; "
+        "if tar -t -z -f {bundle} | grep -q -x node.properties && "
+        "! grep -q '^node.id=' \"$staging/node.properties\"; then "
+        "[ -n \"$node_id\" ] || node_id=$(uuidgen); "
+        "sed -i \"1i node.id=$node_id\" \"$staging/node.properties\"; fi; "
+        "if [ -d {dir} ]; then chown --reference={dir} \"$staging\"; "
+        "chmod --reference={dir} \"$staging\"; "
+        "else chmod 755 \"$staging\"; fi; "
+        "if [ -d {dir} ]; then mv {dir} \"$staging.old\"; fi; "
+        "mv \"$staging\" {dir}; "
+        "rm -rf \"$staging.old\"").format(
+            user=user, bundle=remote_bundle,
+            dir=remote_dir, parent=os.path.dirname(remote_dir),
+            base=os.path.basename(remote_dir),
+            node_properties=node_properties,
+            missing_owner_code=MISSING_OWNER_CODE,
+            keep_existing='true' if keep_existing else 'false')
+
+    with settings(warn_only=True):
+        result = sudo(command)
+    if result.return_code == MISSING_OWNER_CODE:
+        abort("User %s does not exist. Make sure the Presto server RPM "
+              "is installed and try again" % user)
+    elif result.failed:
+        abort("Failed to deploy the configuration to %s" % remote_dir)
 
 
 def output_format(conf):
@@ -89,84 +389,3 @@ def key_val_to_equal(items):
 def list_to_line_separated(conf):
     assert not isinstance(conf, basestring)
     return "\n".join(conf)
-
-
-def deploy(confs, remote_dir):
-    _LOGGER.info("Deploying configurations for " + str(confs.keys()))
-    sudo("mkdir -p " + remote_dir)
-    for name, content in confs.iteritems():
-        write_to_remote_file(content, os.path.join(remote_dir, name),
-                             owner=PRESTO_STANDALONE_USER_GROUP, mode=600)
-
-
-def secure_create_file(filepath, user_group, mode=600):
-    user, group = user_group.split(':')
-    missing_owner_code = 42
-    command = \
-        "( getent passwd {user} >/dev/null || exit {missing_owner_code} ) &&" \
-        " echo '' > {filepath} && " \
-        "chown {user_group} {filepath} && " \
-        "chmod {mode} {filepath} ".format(
-            filepath=filepath, user=user, user_group=user_group, mode=mode,
-            missing_owner_code=missing_owner_code)
-
-    with settings(warn_only=True):
-        result = sudo(command)
-        if result.return_code == missing_owner_code:
-            abort("User %s does not exist. Make sure the Presto server RPM "
-                  "is installed and try again" % user)
-        elif result.failed:
-            abort("Failed to securely create file %s" % (filepath))
-
-
-def secure_create_directory(filepath, user_group, mode=755):
-    user, group = user_group.split(':')
-    missing_owner_code = 42
-    command = \
-        "( getent passwd {user} >/dev/null || exit {missing_owner_code} ) && " \
-        "mkdir -p {filepath} && " \
-        "chown {user_group} {filepath} && " \
-        "chmod {mode} {filepath} ".format(
-            filepath=filepath, user=user, user_group=user_group, mode=mode,
-            missing_owner_code=missing_owner_code)
-
-    with settings(warn_only=True):
-        result = sudo(command)
-        if result.return_code == missing_owner_code:
-            abort("User %s does not exist. Make sure the Presto server RPM "
-                  "is installed and try again" % user)
-        elif result.failed:
-            abort("Failed to securely create file %s" % (filepath))
-
-
-def deploy_node_properties(content, remote_dir):
-    _LOGGER.info("Deploying node.properties configuration")
-    name = "node.properties"
-    node_file_path = (os.path.join(remote_dir, name))
-    if not exists(node_file_path, use_sudo=True):
-        secure_create_file(node_file_path, PRESTO_STANDALONE_USER_GROUP, mode=600)
-    else:
-        sudo('chown %(owner)s %(filepath)s && chmod %(mode)s %(filepath)s'
-             % {'owner': PRESTO_STANDALONE_USER_GROUP, 'mode': 600, 'filepath': node_file_path})
-    node_id_command = (
-        "if ! ( grep -q -s 'node.id' " + node_file_path + " ); then "
-        "uuid=$(uuidgen); "
-        "echo node.id=$uuid >> " + node_file_path + ";"
-        "fi; "
-        "sed -i '/node.id/!d' " + node_file_path + "; "
-        )
-    sudo(node_id_command)
-    files.append(os.path.join(remote_dir, name), content, True, shell=True)
-
-
-def write_to_remote_file(text, filepath, owner, mode=600):
-    secure_create_file(filepath, owner, mode)
-    command = "echo '{text}' > {filepath}".format(
-        text=escape_single_quotes(text), filepath=filepath)
-    sudo(command)
-
-
-def escape_single_quotes(text):
-    # replace a single quote with a (closing) single quote followed by
-    # an escaped quote followed by an (opening) single quote
-    return text.replace(r"'", r"'\''")
@@ -14,9 +14,13 @@
 #
 
 """Monkey patches needed to change logging and error handling in Fabric"""
-import traceback
-import sys
+import glob
 import logging
+import os
+import Queue
+import sys
+import time
+import traceback
 from traceback import format_exc
 
 from fabric import state
@@ -29,9 +33,15 @@ from fabric.utils import error
 import fabric.api
 import fabric.operations
 import fabric.tasks
-from fabric.network import needs_host, to_dict, disconnect_all
+from fabric.network import needs_host, normalize, to_dict, disconnect_all, \
+    ssh
+import fabric.network
 
-from prestoadmin.util import exception
+from prestoadmin.util import exception, fold, journal, progress, \
+    queue_logging, reachability, tracing
+from prestoadmin.util.concurrency import ConcurrencyController
+from prestoadmin.util.host_history import HostHistory, estimate_remaining, \
+    format_duration
 
 
 _LOGGER = logging.getLogger(__name__)
@@ -39,6 +49,9 @@ old_warn = fabric.utils.warn
 old_abort = fabric.utils.abort
 old_run = fabric.operations.run
 old_sudo = fabric.operations.sudo
+old_put = fabric.operations.put
+old_get = fabric.operations.get
+old_connect = fabric.network.connect
 
 
 # Need to monkey patch Fabric's warn method in order to print out
@@ -68,10 +81,12 @@ fabric.api.abort = abort
 def run(command, shell=True, pty=True, combine_stderr=None, quiet=False,
         warn_only=False, stdout=None, stderr=None, timeout=None,
         shell_escape=None):
-    out = old_run(command, shell=shell, pty=pty,
-                  combine_stderr=combine_stderr, quiet=quiet,
-                  warn_only=warn_only, stdout=stdout, stderr=stderr,
-                  timeout=timeout, shell_escape=shell_escape)
+    with tracing.operation_span('run', 'command', fabric.api.env.host_string,
+                                command=command):
+        out = old_run(command, shell=shell, pty=pty,
+                      combine_stderr=combine_stderr, quiet=quiet,
+                      warn_only=warn_only, stdout=stdout, stderr=stderr,
+                      timeout=timeout, shell_escape=shell_escape)
     log_output(out)
     return out
 
@@ -84,10 +99,13 @@ fabric.api.run = run
 def sudo(command, shell=True, pty=True, combine_stderr=None, user=None,
          quiet=False, warn_only=False, stdout=None, stderr=None, group=None,
          timeout=None, shell_escape=None):
-    out = old_sudo(command, shell=shell, pty=pty,
-                   combine_stderr=combine_stderr, user=user, quiet=quiet,
-                   warn_only=warn_only, stdout=stdout, stderr=stderr,
-                   group=group, timeout=timeout, shell_escape=shell_escape)
+    with tracing.operation_span('sudo', 'command', fabric.api.env.host_string,
+                                command=command):
+        out = old_sudo(command, shell=shell, pty=pty,
+                       combine_stderr=combine_stderr, user=user,
+                       quiet=quiet, warn_only=warn_only, stdout=stdout,
+                       stderr=stderr, group=group, timeout=timeout,
+                       shell_escape=shell_escape)
     log_output(out)
     return out
 
@@ -96,14 +114,84 @@ fabric.operations.sudo = sudo
 fabric.api.sudo = sudo
 
 
+# Monkey patch put, get and the SSH connection so that they can be traced.
+def put(*args, **kwargs):
+    with tracing.operation_span('put', 'transfer',
+                                fabric.api.env.host_string,
+                                paths=[str(arg) for arg in args[:2]]) as span:
+        local_path = args[0] if args else kwargs.get('local_path')
+        size = 0
+        if isinstance(local_path, basestring):
+            size = span.args['bytes'] = _local_size(
+                glob.glob(os.path.expanduser(local_path)))
+        result = old_put(*args, **kwargs)
+    progress.report(transferred=size)
+    return result
+
+
+fabric.operations.put = put
+fabric.api.put = put
+
+
+def get(*args, **kwargs):
+    with tracing.operation_span('get', 'transfer',
+                                fabric.api.env.host_string,
+                                paths=[str(arg) for arg in args[:2]]) as span:
+        local_paths = old_get(*args, **kwargs)
+        span.args['bytes'] = _local_size(local_paths)
+    progress.report(transferred=span.args['bytes'])
+    return local_paths
+
+
+fabric.operations.get = get
+fabric.api.get = get
+
+
+def connect(user, host, port, *args, **kwargs):
+    with tracing.span('connect', 'ssh', port=port,
+                      host=fabric.api.env.host_string or host):
+        return old_connect(user, host, port, *args, **kwargs)
+
+
+fabric.network.connect = connect
+
+
+def _local_size(paths):
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(dir_path, name))
+                            for name in file_names)
+        elif os.path.isfile(path):
+            size += os.path.getsize(path)
+    return size
+
+
+# Output longer than this is truncated in the log, keeping its beginning and
+# its end, so that commands with large output do not flood presto-admin.log
+LOG_OUTPUT_LIMIT = 64 * 1024
+
+
 def log_output(out):
+    if not _LOGGER.isEnabledFor(logging.INFO):
+        return
     _LOGGER.info('\nCOMMAND: ' + out.command + '\nFULL COMMAND: ' +
-                 out.real_command + '\nSTDOUT: ' + out + '\nSTDERR: ' +
-                 out.stderr)
+                 out.real_command + '\nSTDOUT: ' + _truncate(out) +
+                 '\nSTDERR: ' + _truncate(out.stderr))
+
+
+def _truncate(output):
+    if len(output) <= LOG_OUTPUT_LIMIT:
+        return output
+    half = LOG_OUTPUT_LIMIT // 2
+    return '%s\n... [%d characters omitted] ...\n%s' % (
+        output[:half], len(output) - 2 * half, output[-half:])
 
 
 # Monkey patch _execute and execute so that we can handle errors differently
-def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
+def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing,
+             log_queue=None, dashboard=None):
     """
     Primary single-host work body of execute().
     """
@@ -127,19 +215,38 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
         # * nukes the connection cache to prevent shared-access problems
         # * knows how to send the tasks' return value back over a Queue
         # * captures exceptions raised by the task
-        def inner(args, kwargs, queue, name, env):
+        def inner(args, kwargs, queue, name, env, log_queue,
+                  report_progress, send_output, fold_output):
             state.env.update(env)
+            queue_logging.log_to_queue(log_queue)
+            tracing.start_process()
+            if fold_output:
+                fold.set_queue(queue)
+            if report_progress:
+                progress.set_queue(queue)
+            if send_output:
+                # Only the parent writes to the terminal the dashboard is on
+                sys.stdout = progress.QueueWriter(queue, name, 'stdout')
+                sys.stderr = progress.QueueWriter(queue, name, 'stderr')
 
             def submit(result):
                 queue.put({'name': name, 'result': result})
 
             try:
                 state.connections.clear()
-                submit(task.run(*args, **kwargs))
+                with tracing.span(env['command'], 'task', host=name):
+                    result = task.run(*args, **kwargs)
+                _record_task_completion(task, name, env['command'])
+                submit(result)
             except BaseException, e:
                 _LOGGER.error(traceback.format_exc())
                 submit(e)
                 sys.exit(1)
+            finally:
+                tracing.finish_process(name)
+                if send_output:
+                    sys.stdout.close()
+                    sys.stderr.close()
 
         # Stuff into Process wrapper
         kwarg_dict = {
@@ -148,6 +255,10 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
             'queue': queue,
             'name': name,
             'env': local_env,
+            'log_queue': log_queue,
+            'report_progress': dashboard is not None,
+            'send_output': dashboard is not None and dashboard.live,
+            'fold_output': fold.is_enabled(),
         }
         p = multiprocessing.Process(target=inner, kwargs=kwarg_dict)
         # Name/id is host string
@@ -157,15 +268,39 @@ def _execute(task, host, my_env, args, kwargs, jobs, queue, multiprocessing):
     # Handle serial execution
     else:
         with settings(**local_env):
-            return task.run(*args, **kwargs)
+            with tracing.span(my_env['command'], 'task', host=host):
+                result = task.run(*args, **kwargs)
+            _record_task_completion(task, host, my_env['command'])
+            fold.end_host(host)
+            return result
+
+
+def _record_task_completion(task, host, command):
+    # Tasks that run once stand for the whole command rather than for the
+    # host they happen to run on, so they are never skipped on resume
+    if not hasattr(task, 'return_value'):
+        journal.record(host, journal.task_step(command))
 
 
 def execute(task, *args, **kwargs):
     """
     Patched version of fabric's execute task with alternative error handling
     """
+    return dict(execute_iter(task, *args, **kwargs))
+
+
+def execute_iter(task, *args, **kwargs):
+    """
+    Version of execute that yields (host, result) as each host finishes,
+    in the order they finish, instead of returning all the results once
+    every host has finished. This lets the caller start follow-up work for
+    the fast hosts while the slow hosts are still running.
+
+    Hosts that fail are handled like in execute: an abort waits for the
+    hosts still running and then exits. If the caller stops iterating
+    early, the hosts still running are waited for as well.
+    """
     my_env = {'clean_revert': True}
-    results = {}
     # Obtain task
     is_callable = callable(task)
     if not (is_callable or _is_task(task)):
@@ -195,6 +330,12 @@ def execute(task, *args, **kwargs):
                                                                 exclude_hosts,
                                                                 state.env)
 
+    # Work the hosts share is done once here, before any host is contacted
+    prepare = getattr(task, 'pa_prepare_callback', None)
+    if prepare is not None and my_env['all_hosts']:
+        with tracing.span('prepare ' + str(my_env['command']), 'prepare'):
+            prepare(*args, **new_kwargs)
+
     parallel = requires_parallel(task)
     if parallel:
         # Import multiprocessing if needed, erroring out usefully
@@ -217,21 +358,76 @@ def execute(task, *args, **kwargs):
     pool_size = task.get_pool_size(my_env['all_hosts'], state.env.pool_size)
     # Set up job queue in case parallel is needed
     queue = multiprocessing.Queue() if parallel else None
-    jobs = JobQueue(pool_size, queue)
+    # Child processes send their log records to this process through
+    # log_queue so that only this process writes to the log file
+    log_queue = multiprocessing.Queue() if parallel else None
+    # Unless a pool size was given, adapt it to how the hosts are doing
+    controller = None
+    if parallel and not state.env.pool_size and \
+            not getattr(task, 'pool_size', None):
+        controller = ConcurrencyController(len(my_env['all_hosts']))
+    # Start the hosts that took the longest before first
+    history = None
+    if parallel and state.env.get('use_history'):
+        history = HostHistory.load()
+    dashboard = None
+    if parallel and state.env.get('progress'):
+        dashboard = progress.Dashboard(my_env['command'], my_env['all_hosts'])
+    jobs = StreamingJobQueue(pool_size, queue, controller, history,
+                             my_env['command'], dashboard)
     if state.output.debug:
         jobs._debug = True
 
     # Call on host list
+    with tracing.span('execute ' + str(my_env['command']), 'execute',
+                      hosts=len(my_env['all_hosts'])):
+        for host, result in _execute_on_hosts(task, my_env, args, new_kwargs,
+                                              jobs, queue, multiprocessing,
+                                              log_queue, dashboard):
+            yield host, result
+
+
+def _execute_on_hosts(task, my_env, args, new_kwargs, jobs, queue,
+                      multiprocessing, log_queue=None, dashboard=None):
+    """
+    Run the task on every host of my_env, or once locally if there are none,
+    and yield the results as they come
+    """
     if my_env['all_hosts']:
+        # Tasks that run once, like topology show, are serial and often do
+        # not connect to their host at all, so only parallel tasks probe
+        unreachable = {}
+        if queue is not None:
+            unreachable = _find_unreachable_hosts(my_env['all_hosts'])
         # Attempt to cycle on hosts, skipping if needed
         for host in my_env['all_hosts']:
+            if journal.is_done(host, journal.task_step(my_env['command'])):
+                print("[%s] Skipping task '%s', which already completed" %
+                      (host, my_env['command']))
+                if dashboard is not None:
+                    dashboard.finished(host, False)
+                yield host, None
+                continue
+            if host in unreachable:
+                if dashboard is not None:
+                    dashboard.finished(host, True)
+                # Fail the host without waiting for the SSH timeout
+                e = NetworkError(unreachable[host])
+                func = warn if state.env.skip_bad_hosts \
+                    or state.env.warn_only else abort
+                error(e.message, func=func)
+                yield host, e
+                continue
+            # Whether the host failed before a job could be started for it
+            failed = True
             try:
-                results[host] = _execute(
+                result = _execute(
                     task, host, my_env, args, new_kwargs, jobs, queue,
-                    multiprocessing
+                    multiprocessing, log_queue, dashboard
                 )
+                failed = False
             except NetworkError, e:
-                results[host] = e
+                result = e
                 # Backwards compat test re: whether to use an exception or
                 # abort
                 if state.env.skip_bad_hosts or state.env.warn_only:
@@ -240,44 +436,241 @@ def execute(task, *args, **kwargs):
                     func = abort
                 error(e.message, func=func, exception=e.wrapped)
             except SystemExit, e:
-                results[host] = e
+                result = e
 
             # If requested, clear out connections here and not just at the end.
             if state.env.eagerly_disconnect:
                 disconnect_all()
 
-        # If running in parallel, block until job queue is emptied
+            # Parallel hosts only have a result once their job has run,
+            # unless there is no job for them
+            if queue is None or failed:
+                yield host, result
+
+        # If running in parallel, yield the results as the jobs finish
         if jobs:
             jobs.close()
-            # Abort if any children did not exit cleanly (fail-fast).
-            # This prevents Fabric from continuing on to any other tasks.
-            # Otherwise, pull in results from the child run.
-            ran_jobs = jobs.run()
-            for name, d in ran_jobs.iteritems():
-                if d['exit_code'] != 0:
-                    if isinstance(d['results'], NetworkError):
-                        func = warn if state.env.skip_bad_hosts \
-                            or state.env.warn_only else abort
-                        error(d['results'].message,
-                              exception=d['results'].wrapped, func=func)
-                    elif exception.is_arguments_error(d['results']):
-                        raise d['results']
-                    elif isinstance(d['results'], SystemExit):
-                        # System exit indicates abort
-                        pass
-                    elif isinstance(d['results'], BaseException):
-                        error(d['results'].message, exception=d['results'])
-                    else:
-                        error('One or more hosts failed while executing task.')
-                results[name] = d['results']
+            listener = queue_logging.start_listener(log_queue)
+            try:
+                for name, d in jobs.run_iter():
+                    if dashboard is not None:
+                        # Failures are printed in place of the dashboard
+                        dashboard.clear()
+                    _handle_job_failure(d)
+                    yield name, d['results']
+            finally:
+                # Abort if any children did not exit cleanly (fail-fast)
+                # only once all the children have finished, so that none are
+                # left running. This prevents Fabric from continuing on to
+                # any other tasks.
+                jobs.wait()
+                listener.stop()
+                if dashboard is not None:
+                    dashboard.close()
 
     # Or just run once for local-only
     else:
         with settings(**my_env):
-            results['<local-only>'] = task.run(*args, **new_kwargs)
-    # Return what we can from the inner task executions
+            result = task.run(*args, **new_kwargs)
+        yield '<local-only>', result
 
-    return results
+
+def _find_unreachable_hosts(hosts):
+    """
+    Return a dictionary of the hosts whose SSH port cannot be reached to the
+    error message for them, if env.probe_timeout is set.
+    """
+    timeout = state.env.get('probe_timeout')
+    if not timeout or state.env.get('gateway'):
+        return {}
+    addresses = dict((host, tuple(normalize(host)[1:])) for host in hosts)
+    with tracing.span('probe', 'ssh', hosts=len(hosts)):
+        reasons = reachability.find_unreachable(
+            [addresses[host] for host in hosts], timeout)
+    return dict((host, 'Unable to reach %s on port %s: %s' %
+                 (address[0], address[1], reasons[address]))
+                for host, address in addresses.items() if address in reasons)
+
+
+def _handle_job_failure(d):
+    if d['exit_code'] != 0:
+        if isinstance(d['results'], NetworkError):
+            func = warn if state.env.skip_bad_hosts \
+                or state.env.warn_only else abort
+            error(d['results'].message,
+                  exception=d['results'].wrapped, func=func)
+        elif exception.is_arguments_error(d['results']):
+            raise d['results']
+        elif isinstance(d['results'], SystemExit):
+            # System exit indicates abort
+            pass
+        elif isinstance(d['results'], BaseException):
+            error(d['results'].message, exception=d['results'])
+        else:
+            error('One or more hosts failed while executing task.')
+
+
+class StreamingJobQueue(JobQueue):
+    """
+    JobQueue that can also yield the result of each job as it finishes,
+    that can let a ConcurrencyController set how many jobs run at once, and
+    that can start the jobs that took the longest in the HostHistory first
+    and show the time left, and that can keep a progress.Dashboard of the
+    jobs up to date
+    """
+    def __init__(self, max_running, comms_queue, controller=None,
+                 history=None, command=None, dashboard=None):
+        super(StreamingJobQueue, self).__init__(max_running, comms_queue)
+        self._results = None
+        self._controller = controller
+        self._history = history
+        self._command = command
+        self._dashboard = dashboard
+        self._start_times = {}
+        self._durations = []
+
+    def run(self):
+        self.wait()
+        return self._results
+
+    def wait(self):
+        """
+        Run the jobs that have not finished yet, without yielding them
+        """
+        for _ in self.run_iter():
+            pass
+
+    def run_iter(self):
+        """
+        Run the jobs, keeping at most max_running of them running at a time,
+        and yield (name, {'exit_code': ..., 'results': ...}) as each job
+        finishes. Can be called again to resume after the caller stopped
+        iterating.
+        """
+        if not self._closed:
+            raise Exception("Need to close() before starting.")
+        if self._results is None:
+            self._results = dict(
+                (job.name, dict.fromkeys(('exit_code', 'results')))
+                for job in self._queued)
+            if self._history is not None:
+                order = dict((name, i) for i, name in enumerate(
+                    self._history.order(self._command,
+                                        [job.name for job in self._queued])))
+                self._queued.sort(key=lambda job: order[job.name])
+
+        while self._queued or self._running:
+            while len(self._running) < self._max_running() and \
+                    self._queued:
+                self._start(self._queued.pop(0))
+            # Pull results off the queue every pass to keep its size down,
+            # a child cannot exit until the queue has taken its result
+            self._fill_results(self._results)
+            for job in [job for job in self._running if not job.is_alive()]:
+                if self._debug:
+                    print("Job queue found finished proc: %s." % job.name)
+                self._running.remove(job)
+                job.join()
+                self._completed.append(job)
+                self._fill_results(self._results)
+                self._results[job.name]['exit_code'] = job.exitcode
+                duration = time.time() - self._start_times[job.name]
+                if self._controller is not None:
+                    self._controller.record(duration, job.exitcode != 0)
+                if job.exitcode == 0:
+                    self._durations.append(duration)
+                    if self._history is not None:
+                        self._history.record_duration(self._command,
+                                                      job.name, duration)
+                fold.end_host(job.name)
+                if self._dashboard is not None:
+                    self._dashboard.finished(job.name, job.exitcode != 0)
+                self._print_time_left()
+                yield job.name, self._results[job.name]
+            if self._dashboard is not None and not self._finished:
+                self._dashboard.tick(self.time_left())
+            time.sleep(ssh.io_sleep)
+        if not self._finished and self._history is not None:
+            self._history.save()
+        self._finished = True
+
+    def _start(self, job):
+        if self._debug:
+            print("Popping '%s' off the queue and starting it" % job.name)
+        with settings(clean_revert=True, host_string=job.name, host=job.name):
+            job.start()
+        self._start_times[job.name] = time.time()
+        self._running.append(job)
+        if self._dashboard is not None:
+            self._dashboard.started(job.name)
+
+    def _fill_results(self, results):
+        """
+        Pull the results off the queue, pass the progress reported by the
+        jobs to the dashboard and their output to be folded
+        """
+        while True:
+            try:
+                datum = self._comms_queue.get_nowait()
+            except Queue.Empty:
+                break
+            if 'folded' in datum:
+                fold.add_output(datum['folded'], datum['state'],
+                                datum['name'])
+            elif progress.is_progress(datum):
+                if self._dashboard is not None:
+                    self._dashboard.update(datum)
+            else:
+                results[datum['name']]['results'] = datum['result']
+
+    def _max_running(self):
+        if self._controller is not None:
+            return self._controller.limit
+        return self._max
+
+    def _estimate(self, name):
+        """
+        Return the seconds the job is expected to take from the history, or
+        from the jobs that finished in this run if the history has none
+        """
+        if self._history is not None:
+            estimate = self._history.estimate(self._command, name)
+            if estimate is not None:
+                return estimate
+        if self._durations:
+            return sum(self._durations) / len(self._durations)
+        return None
+
+    def time_left(self):
+        """
+        Return the estimated seconds until every job is done, or None if
+        there is nothing to estimate from
+        """
+        now = time.time()
+        running = []
+        for job in self._running:
+            estimate = self._estimate(job.name)
+            if estimate is None:
+                return None
+            running.append(estimate - (now - self._start_times[job.name]))
+        queued = [self._estimate(job.name) for job in self._queued]
+        if None in queued:
+            return None
+        return estimate_remaining(running, queued, self._max_running())
+
+    def _print_time_left(self):
+        # The dashboard shows the time left itself. Otherwise it goes to
+        # stderr, out of the way of the output of the command.
+        if self._dashboard is not None or \
+                not (sys.stderr.isatty() and state.output.status):
+            return
+        if not (self._running or self._queued):
+            return
+        time_left = self.time_left()
+        if time_left is not None:
+            sys.stderr.write('%d of %d hosts done, about %s left\n' %
+                             (len(self._completed), len(self._results),
+                              format_duration(time_left)))
 
 
 fabric.tasks._execute = _execute
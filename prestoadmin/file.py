@@ -18,11 +18,12 @@ Commands for running scripts on a cluster
 import logging
 from fabric.operations import put, sudo
 from fabric.decorators import task
-from fabric.api import env
+from fabric.api import env, hide, settings
 from os import path
 
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
+from prestoadmin.util import fold
 from prestoadmin.util.constants import REMOTE_COPY_DIR
 from prestoadmin.plugin import write
 
@@ -44,7 +45,11 @@ def run(script, remote_dir='/tmp'):
     remote_path = path.join(remote_dir, script_name)
     put(script, remote_path)
     sudo('chmod u+x %s' % remote_path)
-    sudo(remote_path)
+    if fold.is_enabled():
+        with settings(hide('stdout')):
+            fold.add_output(sudo(remote_path) + '\n')
+    else:
+        sudo(remote_path)
     sudo('rm %s' % remote_path)
 
 
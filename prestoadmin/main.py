@@ -66,7 +66,10 @@ from prestoadmin import __version__
 from prestoadmin.util.application import entry_point
 from prestoadmin.util.fabric_application import FabricApplication
 from prestoadmin.util.hiddenoptgroup import HiddenOptionGroup
+from prestoadmin.util.local_config_util import get_log_directory
 from prestoadmin.util.parser import LoggingOptionParser
+from prestoadmin.util.task_manifest import LazyTaskModule, \
+    import_module, load_lazy_task_modules
 
 # One-time calculation of "all internal callables" to avoid doing this on every
 # check of a given fabfile callable (in is_classic_task()).
@@ -174,11 +177,33 @@ def load_fabfile(path, importer=None):
     # Actually load tasks
     docstring, new_style, classic, default = load_tasks_from_module(imported)
     tasks = new_style if state.env.new_style_tasks else classic
+    # The task modules are only listed; see import_task_module
+    task_modules = getattr(imported, 'TASK_MODULES', [])
+    if task_modules:
+        state.env.new_style_tasks = True
+        tasks = new_style
+        tasks.update(load_lazy_task_modules(task_modules))
     # Clean up after ourselves
     _seen.clear()
     return docstring, tasks
 
 
+def import_task_module(name):
+    """
+    Import the task module the task with the given name belongs to, if it
+    is still represented by a LazyTaskModule, and replace the lazy tasks in
+    state.commands with the real ones.
+    """
+    collection = name.split('.')[0]
+    lazy_module = state.commands.get(collection)
+    if not isinstance(lazy_module, LazyTaskModule):
+        return
+    module = import_module(lazy_module.module_name)
+    new_style, classic, default = extract_tasks([(collection, module)])
+    _seen.clear()
+    state.commands[collection] = new_style[collection]
+
+
 def load_tasks_from_module(imported):
     """
     Handles loading all of the tasks for a given `imported` module
@@ -348,6 +373,88 @@ def parser_for_options():
         help="default to serial execution method"
     )
 
+    advanced_options.add_option(
+        '-z',
+        '--pool-size',
+        metavar='N',
+        type='int',
+        dest='pool_size',
+        default=0,
+        help="run parallel tasks on at most N hosts at a time instead of "
+             "adapting the number of hosts to the load"
+    )
+
+    advanced_options.add_option(
+        '--resume',
+        action='store_true',
+        dest='resume',
+        default=False,
+        help="run the last install, upgrade or deploy command again, only on "
+             "the hosts and for the steps that did not complete"
+    )
+
+    advanced_options.add_option(
+        '--probe-timeout',
+        metavar='N',
+        type='float',
+        dest='probe_timeout',
+        default=2.0,
+        help="fail the hosts of parallel tasks whose SSH port does not "
+             "answer within N seconds, 0 to disable"
+    )
+
+    advanced_options.add_option(
+        '--no-history',
+        action='store_false',
+        dest='use_history',
+        default=True,
+        help="do not start the hosts of parallel tasks that took the longest "
+             "before first, nor keep their times"
+    )
+
+    advanced_options.add_option(
+        '--progress',
+        action='store_true',
+        dest='progress',
+        default=False,
+        help="show the progress of parallel tasks across the hosts, live on "
+             "a terminal and every 30 seconds otherwise"
+    )
+
+    advanced_options.add_option(
+        '--fold',
+        action='store_true',
+        dest='fold_output',
+        default=False,
+        help="print the output of file run, configuration show and server "
+             "status once for all the hosts with the same output"
+    )
+
+    advanced_options.add_option(
+        '--trace',
+        metavar='FILE',
+        dest='trace_file',
+        default=None,
+        help="write a timeline of the command in the Chrome trace format "
+             "to FILE"
+    )
+
+    advanced_options.add_option(
+        '--profile',
+        action='store_true',
+        dest='profile',
+        default=False,
+        help="write a cProfile profile of each process to the log directory"
+    )
+
+    advanced_options.add_option(
+        '--report',
+        action='store_true',
+        dest='report',
+        default=False,
+        help="print a report of the time spent on each host"
+    )
+
     # Allow setting of arbitrary env vars at runtime.
     advanced_options.add_option(
         '--set',
@@ -806,6 +913,26 @@ def parse_and_validate_commands(args=sys.argv[1:]):
         parser.print_extended_help()
         sys.exit(0)
 
+    run = None
+    resume_options = None
+    command_line = list(args)
+    if options.resume:
+        run = _load_run_to_resume(arguments)
+        # Replay the recorded command line, with its options; the options
+        # given with --resume come last so that they take precedence
+        resume_options = non_default_options
+        command_line = run['arguments'] + command_line
+        non_default_options, arguments = parser.parse_args(
+            command_line, values=Values())
+        options, arguments = parser.parse_args(command_line)
+        default_options = get_default_options(options, non_default_options)
+        arguments = parser.largs
+        # The trace file is given relative to where --resume is run
+        for values in [options, non_default_options]:
+            if getattr(values, 'trace_file', None):
+                values.trace_file = os.path.abspath(values.trace_file)
+        _change_to_run_directory(run)
+
     # If user didn't specify any commands to run, show help
     if not arguments:
         parser.print_help()
@@ -825,8 +952,13 @@ def parse_and_validate_commands(args=sys.argv[1:]):
     if options.display:
         display_command(commands_to_run[0][0])
 
+    for command in commands_to_run:
+        import_task_module(command[0])
+
     load_config_callback = _get_config_callback(commands_to_run)
     _update_env(default_options, non_default_options, load_config_callback)
+    if run is not None:
+        _use_recorded_hosts(run, resume_options)
 
     if not options.serial:
         state.env.parallel = True
@@ -839,10 +971,63 @@ def parse_and_validate_commands(args=sys.argv[1:]):
         state.env.password = getpass.getpass(prompt)
 
     state.env['tasks'] = [x[0] for x in commands_to_run]
+    state.env['command_line'] = command_line
 
     return commands_to_run
 
 
+def _load_run_to_resume(arguments):
+    if arguments:
+        abort('--resume runs the recorded command with its recorded '
+              'arguments and cannot be given a command.')
+    from prestoadmin.util import journal
+    run = journal.load_run()
+    if run is None:
+        abort('There is no command to resume.')
+    print('Resuming: %s' % ' '.join(run['arguments']))
+    return run
+
+
+def _change_to_run_directory(run):
+    """
+    Run in the directory the recorded command ran in, so that its arguments
+    that are relative paths name the same files
+    """
+    try:
+        os.chdir(run['cwd'])
+    except OSError as e:
+        abort('Cannot resume in %s, the directory the command ran in: %s' %
+              (run['cwd'], e.strerror))
+
+
+def _use_recorded_hosts(run, resume_options):
+    """
+    Run on the hosts the recorded command ran on, rather than on the hosts
+    of the topology now, unless hosts are given with --resume
+    """
+    for key in ['hosts', 'exclude_hosts']:
+        if getattr(resume_options, key, None) is None and key in run:
+            state.env[key] = run[key]
+
+
+def start_journal(commands_to_run):
+    """
+    Journal the progress of the command if it can be resumed, or continue
+    the journal of the recorded command if resuming it.
+    """
+    from prestoadmin.util import journal
+    if state.env.resume:
+        steps = journal.resume()
+        _LOGGER.info('Resuming %s with %d completed steps',
+                     state.env.command_line, len(steps))
+        return
+
+    module, command = commands_to_run[0][0].split('.')
+    if getattr(state.commands[module][command], 'resumable', False):
+        journal.start(state.env.command_line, state.env.hosts,
+                      state.env.exclude_hosts)
+
+
 def load_config(load_config_callback):
     """
     This provides a patch point for the unit tests so that individual test
@@ -895,11 +1080,52 @@ def main(args=sys.argv[1:]):
     """
     commands_to_run = parse_and_validate_commands(args)
 
+    # Only needed to run tasks, so --help and the like do not import them
+    from prestoadmin.util import fold, host_history, journal, tracing
+
     names = ", ".join(x[0] for x in commands_to_run)
     _LOGGER.debug("Commands to run: %s" % names)
 
-    # At this point all commands must exist, so execute them in order.
-    return _exit_code(run_tasks(commands_to_run))
+    start_journal(commands_to_run)
+    if state.env.fold_output:
+        fold.start()
+        # The output of each host is printed under the hosts it came from
+        state.output.running = False
+    profile_dir = get_log_directory() if state.env.profile else None
+    tracing.start(state.env.trace_file, profile_dir, record=True)
+    try:
+        # At this point all commands must exist, so execute them in order.
+        return _exit_code(run_tasks(commands_to_run))
+    finally:
+        fold.finish()
+        journal.stop()
+        events = tracing.finish()
+        if state.env.trace_file:
+            print('Trace written to %s' % state.env.trace_file)
+        if profile_dir:
+            print('Profiles written to %s' % profile_dir)
+        write_run_report(events, names)
+        if state.env.use_history:
+            host_history.record_transfers(events)
+
+
+def write_run_report(events, command):
+    """
+    Write the report of the run next to the log file, and print its summary
+    if --report was given.
+    """
+    from prestoadmin.util import run_report
+    report = run_report.build_report(events, command)
+    if not report['hosts']:
+        return
+    report_path = os.path.join(get_log_directory(),
+                               run_report.REPORT_FILE_NAME)
+    run_report.write_report(report, report_path)
+    summary = run_report.format_summary(report)
+    _LOGGER.info(summary)
+    if state.env.report:
+        print(summary)
+        print('Report written to %s' % report_path)
 
 
 if __name__ == "__main__":
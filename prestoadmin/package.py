@@ -15,7 +15,11 @@
 """
 Module for rpm package deploy and install using presto-admin
 """
+import fcntl
+import hashlib
 import logging
+import pipes
+from distutils.spawn import find_executable
 
 from fabric.context_managers import settings, hide, shell_env
 from fabric.decorators import task, runs_once
@@ -24,16 +28,28 @@ from fabric.state import env
 from fabric.tasks import execute
 from fabric.utils import abort
 
-from prestoadmin.util import constants
+from prestoadmin.util import constants, stream, tracing
 from prestoadmin.standalone.config import StandaloneConfig
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.fabricapi import get_host_list
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.journal import resumable, run_step
+from prestoadmin.util.local_config_util import get_config_directory
 
 _LOGGER = logging.getLogger(__name__)
 __all__ = ['install', 'uninstall']
 
+DELTA_DIR_NAME = 'deltas'
+# A delta is only shipped if it is smaller than this part of the new RPM
+MAX_DELTA_RATIO = 0.5
+
+# prepare_delta: the local path -> sha256 of the new RPM and the RPMs next
+# to it, one of which may be staged on the nodes already
+_local_rpms = {}
+
 
 @task
+@resumable
 @runs_once
 @requires_config(StandaloneConfig)
 def install(local_path):
@@ -65,12 +81,12 @@ def deploy_install(local_path):
 
 
 def deploy_upgrade(local_path):
-    deploy_action(local_path, rpm_upgrade)
+    deploy_action(local_path, rpm_upgrade, transfer=deploy_delta)
 
 
-def deploy_action(local_path, rpm_action):
-    deploy(local_path)
-    rpm_action(os.path.basename(local_path))
+def deploy_action(local_path, rpm_action, transfer=None):
+    run_step('transfer', transfer or deploy, local_path)
+    run_step('install', rpm_action, os.path.basename(local_path))
 
 
 def deploy(local_path=None):
@@ -79,16 +95,229 @@ def deploy(local_path=None):
 
     _LOGGER.info("Deploying rpm on %s..." % env.host)
     print("Deploying rpm on %s..." % env.host)
-    sudo('mkdir -p ' + constants.REMOTE_PACKAGES_PATH)
-    ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH, use_sudo=True)
-    if not ret_list.succeeded:
-        _LOGGER.warn("Failure during put. Now using /tmp as temp dir...")
+    with tracing.phase('transfer'):
+        if stream.can_stream() and stream_rpm(local_path):
+            print("Package deployed successfully on: " + env.host)
+            return
+        sudo('mkdir -p ' + constants.REMOTE_PACKAGES_PATH)
         ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH,
-                       use_sudo=True, temp_dir='/tmp')
+                       use_sudo=True)
+        if not ret_list.succeeded:
+            _LOGGER.warn("Failure during put. Now using /tmp as temp dir...")
+            tracing.record_retry('put')
+            ret_list = put(local_path, constants.REMOTE_PACKAGES_PATH,
+                           use_sudo=True, temp_dir='/tmp')
     if ret_list.succeeded:
         print("Package deployed successfully on: " + env.host)
 
 
+def stream_rpm(local_path):
+    """
+    Stream the RPM into the package directory through sha256sum, rather than
+    putting it in a temporary file first, and move it in place if it arrived
+    whole. Return whether it did.
+    """
+    rpm_name = os.path.basename(local_path)
+    temp_name = pipes.quote('.' + rpm_name + '.tmp')
+    result = stream.stream_in(
+        local_path, 'set -o pipefail; mkdir -p {dir} && cd {dir} && '
+        'tee {temp} | sha256sum'.format(dir=constants.REMOTE_PACKAGES_PATH,
+                                        temp=temp_name))
+    succeeded = result.succeeded and result.split()[:1] == [result.sha256]
+    with settings(hide('stdout', 'running', 'warnings'), warn_only=True):
+        if succeeded:
+            succeeded = sudo('cd %s && mv -f %s %s' % (
+                constants.REMOTE_PACKAGES_PATH, temp_name,
+                pipes.quote(rpm_name))).succeeded
+        else:
+            sudo('rm -f %s' % os.path.join(constants.REMOTE_PACKAGES_PATH,
+                                           temp_name))
+    if not succeeded:
+        _LOGGER.warn('Failure streaming the rpm to %s: %s. Now using put...'
+                     % (env.host, result))
+        tracing.record_retry('stream')
+    return succeeded
+
+
+def prepare_delta(local_path):
+    """
+    Hash the new RPM and the RPMs next to it once, before the upgrade is
+    dispatched to the nodes, so that the processes upgrading them need not,
+    and remove the deltas that none of these RPMs can use
+    """
+    _local_rpms.clear()
+    if not local_path or not os.path.isfile(local_path) or \
+            not find_executable('makedeltarpm'):
+        return
+    directory = os.path.dirname(os.path.abspath(local_path))
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith('.rpm') and os.path.isfile(path):
+            _local_rpms[path] = _sha256(path)
+    prune_deltas()
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as rpm_file:
+        for chunk in iter(lambda: rpm_file.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def deploy_delta(local_path):
+    """
+    Ship the new RPM as a delta against an RPM staged on the node by an
+    earlier install or upgrade, and rebuild it there. This needs
+    makedeltarpm locally and applydeltarpm on the node; otherwise, or if
+    the node has no RPM that is also next to the new one, the whole RPM is
+    shipped.
+    """
+    if not os.path.isfile(local_path):
+        abort('RPM file not found at %s.' % local_path)
+    local_path = os.path.abspath(local_path)
+    if local_path not in _local_rpms:
+        prepare_delta(local_path)
+    new_digest = _local_rpms.get(local_path)
+    if new_digest is None:
+        return deploy(local_path)
+
+    rpm_name = os.path.basename(local_path)
+    local_by_digest = dict((digest, path)
+                           for path, digest in _local_rpms.items())
+    with tracing.phase('transfer'):
+        for staged_name, staged_digest in staged_rpms():
+            if staged_digest == new_digest:
+                if staged_name == rpm_name or _copy_staged(staged_name,
+                                                           rpm_name):
+                    print('Package already staged on: ' + env.host)
+                    return
+            elif staged_digest in local_by_digest:
+                delta_path = make_delta(local_by_digest[staged_digest],
+                                        local_path, staged_digest, new_digest)
+                if delta_path and apply_delta(staged_name, delta_path,
+                                              rpm_name, new_digest):
+                    print('Package deployed as a delta of %s on: %s'
+                          % (staged_name, env.host))
+                    return
+                break
+    deploy(local_path)
+
+
+def staged_rpms():
+    """
+    Return the (name, sha256) of the RPMs staged on the node, newest first,
+    or [] if the node cannot apply a delta
+    """
+    with settings(hide('stdout', 'running', 'warnings'), warn_only=True):
+        output = sudo('command -v applydeltarpm >/dev/null && cd %s && '
+                      'ls -t | grep "\\.rpm$" | '
+                      'while IFS= read -r name; do sha256sum "$name"; done'
+                      % constants.REMOTE_PACKAGES_PATH)
+    if not output.succeeded:
+        return []
+    # sha256sum prints the hash, two spaces and the name
+    return [(line[66:], line[:64]) for line in output.splitlines()
+            if len(line) > 66]
+
+
+def _copy_staged(staged_name, rpm_name):
+    with settings(hide('stdout', 'running', 'warnings'), warn_only=True):
+        return sudo('cd %s && cp -p %s %s' % (
+            constants.REMOTE_PACKAGES_PATH, pipes.quote(staged_name),
+            pipes.quote(rpm_name))).succeeded
+
+
+def make_delta(old_path, new_path, old_digest, new_digest):
+    """
+    Return the path of the delta from the RPM at old_path to the one at
+    new_path, made once in the local delta directory, or None if it cannot
+    be made or is not much smaller than the new RPM
+    """
+    delta_dir = _delta_directory()
+    ensure_directory_exists(delta_dir)
+    delta_path = os.path.join(delta_dir, '%s-%s.drpm' % (old_digest[:16],
+                                                         new_digest[:16]))
+    # The processes upgrading the other nodes may be making the same delta
+    with open(delta_path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.isfile(delta_path):
+            temp_path = delta_path + '.tmp'
+            try:
+                with settings(hide('everything'), warn_only=True):
+                    result = local('makedeltarpm %s %s %s' % (
+                        pipes.quote(old_path), pipes.quote(new_path),
+                        pipes.quote(temp_path)), capture=True)
+                if not result.succeeded:
+                    _LOGGER.warn('Could not make a delta from %s to %s: %s'
+                                 % (old_path, new_path, result.stderr))
+                    return None
+                os.rename(temp_path, delta_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    if os.path.getsize(delta_path) > \
+            MAX_DELTA_RATIO * os.path.getsize(new_path):
+        _LOGGER.info('The delta from %s to %s is too large to ship'
+                     % (old_path, new_path))
+        return None
+    return delta_path
+
+
+def _delta_directory():
+    return os.path.join(get_config_directory(), DELTA_DIR_NAME)
+
+
+def prune_deltas():
+    """
+    Remove the deltas, and their lock and temporary files, from or to an RPM
+    that is no longer next to the new one, since they cannot be used again
+    """
+    delta_dir = _delta_directory()
+    if not os.path.isdir(delta_dir):
+        return
+    prefixes = set(digest[:16] for digest in _local_rpms.values())
+    for name in os.listdir(delta_dir):
+        # The name is <old sha256 prefix>-<new sha256 prefix>.drpm[.lock|.tmp]
+        digests = name.split('.')[0].split('-')
+        if not prefixes.issuperset(digests):
+            try:
+                os.remove(os.path.join(delta_dir, name))
+            except OSError as e:
+                _LOGGER.warn('Could not remove the delta %s: %s'
+                             % (name, e))
+
+
+def apply_delta(staged_name, delta_path, rpm_name, new_digest):
+    """
+    Ship the delta and rebuild the new RPM from it and the staged RPM on the
+    node. The RPM is only put in place if its sha256 is that of the new one.
+    """
+    remote_delta = os.path.join(constants.REMOTE_PACKAGES_PATH,
+                                os.path.basename(delta_path))
+    if not put(delta_path, remote_delta, use_sudo=True).succeeded:
+        return False
+    temp_name = pipes.quote('.' + rpm_name + '.tmp')
+    with settings(hide('stdout', 'running', 'warnings'), warn_only=True):
+        result = sudo(
+            'cd %(dir)s && applydeltarpm -r %(old)s %(delta)s %(temp)s && '
+            '[ "$(sha256sum < %(temp)s | cut -d" " -f1)" = %(digest)s ] && '
+            'mv -f %(temp)s %(new)s; status=$?; '
+            'rm -f %(delta)s %(temp)s; exit $status'
+            % {'dir': constants.REMOTE_PACKAGES_PATH,
+               'old': pipes.quote(staged_name),
+               'delta': pipes.quote(remote_delta),
+               'temp': temp_name,
+               'digest': new_digest,
+               'new': pipes.quote(rpm_name)})
+    if not result.succeeded:
+        _LOGGER.warn('Could not apply the delta on %s: %s'
+                     % (env.host, result))
+        tracing.record_retry('delta')
+    return result.succeeded
+
+
 def _rpm_install(package_path):
     nodeps = _nodeps_rpm_option()
 
@@ -108,7 +337,9 @@ def _nodeps_rpm_option():
 
 def rpm_install(rpm_name):
     _LOGGER.info("Installing the rpm")
-    if _rpm_install(_rpm_path(rpm_name)).succeeded:
+    with tracing.phase('install'):
+        ret = _rpm_install(_rpm_path(rpm_name))
+    if ret.succeeded:
         print("Package installed successfully on: " + env.host)
 
 
@@ -125,7 +356,9 @@ def rpm_upgrade(rpm_name):
     if not package_name.succeeded:
         abort("Corrupted RPM file: %s" % rpm_path)
 
-    if _rpm_upgrade(rpm_path).succeeded:
+    with tracing.phase('install'):
+        ret = _rpm_upgrade(rpm_path)
+    if ret.succeeded:
         print("Package upgraded successfully on: " + env.host)
 
 
@@ -134,6 +367,7 @@ def _rpm_upgrade(package_name):
 
 
 @task
+@resumable
 @runs_once
 @requires_config(StandaloneConfig)
 def uninstall(rpm_name):
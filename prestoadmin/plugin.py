@@ -15,18 +15,35 @@
 """
 module for tasks relating to presto plugins
 """
+from contextlib import closing
+import hashlib
 import logging
+import pipes
+import tarfile
+import tempfile
+from fabric.context_managers import settings, hide
 from fabric.decorators import task
 from fabric.operations import sudo, put
+from fabric.utils import abort
 import os
 from fabric.api import env
+from prestoadmin.deploy import BUNDLE_DIR_NAME, remove_old_bundles
 from prestoadmin.standalone.config import StandaloneConfig
+from prestoadmin.util import tracing
 from prestoadmin.util.base_config import requires_config
-from prestoadmin.util.constants import REMOTE_PLUGIN_DIR
+from prestoadmin.util.fabricapi import prepared_by
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.journal import resumable
+from prestoadmin.util.constants import REMOTE_COPY_DIR, REMOTE_PLUGIN_DIR
+from prestoadmin.util.local_config_util import get_config_directory
 
-__all__ = ['add_jar']
+__all__ = ['add_jar', 'sync']
 _LOGGER = logging.getLogger(__name__)
 
+# prepare_sync: the name -> (size, sha256) of the files to sync, hashed once
+# in the parent process rather than by the process of each host
+_local_files = None
+
 
 def write(local_path, remote_dir):
     sudo("mkdir -p " + remote_dir)
@@ -34,6 +51,7 @@ def write(local_path, remote_dir):
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def add_jar(local_path, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
     """
@@ -47,3 +65,161 @@ def add_jar(local_path, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
     """
     _LOGGER.info('deploying jars on %s' % env.host)
     write(local_path, os.path.join(plugin_dir, plugin_name))
+
+
+def prepare_sync(local_dir, *args, **kwargs):
+    """
+    Hash the files in local_dir once, before the sync is dispatched to the
+    hosts
+    """
+    global _local_files
+    _local_files = local_manifest(local_dir)
+
+
+@task
+@prepared_by(prepare_sync)
+@resumable
+@requires_config(StandaloneConfig)
+def sync(local_dir, plugin_name, plugin_dir=REMOTE_PLUGIN_DIR):
+    """
+    Make the plugin directory on the nodes hold the files in local_dir.
+
+    Only the files that are missing or differ on a node are transferred, as
+    one archive, and the files that are not in local_dir are removed from
+    the plugin directory. The changes are made to a copy of the plugin
+    directory that then replaces it, so the Presto server never sees a
+    plugin with only some of its jars updated.
+
+    Parameters:
+        local_dir - Local directory with the jars of the plugin
+        plugin_name - Name of the plugin subdirectory to sync the jars to
+        plugin_dir - (Optional) The plugin directory.  If no directory is
+                     given, '/usr/lib/presto/lib/plugin' is used by default.
+    """
+    local_files = _local_files if _local_files is not None \
+        else local_manifest(local_dir)
+    remote_dir = os.path.join(plugin_dir, plugin_name)
+    with tracing.phase('transfer'):
+        remote_files = remote_manifest(remote_dir)
+        changed = sorted(name for name in local_files
+                         if remote_files.get(name) != local_files[name])
+        stale = sorted(set(remote_files) - set(local_files))
+        if not changed and not stale:
+            print('Plugin %s is up to date on: %s' % (plugin_name, env.host))
+            return
+        print('Updating %d and removing %d files of plugin %s on: %s' % (
+            len(changed), len(stale), plugin_name, env.host))
+        archive_path = build_archive(local_dir, changed, local_files) \
+            if changed else None
+        apply_sync(archive_path, stale, remote_dir)
+
+
+def local_manifest(local_dir):
+    """
+    Return the name -> (size, sha256) of the files in local_dir
+    """
+    if not os.path.isdir(local_dir):
+        abort('Plugin directory not found at %s.' % local_dir)
+    manifest = {}
+    for name in os.listdir(local_dir):
+        path = os.path.join(local_dir, name)
+        if not os.path.isfile(path):
+            _LOGGER.warn('Not syncing %s, which is not a file' % path)
+            continue
+        digest = hashlib.sha256()
+        with open(path, 'rb') as local_file:
+            for chunk in iter(lambda: local_file.read(1024 * 1024), ''):
+                digest.update(chunk)
+        manifest[name] = (os.path.getsize(path), digest.hexdigest())
+    if not manifest:
+        abort('No files to sync in %s.' % local_dir)
+    return manifest
+
+
+def remote_manifest(remote_dir):
+    """
+    Return the name -> (size, sha256) of the files in remote_dir on the
+    current host, which is empty if remote_dir does not exist
+    """
+    with settings(hide('stdout', 'running'), warn_only=True):
+        result = sudo("cd %s 2>/dev/null || exit 0; find . -maxdepth 1 "
+                      "-type f -printf '%%s ' -exec sha256sum {} \\;"
+                      % pipes.quote(remote_dir))
+    if result.failed:
+        abort('Could not list the files in %s on %s'
+              % (remote_dir, env.host))
+    manifest = {}
+    for line in result.splitlines():
+        size, _, line = line.strip().partition(' ')
+        digest, _, name = line.partition('  ./')
+        if name and size.isdigit():
+            manifest[name] = (int(size), digest)
+    return manifest
+
+
+def build_archive(local_dir, names, local_files):
+    """
+    Write the files names in local_dir to a local archive and return its
+    path. The archive is named by its content, so the hosts that are missing
+    the same files share the one archive.
+    """
+    digest = hashlib.sha1()
+    for name in names:
+        digest.update('%s\0%d\0%s\0' % ((name,) + local_files[name]))
+    bundle_dir = os.path.join(get_config_directory(), BUNDLE_DIR_NAME)
+    archive_path = os.path.join(bundle_dir,
+                                'plugin-' + digest.hexdigest() + '.tar')
+    if os.path.exists(archive_path):
+        return archive_path
+
+    ensure_directory_exists(bundle_dir)
+    remove_old_bundles(bundle_dir)
+    fd, temp_path = tempfile.mkstemp(dir=bundle_dir)
+    # Jars are compressed already, so the archive is not
+    with os.fdopen(fd, 'wb') as archive_file:
+        with closing(tarfile.open(fileobj=archive_file,
+                                  mode='w')) as archive:
+            for name in names:
+                archive.add(os.path.join(local_dir, name), arcname=name)
+    # Other processes syncing the same files may be writing it too
+    os.rename(temp_path, archive_path)
+    return archive_path
+
+
+def apply_sync(archive_path, stale, remote_dir):
+    """
+    Replace remote_dir on the current host with a copy of it with the
+    archive extracted over it and the stale files removed. The files are
+    owned by the owner of remote_dir, or of its parent for a new one.
+    """
+    commands = [
+        'set -e',
+        'mkdir -p {parent}',
+        'staging=$(mktemp -d {parent}/.{base}.sync-XXXXXX)',
+        "trap 'rm -rf \"$staging\" {archive}' EXIT",
+        # Hard links, as the files that change are replaced, not written to
+        'if [ -d {dir} ]; then cp -al {dir}/. "$staging"; '
+        'chmod --reference={dir} "$staging"; owner={dir}; '
+        'else chmod 755 "$staging"; owner={parent}; fi']
+    remote_archive = ''
+    if archive_path:
+        remote_archive = os.path.join(REMOTE_COPY_DIR, 'presto-admin-' +
+                                      os.path.basename(archive_path))
+        put(archive_path, remote_archive)
+        commands.append('tar -C "$staging" --no-same-owner --unlink-first '
+                        '-x -f {archive}')
+    if stale:
+        commands.append('rm -f ' + ' '.join(
+            '"$staging"/' + pipes.quote(name) for name in stale))
+    commands += ['chown -R --reference="$owner" "$staging"',
+                 'if [ -d {dir} ]; then mv {dir} "$staging.old"; fi',
+                 'mv "$staging" {dir}',
+                 'rm -rf "$staging.old"']
+    command = '; '.join(commands).format(
+        dir=pipes.quote(remote_dir),
+        parent=pipes.quote(os.path.dirname(remote_dir)),
+        base=os.path.basename(remote_dir), archive=remote_archive)
+    with settings(warn_only=True):
+        result = sudo(command)
+    if result.failed:
+        abort('Failed to sync the plugin directory %s' % remote_dir)
@@ -32,6 +32,7 @@ from prestoadmin.util.constants import REMOTE_CONF_DIR, CONFIG_PROPERTIES
 from prestoadmin.util.exception import InvalidArgumentError
 from prestoadmin.util.httpscacertconnection import HTTPSCaCertConnection
 from prestoadmin.util.local_config_util import get_coordinator_directory, get_topology_path
+from prestoadmin.util import tracing
 from prestoadmin.util.presto_config import PrestoConfig, LDAP_CLIENT_USER_KEY, LDAP_CLIENT_PASSWORD_KEY
 
 _LOGGER = logging.getLogger(__name__)
@@ -93,11 +94,12 @@ class PrestoClient:
         Returns:
             list of rows or None if client was unable to connect to Presto
         """
-        status = self._execute_query(sql, schema, catalog)
-        if status:
-            return self._get_rows()
-        else:
-            return None
+        with tracing.span('run_sql', 'presto', server=self.server, sql=sql):
+            status = self._execute_query(sql, schema, catalog)
+            if status:
+                return self._get_rows()
+            else:
+                return None
 
     def _execute_query(self, sql, schema, catalog):
         if not sql:
@@ -35,13 +35,16 @@ from retrying import retry, RetryError
 import util.filesystem
 from prestoadmin import catalog
 from prestoadmin import configure_cmds
+import prestoadmin.deploy
 from prestoadmin import package
 from prestoadmin.prestoclient import PrestoClient
 from prestoadmin.standalone.config import StandaloneConfig
-from prestoadmin.util import constants
+from prestoadmin.util import backup_store, constants, fold, tracing
 from prestoadmin.util.base_config import requires_config
 from prestoadmin.util.exception import ConfigFileNotFoundError, ConfigurationError
-from prestoadmin.util.fabricapi import get_host_list, get_coordinator_role
+from prestoadmin.util.fabricapi import get_host_list, get_coordinator_role, \
+    prepared_by
+from prestoadmin.util.journal import command_step, resumable, run_step
 from prestoadmin.util.local_config_util import get_catalog_directory
 from prestoadmin.util.remote_config_util import lookup_port, \
     lookup_server_log_file, lookup_launcher_log_file, lookup_string_config
@@ -85,6 +88,12 @@ EXTERNAL_IP_SQL = 'select url_extract_host(http_uri) from ' \
 CATALOG_INFO_SQL = 'select catalog_name from system.metadata.catalogs'
 _LOGGER = logging.getLogger(__name__)
 
+# The catalogs to deploy on install, found once by prepare_configs
+_catalog_names = None
+# The snapshot the configuration is backed up to on upgrade, created once by
+# prepare_upgrade
+_upgrade_snapshot = None
+
 DOWNLOAD_DIRECTORY = '/tmp'
 DEFAULT_RPM_NAME = 'presto-server-rpm.rpm'
 LATEST_RPM_URL = 'https://repository.sonatype.org/service/local/artifact/maven' \
@@ -331,6 +340,7 @@ class PrestoRpmFetcher:
 
 
 @task
+@resumable
 @runs_once
 @requires_config(StandaloneConfig)
 def install(rpm_specifier):
@@ -382,9 +392,21 @@ def install(rpm_specifier):
     return execute(deploy_install_configure, path_to_rpm, hosts=get_host_list())
 
 
+def prepare_configs(*args):
+    """
+    Render and validate the configuration and find the catalogs to deploy
+    with it once, before the rpm is installed on any host
+    """
+    global _catalog_names
+    add_tpch_catalog()
+    _catalog_names = find_catalogs()
+    prestoadmin.deploy.prepare_role_confs()
+
+
+@prepared_by(prepare_configs)
 def deploy_install_configure(local_path):
     package.deploy_install(local_path)
-    update_configs()
+    run_step('configure', update_configs)
     wait_for_presto_user()
 
 
@@ -393,17 +415,25 @@ def add_tpch_catalog():
     util.filesystem.write_to_file_if_not_exists('connector.name=tpch', tpch_catalog_config)
 
 
-def update_configs():
-    configure_cmds.deploy()
-
-    add_tpch_catalog()
+def find_catalogs():
     try:
-        catalog.add()
+        return catalog.get_catalog_files() or []
     except ConfigFileNotFoundError:
         _LOGGER.info('No catalog directory found, not adding catalogs.')
+        return []
 
 
-@retry(stop_max_delay=3000, wait_fixed=250)
+def update_configs():
+    filenames = _catalog_names
+    if filenames is None:
+        add_tpch_catalog()
+        filenames = find_catalogs()
+    # The configuration and the catalogs go in one bundle for the role
+    prestoadmin.deploy.role_bundle(get_catalog_directory(), filenames)
+
+
+@retry(stop_max_delay=3000,
+       wait_func=tracing.retry_wait(250, 'wait for presto user'))
 def wait_for_presto_user():
     ret = sudo('getent passwd presto', quiet=True)
     if not ret.succeeded:
@@ -412,6 +442,7 @@ def wait_for_presto_user():
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def uninstall():
     """
@@ -435,7 +466,21 @@ def uninstall():
         abort('Unable to uninstall package on: ' + env.host)
 
 
+def prepare_upgrade(new_rpm_path=None, *args, **kwargs):
+    """
+    Create the snapshot that the configuration of every node is backed up to
+    before the upgrade, and hash the RPMs it may be shipped as a delta of
+    """
+    global _upgrade_snapshot
+    # A resumed upgrade goes on backing up to the snapshot it started
+    _upgrade_snapshot = command_step('upgrade snapshot',
+                                     backup_store.new_snapshot)
+    package.prepare_delta(new_rpm_path)
+
+
 @task
+@prepared_by(prepare_upgrade)
+@resumable
 @requires_config(StandaloneConfig)
 def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
     """
@@ -452,7 +497,9 @@ def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
     collected configuration back out to the hosts on the cluster.
 
     Note that the configuration files in the presto-admin configuration
-    directory are not updated during upgrade.
+    directory are not updated during upgrade. The configuration of the nodes
+    is also backed up to a new snapshot, which configuration restore can
+    restore.
 
     :param new_rpm_path -       The path to the new Presto RPM to
                                 install
@@ -467,13 +514,17 @@ def upgrade(new_rpm_path, local_config_dir=None, overwrite=False):
                                 dependencies. Equivalent to adding --nodeps
                                 flag to rpm -U.
     """
-    stop()
+    run_step('stop', stop)
 
-    temp_config_tar = configure_cmds.gather_config_directory()
+    run_step('backup config', configure_cmds.backup_host,
+             _upgrade_snapshot or backup_store.new_snapshot())
+    temp_config_tar = run_step('gather config',
+                               configure_cmds.gather_config_directory)
 
     package.deploy_upgrade(new_rpm_path)
 
-    configure_cmds.deploy_config_directory(temp_config_tar)
+    run_step('configure', configure_cmds.deploy_config_directory,
+             temp_config_tar)
 
 
 def service(control=None):
@@ -491,7 +542,9 @@ def check_status_for_control_commands():
           'please wait. This check will time out after %d minutes if the '
           'server does not respond.'
           % (env.host, (RETRY_TIMEOUT / 60)))
-    if check_server_status():
+    with tracing.phase('verify'):
+        started = check_server_status()
+    if started:
         print('Server started successfully on: ' + env.host)
     else:
         warn('Could not verify server status for: ' + env.host +
@@ -519,6 +572,7 @@ def is_port_in_use(host):
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def start():
     """
@@ -532,6 +586,7 @@ def start():
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def stop():
     """
@@ -552,6 +607,7 @@ def stop_and_start():
 
 
 @task
+@resumable
 @requires_config(StandaloneConfig)
 def restart():
     """
@@ -620,7 +676,9 @@ def check_server_status():
             return False
 
 
-@retry(stop_max_delay=RETRY_TIMEOUT * 1000, wait_fixed=5000, retry_on_result=lambda result: result is False)
+@retry(stop_max_delay=RETRY_TIMEOUT * 1000,
+       wait_func=tracing.retry_wait(5000, 'query server status'),
+       retry_on_result=lambda result: result is False)
 def query_server_for_status(client, node_id):
     try:
         rows = client.run_sql(SYSTEM_RUNTIME_NODES)
@@ -715,8 +773,10 @@ def get_roles_for(host):
 
 def print_node_info(node_status, catalog_status):
     for k in node_status:
-        print('\tNode URI(http): ' + str(k) +
-              '\n\tPresto Version: ' + str(node_status[k][0]) +
+        # The URI is left out of folded output so that the nodes fold
+        if not fold.is_enabled():
+            print('\tNode URI(http): ' + str(k))
+        print('\tPresto Version: ' + str(node_status[k][0]) +
               '\n\tNode status:    ' + str(node_status[k][1]))
         if catalog_status:
             print('\tCatalogs:     ' + catalog_status)
@@ -746,6 +806,10 @@ def get_ext_ip_of_node(client):
 
 def print_status_header(external_ip, server_status, host):
     print('Server Status:')
+    if fold.is_enabled():
+        print('\tRoles: %s: %s' % (', '.join(get_roles_for(host)),
+                                   is_server_up(server_status)))
+        return
     print('\t%s(IP: %s, Roles: %s): %s' % (host, external_ip,
                                            ', '.join(get_roles_for(host)),
                                            is_server_up(server_status)))
@@ -797,25 +861,38 @@ def get_status_from_coordinator():
             else:
                 (external_ip, is_running, error_message) = node_information[host]
 
-            print_status_header(external_ip, is_running, host)
-            if error_message:
-                print('\t' + error_message)
-            elif not coordinator_status:
-                print('\tNo information available: unable to query coordinator')
-            elif not is_running:
-                print('\tNo information available')
+            if fold.is_enabled():
+                with fold.capture(is_server_up(is_running), host):
+                    print_host_status(client, host, external_ip, is_running,
+                                      error_message, coordinator_status,
+                                      catalog_status)
             else:
-                version_string = get_presto_version()
-                version = strip_tag(split_version(version_string))
-                query, processor = NODE_INFO_PER_URI_SQL.for_version(version)
-                # just get the node_info row for the host if server is up
-                node_info_row = client.run_sql(query % external_ip)
-                node_status = processor(node_info_row)
-                if node_status:
-                    print_node_info(node_status, catalog_status)
-                else:
-                    print('\tNo information available: the coordinator has not yet'
-                          ' discovered this node')
+                print_host_status(client, host, external_ip, is_running,
+                                  error_message, coordinator_status,
+                                  catalog_status)
+
+
+def print_host_status(client, host, external_ip, is_running, error_message,
+                      coordinator_status, catalog_status):
+    print_status_header(external_ip, is_running, host)
+    if error_message:
+        print('\t' + error_message)
+    elif not coordinator_status:
+        print('\tNo information available: unable to query coordinator')
+    elif not is_running:
+        print('\tNo information available')
+    else:
+        version_string = get_presto_version()
+        version = strip_tag(split_version(version_string))
+        query, processor = NODE_INFO_PER_URI_SQL.for_version(version)
+        # just get the node_info row for the host if server is up
+        node_info_row = client.run_sql(query % external_ip)
+        node_status = processor(node_info_row)
+        if node_status:
+            print_node_info(node_status, catalog_status)
+        else:
+            print('\tNo information available: the coordinator has not yet'
+                  ' discovered this node')
 
 
 @task
@@ -22,3 +22,11 @@ class AllWriteTimedRotatingFileHandler(handlers.TimedRotatingFileHandler):
         rotating_file_handler = handlers.TimedRotatingFileHandler._open(self)
         os.umask(prev_umask)
         return rotating_file_handler
+
+
+class AllWriteRotatingFileHandler(handlers.RotatingFileHandler):
+    def _open(self):
+        prev_umask = os.umask(000)
+        rotating_file_handler = handlers.RotatingFileHandler._open(self)
+        os.umask(prev_umask)
+        return rotating_file_handler
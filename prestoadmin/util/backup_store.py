@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for the local store of the snapshots of the configuration directory
+of the nodes.
+
+A snapshot is a manifest for each node of the files in its configuration
+directory, with their mode, owner and the sha256 of their content. The
+content is stored once for each distinct hash, however many nodes and
+snapshots have it, so the snapshots of nodes with the same configuration
+take about the space of one.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_config_directory
+
+BACKUP_DIR_NAME = 'backups'
+BLOB_DIR_NAME = 'blobs'
+SNAPSHOT_DIR_NAME = 'snapshots'
+SNAPSHOT_ID_FORMAT = '%Y%m%dT%H%M%S'
+
+
+def get_backup_directory():
+    return os.path.join(get_config_directory(), BACKUP_DIR_NAME)
+
+
+def _blob_path(digest):
+    return os.path.join(get_backup_directory(), BLOB_DIR_NAME, digest)
+
+
+def _snapshot_directory(snapshot):
+    return os.path.join(get_backup_directory(), SNAPSHOT_DIR_NAME, snapshot)
+
+
+def has_blob(digest):
+    return os.path.exists(_blob_path(digest))
+
+
+def add_blob(content):
+    """
+    Store content, unless it is stored already, and return its sha256
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    if has_blob(digest):
+        return digest
+    blob_dir = os.path.dirname(_blob_path(digest))
+    ensure_directory_exists(blob_dir)
+    fd, temp_path = tempfile.mkstemp(dir=blob_dir)
+    with os.fdopen(fd, 'wb') as blob_file:
+        blob_file.write(content)
+    # The processes backing up other nodes may be storing the same content
+    os.rename(temp_path, _blob_path(digest))
+    return digest
+
+
+def read_blob(digest):
+    with open(_blob_path(digest), 'rb') as blob_file:
+        return blob_file.read()
+
+
+def new_snapshot():
+    """
+    Create an empty snapshot and return its id, which sorts after the ids of
+    the snapshots created before it
+    """
+    snapshot_id = time.strftime(SNAPSHOT_ID_FORMAT)
+    suffix = 0
+    while True:
+        snapshot = '%s.%d' % (snapshot_id, suffix) if suffix \
+            else snapshot_id
+        try:
+            os.makedirs(_snapshot_directory(snapshot))
+            return snapshot
+        except OSError:
+            if not os.path.isdir(_snapshot_directory(snapshot)):
+                raise
+            suffix += 1
+
+
+def list_snapshots():
+    snapshot_dir = os.path.join(get_backup_directory(), SNAPSHOT_DIR_NAME)
+    if not os.path.isdir(snapshot_dir):
+        return []
+    return sorted(os.listdir(snapshot_dir), key=_snapshot_key)
+
+
+def _snapshot_key(snapshot):
+    snapshot_id, _, suffix = snapshot.partition('.')
+    return snapshot_id, int(suffix) if suffix.isdigit() else 0
+
+
+def latest_snapshot():
+    """
+    Return the latest snapshot that has at least one host, so that a backup
+    that was interrupted before any host was backed up is not restored
+    """
+    for snapshot in reversed(list_snapshots()):
+        if snapshot_hosts(snapshot):
+            return snapshot
+    return None
+
+
+def snapshot_hosts(snapshot):
+    """
+    Return the hosts that were backed up to snapshot
+    """
+    return sorted(name[:-len('.json')]
+                  for name in os.listdir(_snapshot_directory(snapshot))
+                  if name.endswith('.json'))
+
+
+def has_snapshot(snapshot):
+    return bool(re.match(r'^\d{8}T\d{6}(\.\d+)?$', snapshot)) and \
+        os.path.isdir(_snapshot_directory(snapshot))
+
+
+def write_manifest(snapshot, host, entries):
+    """
+    Record the files of host in snapshot
+
+    Parameters:
+        entries - a list of a dictionary for each file and directory, with
+            its path, 'type' ('f' or 'd'), 'mode', 'owner' ('user:group') and
+            for files, the 'sha256' of its content, which must be stored
+    """
+    manifest_path = os.path.join(_snapshot_directory(snapshot),
+                                 host + '.json')
+    ensure_directory_exists(os.path.dirname(manifest_path))
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path))
+    with os.fdopen(fd, 'w') as manifest_file:
+        json.dump(sorted(entries, key=lambda entry: entry['path']),
+                  manifest_file, indent=1)
+    os.rename(temp_path, manifest_path)
+
+
+def read_manifest(snapshot, host):
+    """
+    Return the entries of host in snapshot, or None if it has none
+    """
+    try:
+        with open(os.path.join(_snapshot_directory(snapshot),
+                               host + '.json')) as manifest_file:
+            return json.load(manifest_file)
+    except IOError:
+        return None
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for choosing how many hosts a parallel task runs on at once.
+
+Every host runs in its own process with its own SSH connection, so running
+all the hosts of a large cluster at once can exhaust the file descriptors
+and processes of the presto-admin machine. The limit starts from what this
+machine can afford and then adapts to the hosts that finish: it backs off
+when hosts fail or slow down and grows while they do not.
+"""
+import logging
+import multiprocessing
+import resource
+
+from prestoadmin.util.stats import percentile
+
+_LOGGER = logging.getLogger(__name__)
+
+# Each job is a process with an SSH connection and the pipes to its parent
+FDS_PER_JOB = 8
+RESERVED_FDS = 64
+# Jobs mostly wait on the network, so there can be many per CPU
+JOBS_PER_CPU = 8
+
+MIN_LIMIT = 1
+MIN_WINDOW = 4
+MAX_WINDOW = 32
+# Back off when more than this fraction of the hosts in a window fail...
+ERROR_RATE_THRESHOLD = 0.2
+# ...or when their median time is this many times the best median seen
+LATENCY_FACTOR = 2.0
+
+
+def _soft_limit(limit, default):
+    try:
+        soft = resource.getrlimit(limit)[0]
+    except (ValueError, resource.error):
+        return default
+    return default if soft == resource.RLIM_INFINITY else soft
+
+
+def get_resource_limits():
+    """
+    Return the number of CPUs and the soft limits on open files and
+    processes of this process.
+    """
+    try:
+        cpu_count = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpu_count = 1
+    fd_limit = _soft_limit(resource.RLIMIT_NOFILE, 1024)
+    process_limit = _soft_limit(resource.RLIMIT_NPROC, 4096)
+    return cpu_count, fd_limit, process_limit
+
+
+class ConcurrencyController(object):
+    """
+    Additive increase, multiplicative decrease control of the number of
+    hosts to run at once.
+
+    Parameters:
+        host_count - the number of hosts the task runs on
+        cpu_count, fd_limit, process_limit - the resources of this machine,
+            looked up if not given
+    """
+    def __init__(self, host_count, cpu_count=None, fd_limit=None,
+                 process_limit=None):
+        if cpu_count is None or fd_limit is None or process_limit is None:
+            cpu_count, fd_limit, process_limit = get_resource_limits()
+        self.max_limit = max(MIN_LIMIT, min(
+            host_count,
+            (fd_limit - RESERVED_FDS) // FDS_PER_JOB,
+            process_limit // 2))
+        self.limit = max(MIN_LIMIT, min(self.max_limit,
+                                        cpu_count * JOBS_PER_CPU))
+        self._window = []
+        self._best_latency = None
+        _LOGGER.debug('Initial pool size %d, at most %d', self.limit,
+                      self.max_limit)
+
+    def record(self, duration, failed):
+        """
+        Record that a host finished after duration seconds, and adjust the
+        limit once there are enough hosts to judge.
+        """
+        self._window.append((duration, failed))
+        if len(self._window) < max(MIN_WINDOW, min(self.limit, MAX_WINDOW)):
+            return
+
+        error_rate = float(sum(1 for _, f in self._window if f)) / \
+            len(self._window)
+        latency = percentile([d for d, _ in self._window], 0.5)
+        self._window = []
+
+        old_limit = self.limit
+        if error_rate > ERROR_RATE_THRESHOLD:
+            self.limit = max(MIN_LIMIT, self.limit // 2)
+            reason = '%d%% of the hosts failed' % (error_rate * 100)
+        elif self._best_latency is not None and \
+                latency > self._best_latency * LATENCY_FACTOR:
+            self.limit = max(MIN_LIMIT, self.limit * 3 // 4)
+            reason = 'median time %.1fs, best %.1fs' % (
+                latency, self._best_latency)
+        else:
+            self.limit = min(self.max_limit,
+                             self.limit + max(1, self.limit // 4))
+            reason = 'median time %.1fs' % latency
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+
+        if self.limit != old_limit:
+            _LOGGER.info('Changed pool size from %d to %d: %s', old_limit,
+                         self.limit, reason)
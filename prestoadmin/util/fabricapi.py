@@ -18,7 +18,7 @@ Module to add extensions and helpers for fabric api methods
 
 from functools import wraps
 
-from fabric.api import env, put, settings, sudo
+from fabric.api import env
 from fabric.utils import abort
 
 
@@ -43,6 +43,19 @@ def task_by_rolename(rolename):
     return inner_decorator
 
 
+def prepared_by(callback):
+    """
+    Decorator for the tasks that share work across their hosts, like
+    rendering the configuration to deploy. execute calls callback with the
+    arguments of the task once, in the parent process, before running the
+    task on any host, so that an error in it fails the task right away.
+    """
+    def inner_decorator(f):
+        f.pa_prepare_callback = callback
+        return f
+    return inner_decorator
+
+
 def by_rolename(host, rolename, f, *args, **kwargs):
     if rolename is None:
         f(*args, **kwargs)
@@ -62,27 +75,3 @@ def by_role_coordinator(host, f, *args, **kwargs):
 def by_role_worker(host, f, *args, **kwargs):
     if host in get_worker_role() and host not in get_coordinator_role():
         return f(*args, **kwargs)
-
-
-def put_secure(user_group, mode, *args, **kwargs):
-    missing_owner_code = 42
-    user, group = user_group.split(":")
-
-    files = put(*args, mode=mode, **kwargs)
-
-    for file in files:
-        with settings(warn_only=True):
-            command = \
-                "( getent passwd {user} >/dev/null || ( rm -f {file} ; " \
-                "exit {missing_owner_code} ) ) && " \
-                "chown {user_group} {file}".format(
-                    user=user, file=file, user_group=user_group,
-                    missing_owner_code=missing_owner_code)
-
-            result = sudo(command)
-
-            if result.return_code == missing_owner_code:
-                abort("User %s does not exist. Make sure the Presto "
-                      "server RPM is installed and try again" % (user,))
-            elif result.failed:
-                abort("Failed to chown file %s" % (file,))
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for folding the output of a command across the hosts, like
+dshbak -c: the hosts whose output is the same are printed once, under the
+list of those hosts in ranges like slave[01-20].
+
+The output of each host is hashed as it comes, and only the first host with
+a given output keeps it, in a file once it is large, so the memory used
+does not grow with the number of hosts or the size of their output. The
+processes that run a parallel task send their output to the parent
+process through the queue that carries their results.
+"""
+import hashlib
+import re
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+
+from fabric.api import env
+
+# Output larger than this is kept in a file rather than in memory
+SPOOL_SIZE = 64 * 1024
+SEPARATOR = '-' * 16
+
+# The folder of the command, in the parent process
+_folder = None
+# The queue to send the output to, in the processes that run a task
+_queue = None
+
+
+def start():
+    global _folder
+    _folder = OutputFolder()
+
+
+def set_queue(queue):
+    global _queue
+    _queue = queue
+
+
+def is_enabled():
+    return _folder is not None or _queue is not None
+
+
+def add_output(text, state=None, host=None):
+    """
+    Add text to the output of host, the current host by default, to be
+    folded with that of the other hosts. The state, e.g. 'Running', is
+    counted in the summary printed after the output.
+    """
+    host = host or env.host_string
+    if _queue is not None:
+        _queue.put({'name': host, 'folded': text, 'state': state})
+    elif _folder is not None:
+        _folder.add(host, text, state)
+
+
+def end_host(host):
+    """
+    Fold the output of host, which has no more to add
+    """
+    if _queue is None and _folder is not None:
+        _folder.end_host(host)
+
+
+@contextmanager
+def capture(state=None, host=None):
+    """
+    Add what is printed in the block to the output of host
+    """
+    old_stdout = sys.stdout
+    sys.stdout = _FoldWriter(state, host or env.host_string)
+    try:
+        yield
+    finally:
+        sys.stdout = old_stdout
+
+
+def finish(stream=None):
+    """
+    Print the folded output of the command and stop folding
+    """
+    global _folder
+    if _folder is not None:
+        _folder.write(stream or sys.stdout)
+        _folder = None
+
+
+class _FoldWriter(object):
+    def __init__(self, state, host):
+        self._state = state
+        self._host = host
+
+    def write(self, text):
+        add_output(text, self._state, self._host)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def natural_key(host):
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', host)]
+
+
+def compress_hosts(hosts):
+    """
+    Return the hosts with the runs of consecutive numbers folded into
+    ranges, e.g. ['slave[1-3]', 'master'] for slave1, slave2, slave3 and
+    master. This is the reverse of how the hosts in the topology are
+    expanded, so each range can be given back as a host.
+    """
+    numbered = []
+    others = []
+    for host in set(hosts):
+        match = re.match(r'(.*?)(\d+)(\D*)$', host)
+        if match is None:
+            others.append(host)
+        else:
+            numbered.append(match.groups())
+    padded = set((prefix, suffix, len(number))
+                 for prefix, number, suffix in numbered
+                 if _is_zero_padded(number))
+
+    groups = defaultdict(list)
+    for prefix, number, suffix in numbered:
+        # Zero padded numbers only fold with numbers of the same width, like
+        # slave09 with slave10, as a range expands to numbers of the width of
+        # its bounds when they have the same width
+        width = len(number) if (prefix, suffix, len(number)) in padded else 0
+        groups[(prefix, suffix, width)].append(number)
+
+    # (first host, hosts) to sort the ranges by their first host
+    compressed = [(host, host) for host in others]
+    for (prefix, suffix, width), numbers in groups.items():
+        numbers.sort(key=int)
+        start = end = numbers[0]
+        for number in numbers[1:] + [None]:
+            if number is not None and int(number) == int(end) + 1:
+                end = number
+                continue
+            first = prefix + start + suffix
+            if start == end:
+                compressed.append((first, first))
+            else:
+                compressed.append((first, '%s[%s-%s]%s' % (prefix, start, end,
+                                                           suffix)))
+            start = end = number
+    compressed.sort(key=lambda item: natural_key(item[0]))
+    return [item[1] for item in compressed]
+
+
+def _is_zero_padded(number):
+    return number.startswith('0') and len(number) > 1
+
+
+class OutputFolder(object):
+    """
+    The output of each host, folded by content
+    """
+    def __init__(self):
+        # host -> (hash, file) of the output of the hosts still adding to it
+        self._pending = {}
+        # hash -> {'hosts': [...], 'output': file}
+        self._groups = {}
+        self._states = {}
+
+    def add(self, host, text, state=None):
+        if state is not None:
+            self._states[host] = state
+        if host not in self._pending:
+            self._pending[host] = (hashlib.sha1(),
+                                   tempfile.SpooledTemporaryFile(SPOOL_SIZE))
+        digest, output = self._pending[host]
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        digest.update(text)
+        output.write(text)
+
+    def end_host(self, host):
+        if host not in self._pending:
+            return
+        digest, output = self._pending.pop(host)
+        group = self._groups.get(digest.hexdigest())
+        if group is None:
+            self._groups[digest.hexdigest()] = {'hosts': [host],
+                                                'output': output}
+        else:
+            group['hosts'].append(host)
+            output.close()
+
+    def write(self, stream):
+        for host in list(self._pending):
+            self.end_host(host)
+        for group in sorted(self._groups.values(),
+                            key=lambda group: natural_key(
+                                min(group['hosts'], key=natural_key))):
+            stream.write('%s\n%s\n%s\n' % (
+                SEPARATOR, ', '.join(compress_hosts(group['hosts'])),
+                SEPARATOR))
+            group['output'].seek(0)
+            shutil.copyfileobj(group['output'], stream)
+            group['output'].close()
+        self._groups = {}
+
+        if self._states:
+            hosts_by_state = defaultdict(list)
+            for host, state in self._states.items():
+                hosts_by_state[state].append(host)
+            stream.write('Summary:\n')
+            for state, hosts in sorted(hosts_by_state.items()):
+                stream.write('\t%s: %d (%s)\n' % (
+                    state, len(hosts), ', '.join(compress_hosts(hosts))))
+            self._states = {}
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for locating and parsing the garbage collection logs of the Presto
+server JVM.
+
+Both the Java 8 format (-Xloggc with -XX:+PrintGCDetails or without it) and
+the unified logging format of Java 9 and later (-Xlog:gc) are understood.
+"""
+import re
+
+from prestoadmin.util.stats import percentile
+
+# Only the lines matching this are needed to compute the statistics, so the
+# logs can be filtered on the node before they are transferred.
+GC_LOG_LINE_FILTER = r'secs\]|Pause|Heap:'
+# Written on the node before the lines of each log file, so that the uptimes
+# of different files are not compared with each other
+GC_LOG_FILE_MARKER = '==> gc log: '
+
+XLOGGC_REGEX = re.compile(r'^-Xloggc:(\S+)$')
+XLOG_GC_REGEX = re.compile(r'^-Xlog:gc[^:]*:(?:file=)?([^:]+)')
+
+JAVA8_PAUSE_REGEX = re.compile(
+    r'(?:(\d+\.\d+): )?\[(GC pause|GC remark|GC cleanup|Full GC)(.*), '
+    r'(\d+\.\d+) secs\]\s*$')
+UNIFIED_PAUSE_REGEX = re.compile(
+    r'GC\(\d+\) Pause (\w+)(.*) (\d+\.\d+)ms\s*$')
+UNIFIED_UPTIME_REGEX = re.compile(r'\[(\d+\.\d+)s\]')
+DETAILS_HEAP_REGEX = re.compile(
+    r'Heap: (\d+(?:\.\d+)?)([BKMG])\(.*?\)->(\d+(?:\.\d+)?)([BKMG])\(')
+HEAP_REGEX = re.compile(
+    r'(\d+(?:\.\d+)?)([BKMG])->(\d+(?:\.\d+)?)([BKMG])\(')
+
+HUMONGOUS_CAUSE = 'Humongous Allocation'
+MEGABYTES_PER_UNIT = {'B': 1.0 / 1024 / 1024, 'K': 1.0 / 1024, 'M': 1.0,
+                      'G': 1024.0}
+
+JAVA8_GC_LOG_OPTIONS = ['-Xloggc:/var/log/presto/gc.log',
+                        '-XX:+PrintGCDetails', '-XX:+PrintGCDateStamps',
+                        '-XX:+UseGCLogFileRotation',
+                        '-XX:NumberOfGCLogFiles=5', '-XX:GCLogFileSize=20M']
+
+
+def find_gc_log_path(jvm_options):
+    """
+    Return the GC log file configured by the given JVM options, or None if
+    GC logging is not enabled. The %p and %t placeholders for the process id
+    and start time are replaced with a * so the result can be used as a glob.
+    """
+    path = None
+    for option in jvm_options:
+        option = option.strip()
+        match = XLOGGC_REGEX.match(option) or XLOG_GC_REGEX.match(option)
+        if match:
+            path = match.group(1)
+    if path is None:
+        return None
+    return path.replace('%p', '*').replace('%t', '*')
+
+
+class GcEvent(object):
+    def __init__(self, uptime, kind, cause, pause_ms):
+        self.uptime = uptime
+        self.kind = kind
+        self.cause = cause
+        self.pause_ms = pause_ms
+        self.heap_before_mb = None
+        self.heap_after_mb = None
+        # Index of the run of events from the same log file and the same JVM
+        self.segment = 0
+
+    def is_full(self):
+        return self.kind in ['Full GC', 'Full']
+
+    def is_humongous(self):
+        return HUMONGOUS_CAUSE in self.cause
+
+    def set_heap(self, match):
+        before, before_unit, after, after_unit = match.groups()
+        self.heap_before_mb = float(before) * MEGABYTES_PER_UNIT[before_unit]
+        self.heap_after_mb = float(after) * MEGABYTES_PER_UNIT[after_unit]
+
+
+def parse_gc_log(lines):
+    """
+    Return the list of GcEvent for the stop-the-world pauses in lines.
+
+    A new segment of events starts after each GC_LOG_FILE_MARKER line and
+    when the uptime goes backwards, i.e. the JVM was restarted.
+    """
+    events = []
+    segment = 0
+    last_uptime = None
+    for line in lines:
+        if line.startswith(GC_LOG_FILE_MARKER):
+            segment += 1
+            last_uptime = None
+            continue
+        match = JAVA8_PAUSE_REGEX.search(line)
+        if match:
+            uptime, kind, cause, secs = match.groups()
+            event = GcEvent(_to_float(uptime), kind, cause,
+                            float(secs) * 1000)
+            events.append(event)
+        else:
+            match = UNIFIED_PAUSE_REGEX.search(line)
+            if match:
+                kind, cause, millis = match.groups()
+                uptime_match = UNIFIED_UPTIME_REGEX.search(line)
+                uptime = uptime_match.group(1) if uptime_match else None
+                event = GcEvent(_to_float(uptime), kind, cause, float(millis))
+                events.append(event)
+        if match:
+            if event.uptime is not None:
+                if last_uptime is not None and event.uptime < last_uptime:
+                    segment += 1
+                last_uptime = event.uptime
+            event.segment = segment
+
+        # With -XX:+PrintGCDetails the heap occupancy of a pause is logged on
+        # one of the lines following it.
+        if events and events[-1].heap_before_mb is None and \
+                events[-1].segment == segment:
+            heap_match = DETAILS_HEAP_REGEX.search(line) or (
+                match and HEAP_REGEX.search(line))
+            if heap_match:
+                events[-1].set_heap(heap_match)
+    return events
+
+
+def _to_float(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+def compute_gc_statistics(events):
+    """
+    Summarize the GC pauses of one node. The allocation rate is the heap
+    growth between consecutive pauses divided by the time between the first
+    and the last pause, both summed over the segments of the events, since
+    neither the heap nor the uptime carries over from one log file or JVM
+    run to the next.
+    """
+    pauses = [event.pause_ms for event in events]
+    allocated_mb = 0.0
+    previous = None
+    for event in events:
+        if event.heap_before_mb is None:
+            continue
+        if previous is not None and previous.segment == event.segment:
+            allocated_mb += max(0.0, event.heap_before_mb -
+                                previous.heap_after_mb)
+        previous = event
+
+    # segment -> (first uptime, last uptime)
+    spans = {}
+    for event in events:
+        if event.uptime is not None:
+            first, _ = spans.get(event.segment, (event.uptime, None))
+            spans[event.segment] = (first, event.uptime)
+    elapsed = sum(last - first for first, last in spans.values())
+    allocation_rate = None
+    if elapsed > 0:
+        allocation_rate = allocated_mb / elapsed
+
+    return {'pauses': len(pauses),
+            'total_pause_ms': sum(pauses),
+            'p50_pause_ms': percentile(pauses, 0.5),
+            'p99_pause_ms': percentile(pauses, 0.99),
+            'max_pause_ms': max(pauses) if pauses else None,
+            'full_gcs': len([e for e in events if e.is_full()]),
+            'humongous_allocations': len([e for e in events
+                                          if e.is_humongous()]),
+            'allocation_rate_mb_per_sec': allocation_rate}
+
+
+def rank_nodes(statistics_by_host):
+    """
+    Return (host, statistics) pairs ordered from the worst node to the best
+    one: by the number of full GCs, then by the 99th percentile pause, then by
+    the longest pause.
+    """
+    def badness(item):
+        stats = item[1]
+        return (stats['full_gcs'], stats['p99_pause_ms'] or 0,
+                stats['max_pause_ms'] or 0)
+    return sorted(statistics_by_host.items(), key=badness, reverse=True)
+
+
+def format_ranking(statistics_by_host):
+    header = ('Host', 'Pauses', 'p50 ms', 'p99 ms', 'Max ms', 'Full GCs',
+              'Humongous', 'Alloc MB/s')
+    rows = [header]
+    for host, stats in rank_nodes(statistics_by_host):
+        rows.append((host, str(stats['pauses']),
+                     _format_number(stats['p50_pause_ms']),
+                     _format_number(stats['p99_pause_ms']),
+                     _format_number(stats['max_pause_ms']),
+                     str(stats['full_gcs']),
+                     str(stats['humongous_allocations']),
+                     _format_number(stats['allocation_rate_mb_per_sec'])))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return '\n'.join('  '.join(value.ljust(width) for value, width
+                               in zip(row, widths)).rstrip()
+                     for row in rows)
+
+
+def _format_number(value):
+    if value is None:
+        return '-'
+    return '%.1f' % value
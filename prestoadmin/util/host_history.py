@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for the history of how long each host took to run each task, and of
+the rate at which files were transferred to each host.
+
+When a parallel task runs on more hosts than the pool size, the hosts
+started last decide when the task finishes, so the hosts that took the
+longest before are started first. The same history gives an estimate of
+the time left while the task runs.
+"""
+import heapq
+import json
+import logging
+import os
+from collections import defaultdict
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_config_directory
+from prestoadmin.util.stats import percentile
+
+_LOGGER = logging.getLogger(__name__)
+
+HISTORY_FILE_NAME = 'host_history.json'
+# Weight of the latest run in the moving averages of the history
+SMOOTHING = 0.5
+# Smaller transfers take about as long whatever the rate of the link
+MIN_TRANSFER_BYTES = 64 * 1024
+
+
+def get_history_path():
+    return os.path.join(get_config_directory(), HISTORY_FILE_NAME)
+
+
+class HostHistory(object):
+    """
+    The durations of the tasks on each host, and the transfer rates to each
+    host, averaged over the previous runs
+    """
+    def __init__(self, durations=None, transfer_rates=None):
+        # task name -> host -> seconds
+        self.durations = defaultdict(dict)
+        for command, hosts in (durations or {}).items():
+            self.durations[command].update(hosts)
+        # host -> bytes per second
+        self.transfer_rates = dict(transfer_rates or {})
+
+    @classmethod
+    def load(cls):
+        try:
+            with open(get_history_path()) as history_file:
+                data = json.load(history_file)
+        except (IOError, ValueError):
+            return cls()
+        return cls(data.get('durations'), data.get('transfer_rates'))
+
+    def save(self):
+        history_path = get_history_path()
+        try:
+            ensure_directory_exists(os.path.dirname(history_path))
+            with open(history_path, 'w') as history_file:
+                json.dump({'durations': self.durations,
+                           'transfer_rates': self.transfer_rates},
+                          history_file)
+        except (IOError, OSError) as e:
+            _LOGGER.debug('Could not store %s: %s', history_path, e)
+
+    def estimate(self, command, host):
+        """
+        Return the seconds the task is expected to take on host, or None if
+        it has never run. A host the task has not run on is expected to take
+        the median time of the other hosts, scaled by how its transfer rate
+        compares to theirs.
+        """
+        durations = self.durations.get(command)
+        if not durations:
+            return None
+        if host in durations:
+            return durations[host]
+        typical = percentile(durations.values(), 0.5)
+        rates = [self.transfer_rates[other] for other in durations
+                 if other in self.transfer_rates]
+        if host in self.transfer_rates and rates:
+            return typical * percentile(rates, 0.5) / \
+                self.transfer_rates[host]
+        return typical
+
+    def order(self, command, hosts):
+        """
+        Return the hosts in the order to start them in so that the task
+        finishes soonest: longest expected time first. Hosts with the same
+        expected time, or with none, keep their order.
+        """
+        def expected_time(host):
+            return self.estimate(command, host) or 0
+        return sorted(hosts, key=lambda host: -expected_time(host))
+
+    def record_duration(self, command, host, seconds):
+        self.durations[command][host] = _average(
+            self.durations[command].get(host), seconds)
+
+    def record_transfer(self, host, byte_count, seconds):
+        if byte_count < MIN_TRANSFER_BYTES or seconds <= 0:
+            return
+        self.transfer_rates[host] = _average(
+            self.transfer_rates.get(host), byte_count / seconds)
+
+
+def _average(old, new):
+    if old is None:
+        return new
+    return SMOOTHING * new + (1 - SMOOTHING) * old
+
+
+def record_transfers(events):
+    """
+    Add the transfer rate to each host in the trace events of a run to the
+    history
+    """
+    transfers = defaultdict(lambda: [0, 0.0])
+    for event in events:
+        args = event.get('args', {})
+        if event.get('cat') == 'transfer' and args.get('host') and \
+                args.get('bytes'):
+            transfers[args['host']][0] += args['bytes']
+            transfers[args['host']][1] += event['dur'] / 1000000.0
+    if not transfers:
+        return
+    history = HostHistory.load()
+    for host, (byte_count, seconds) in transfers.items():
+        history.record_transfer(host, byte_count, seconds)
+    history.save()
+
+
+def estimate_remaining(running, queued, slots):
+    """
+    Estimate the seconds until every job is done by playing out the
+    schedule: each queued job starts on the first of the slots to free up.
+
+    Parameters:
+        running - the seconds left for each running job
+        queued - the expected seconds of each queued job, in start order
+        slots - how many jobs run at once
+    """
+    free_at = [max(0.0, left) for left in running]
+    free_at += [0.0] * (slots - len(free_at))
+    heapq.heapify(free_at)
+    for seconds in queued:
+        heapq.heappush(free_at, heapq.heappop(free_at) + seconds)
+    return max(free_at) if free_at else 0.0
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes:
+        return '%dm%02ds' % (minutes, seconds)
+    return '%ds' % seconds
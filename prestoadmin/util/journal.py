@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for journaling the progress of commands on each host, so that a
+command that failed on some of the hosts can be resumed with --resume.
+
+Running a command decorated with @resumable records its arguments in
+~/.prestoadmin/journal/run.json. As the command goes, each completed step on
+a host, and each task that completed on a host, is appended as a line to
+~/.prestoadmin/journal/steps.log. The processes that run parallel tasks
+append to the same file; each line is written with a single write to a file
+opened for appending, so the lines do not interleave.
+
+Resuming runs the recorded command again with the same arguments, but skips
+the tasks and the steps that had completed on each host.
+"""
+import json
+import logging
+import os
+import time
+
+from fabric.api import env
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_config_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+JOURNAL_DIR_NAME = 'journal'
+RUN_FILE_NAME = 'run.json'
+STEPS_FILE_NAME = 'steps.log'
+
+# The steps that completed in the run being resumed, as a dictionary of
+# (host, step) to the recorded value. Only these are skipped; the steps
+# recorded as this run goes are not, so that a step that runs twice on a
+# host in one command runs both times.
+_resumed_steps = None
+_steps_path = None
+
+
+def resumable(func):
+    """
+    Decorator for the tasks whose progress is journaled so that they can be
+    resumed with --resume
+    """
+    func.resumable = True
+    return func
+
+
+def get_journal_directory():
+    return os.path.join(get_config_directory(), JOURNAL_DIR_NAME)
+
+
+def load_run():
+    """
+    Return the recorded run, or None if there is none
+    """
+    try:
+        with open(os.path.join(get_journal_directory(),
+                               RUN_FILE_NAME)) as run_file:
+            return json.load(run_file)
+    except (IOError, ValueError):
+        return None
+
+
+def start(arguments, hosts, exclude_hosts):
+    """
+    Start journaling a new run of the command given by arguments, the
+    command line options and the words that name the command and give its
+    arguments, so that --resume can replay them.
+    """
+    global _resumed_steps, _steps_path
+    journal_dir = get_journal_directory()
+    ensure_directory_exists(journal_dir)
+    with open(os.path.join(journal_dir, RUN_FILE_NAME), 'w') as run_file:
+        json.dump({'arguments': arguments, 'cwd': os.getcwd(),
+                   'hosts': hosts, 'exclude_hosts': exclude_hosts,
+                   'started': time.time()}, run_file, indent=4)
+    _steps_path = os.path.join(journal_dir, STEPS_FILE_NAME)
+    open(_steps_path, 'w').close()
+    _resumed_steps = {}
+
+
+def resume():
+    """
+    Continue journaling the recorded run, skipping the steps it completed
+    """
+    global _resumed_steps, _steps_path
+    _steps_path = os.path.join(get_journal_directory(), STEPS_FILE_NAME)
+    _resumed_steps = {}
+    try:
+        with open(_steps_path) as steps_file:
+            for line in steps_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the interruption
+                    continue
+                _resumed_steps[(entry['host'], entry['step'])] = \
+                    entry.get('value')
+    except IOError:
+        pass
+    return _resumed_steps
+
+
+def stop():
+    global _resumed_steps, _steps_path
+    _resumed_steps = None
+    _steps_path = None
+
+
+def is_active():
+    return _steps_path is not None
+
+
+def task_step(command):
+    return 'task:%s' % command
+
+
+def is_done(host, step):
+    return _resumed_steps is not None and (host, step) in _resumed_steps
+
+
+def record(host, step, value=None):
+    """
+    Record that step completed on host, along with the value it returned if
+    the value is needed to resume the steps after it
+    """
+    if _steps_path is None:
+        return
+    entry = {'host': host, 'step': step, 'value': value, 'time': time.time()}
+    try:
+        line = json.dumps(entry) + '\n'
+    except TypeError:
+        # Only values that can be written as JSON are kept
+        entry['value'] = None
+        line = json.dumps(entry) + '\n'
+    fd = os.open(_steps_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def run_step(name, func, *args, **kwargs):
+    """
+    Run a step of a task on the current host and record that it completed.
+    When resuming, a step that completed is skipped and the value it
+    returned then is returned instead.
+    """
+    host = env.host_string
+    if is_done(host, name):
+        print('[%s] Skipping %s, which already completed' % (host, name))
+        _LOGGER.info('Skipping step %s on %s, which already completed',
+                     name, host)
+        return _resumed_steps[(host, name)]
+    value = func(*args, **kwargs)
+    record(host, name, value)
+    return value
+
+
+def command_step(name, func, *args, **kwargs):
+    """
+    Run a step of the command itself rather than of a host, like creating
+    something every host of the command shares, and record that it
+    completed. When resuming, a step that completed is skipped and the value
+    it returned then is returned instead.
+    """
+    if is_done(None, name):
+        _LOGGER.info('Skipping step %s, which already completed', name)
+        return _resumed_steps[(None, name)]
+    value = func(*args, **kwargs)
+    record(None, name, value)
+    return value
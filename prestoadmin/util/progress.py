@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for showing the progress of a parallel task across its hosts.
+
+The processes that run the task on each host report the phase they are in
+and the bytes they transfer through the queue that carries their results
+back to the parent process, where a Dashboard keeps count. On a terminal
+the dashboard is redrawn in place below the output, and the output of the
+hosts is sent through the same queue so that the parent is the only process
+writing to the terminal. Otherwise a summary is printed every so often.
+"""
+import fcntl
+import struct
+import sys
+import termios
+import time
+
+from fabric.api import env
+
+from prestoadmin.util.host_history import format_duration
+
+# Seconds between redraws on a terminal, and between summaries otherwise
+LIVE_INTERVAL = 0.5
+SUMMARY_INTERVAL = 30
+SLOWEST_HOST_COUNT = 3
+
+WAITING = 'waiting'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# The queue to report to, set in the processes that run a task on a host
+_queue = None
+
+
+def set_queue(queue):
+    global _queue
+    _queue = queue
+
+
+def report(**fields):
+    """
+    Report the progress of the task on the current host, e.g. the phase it
+    is in or the bytes it transferred. Does nothing outside of the processes
+    that run a parallel task with a dashboard.
+    """
+    if _queue is not None:
+        _queue.put({'name': env.host_string, 'progress': fields})
+
+
+def is_progress(datum):
+    return 'progress' in datum or 'output' in datum
+
+
+class QueueWriter(object):
+    """
+    File-like object that sends each complete line written to it through
+    the queue, for the dashboard to print
+    """
+    def __init__(self, queue, name, stream_name):
+        self._queue = queue
+        self._name = name
+        self._stream_name = stream_name
+        self._buffer = ''
+
+    def write(self, data):
+        self._buffer += data
+        if '\n' in self._buffer:
+            lines, self._buffer = self._buffer.rsplit('\n', 1)
+            self._queue.put({'name': self._name, 'output': lines + '\n',
+                             'stream': self._stream_name})
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self.write('\n')
+
+    def isatty(self):
+        return False
+
+
+def _terminal_width(stream):
+    try:
+        return struct.unpack('hh', fcntl.ioctl(
+            stream.fileno(), termios.TIOCGWINSZ, '1234'))[1] or 80
+    except (AttributeError, IOError, ValueError):
+        return 80
+
+
+class Dashboard(object):
+    """
+    The state of each host of a parallel task, drawn as a few lines: the
+    hosts done, running, failed and waiting, the transfer rate and the time
+    left, and the slowest of the running hosts with the phase they are in.
+
+    Parameters:
+        command - the name of the task
+        hosts - the hosts it runs on
+        stream - where to draw, sys.stderr by default. The dashboard is
+            live if it is a terminal.
+    """
+    def __init__(self, command, hosts, stream=None):
+        self.command = command
+        self.stream = stream or sys.stderr
+        self.live = self.stream.isatty()
+        self.interval = LIVE_INTERVAL if self.live else SUMMARY_INTERVAL
+        self.hosts = dict((host, {'state': WAITING, 'phase': None,
+                                  'started': None}) for host in hosts)
+        self.bytes_transferred = 0
+        self._start_time = time.time()
+        self._last_draw = self._start_time
+        self._drawn_lines = 0
+
+    def started(self, name):
+        self.hosts[name].update(state=RUNNING, started=time.time())
+
+    def finished(self, name, failed):
+        self.hosts[name].update(state=FAILED if failed else DONE,
+                                phase=None)
+
+    def update(self, datum):
+        """
+        Apply a datum that a host sent through the queue
+        """
+        if 'output' in datum:
+            self.write(datum['output'],
+                       sys.stderr if datum['stream'] == 'stderr'
+                       else sys.stdout)
+            return
+        progress = datum['progress']
+        if 'phase' in progress:
+            self.hosts[datum['name']]['phase'] = progress['phase']
+        self.bytes_transferred += progress.get('transferred', 0)
+
+    def count(self, state):
+        return sum(1 for host in self.hosts.values()
+                   if host['state'] == state)
+
+    def lines(self, time_left=None):
+        now = time.time()
+        elapsed = max(now - self._start_time, 0.001)
+        summary = '%s: %d of %d hosts done, %d running, %d failed, ' \
+                  '%d waiting' % (self.command, self.count(DONE),
+                                  len(self.hosts), self.count(RUNNING),
+                                  self.count(FAILED), self.count(WAITING))
+        if self.bytes_transferred:
+            summary += ', %.1f MB/s' % (
+                self.bytes_transferred / elapsed / (1024 * 1024))
+        if time_left is not None:
+            summary += ', about %s left' % format_duration(time_left)
+        lines = [summary]
+
+        running = sorted((name for name, host in self.hosts.items()
+                          if host['state'] == RUNNING),
+                         key=lambda name: self.hosts[name]['started'])
+        if running:
+            lines.append('Slowest: ' + ', '.join(
+                '%s %s %s' % (name, self.hosts[name]['phase'] or 'running',
+                              format_duration(
+                                  now - self.hosts[name]['started']))
+                for name in running[:SLOWEST_HOST_COUNT]))
+        failed = sorted(name for name, host in self.hosts.items()
+                        if host['state'] == FAILED)
+        if failed:
+            lines.append('Failed: ' + ', '.join(failed))
+        return lines
+
+    def tick(self, time_left=None):
+        """
+        Draw the dashboard if it is time to
+        """
+        if time.time() - self._last_draw >= self.interval:
+            self.draw(time_left)
+
+    def draw(self, time_left=None):
+        self._last_draw = time.time()
+        lines = self.lines(time_left)
+        if self.live:
+            self.clear()
+            width = _terminal_width(self.stream)
+            # Lines that wrap could not be cleared by counting them
+            self.stream.write(''.join(line[:width - 1] + '\n'
+                                      for line in lines))
+            self._drawn_lines = len(lines)
+        else:
+            self.stream.write(''.join(line + '\n' for line in lines))
+        self.stream.flush()
+
+    def clear(self):
+        """
+        Erase the dashboard from the terminal, so that other output can be
+        written in its place
+        """
+        if self._drawn_lines:
+            self.stream.write('\x1b[%dA\x1b[J' % self._drawn_lines)
+            self.stream.flush()
+            self._drawn_lines = 0
+
+    def write(self, text, stream):
+        self.clear()
+        stream.write(text)
+        stream.flush()
+        # Draw again right away rather than leave the host output alone
+        self._last_draw = 0
+
+    def close(self):
+        """
+        Replace the dashboard with a last summary of the task
+        """
+        self.clear()
+        self.stream.write(self.lines()[0] + '\n')
+        self.stream.flush()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for sending the log records of the processes that run parallel tasks
+to the process that started them.
+
+The forked processes inherit the handlers of the root logger, so without this
+every process would write to presto-admin.log on its own. Instead the
+processes put their records on a queue and a thread of the parent process
+hands them to its handlers, so the log file only has one writer. This is
+what logging.handlers.QueueHandler and QueueListener do in Python 3.
+"""
+import logging
+import threading
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler that puts the records on a multiprocessing queue
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        # The arguments and the traceback may not be picklable, so the
+        # message and the traceback are formatted here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Thread that hands the records put on the queue to the given handlers
+    """
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        """
+        Hand the remaining records to the handlers and stop the thread. The
+        processes putting records on the queue must have exited.
+        """
+        self.queue.put_nowait(None)
+        self._thread.join()
+        self._thread = None
+
+
+def start_listener(queue):
+    """
+    Start a listener for the records of the child processes that hands them
+    to the handlers of the root logger.
+    """
+    listener = QueueListener(queue, list(logging.root.handlers))
+    listener.start()
+    return listener
+
+
+def log_to_queue(queue):
+    """
+    Replace the handlers of the root logger of a child process by a handler
+    that puts the records on the queue.
+    """
+    for handler in list(logging.root.handlers):
+        logging.root.removeHandler(handler)
+    logging.root.addHandler(QueueHandler(queue))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for finding the hosts whose SSH port cannot be reached before running
+a task on them.
+
+Connecting to a host that is down takes the whole SSH connection timeout, so
+instead the SSH port of every host is probed at once with a short timeout
+and the hosts that do not answer are failed right away. The results are
+cached for a short time so that the commands run right after do not probe
+the same hosts again.
+"""
+import json
+import logging
+import os
+import socket
+import time
+from multiprocessing.pool import ThreadPool
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_config_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+CACHE_FILE_NAME = 'reachability_cache.json'
+CACHE_TTL = 30
+MAX_PROBE_THREADS = 64
+
+
+def probe(host, port, timeout):
+    """
+    Return None if a TCP connection to host:port can be opened within
+    timeout seconds, or else the reason it could not be.
+    """
+    try:
+        sock = socket.create_connection((host, int(port)), timeout)
+    except socket.timeout:
+        return 'timed out after %g seconds' % timeout
+    except socket.gaierror as e:
+        return 'name lookup failed (%s)' % e.args[-1]
+    except socket.error as e:
+        return e.strerror or str(e)
+    sock.close()
+    return None
+
+
+def get_cache_path():
+    return os.path.join(get_config_directory(), CACHE_FILE_NAME)
+
+
+def _load_cache(now):
+    try:
+        with open(get_cache_path()) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+    return dict((key, entry) for key, entry in cache.items()
+                if now - entry['time'] < CACHE_TTL)
+
+
+def _store_cache(cache):
+    cache_path = get_cache_path()
+    try:
+        ensure_directory_exists(os.path.dirname(cache_path))
+        with open(cache_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+    except (IOError, OSError) as e:
+        _LOGGER.debug('Could not store %s: %s', cache_path, e)
+
+
+def find_unreachable(addresses, timeout):
+    """
+    Probe the SSH port of the given hosts in parallel.
+
+    Parameters:
+        addresses - a list of (host, port) pairs
+        timeout - the seconds to wait for each host
+
+    Returns:
+        a dictionary of (host, port) to the reason it could not be reached,
+        for the unreachable hosts only
+    """
+    now = time.time()
+    cache = _load_cache(now)
+    to_probe = [(host, port) for host, port in set(addresses)
+                if '%s:%s' % (host, port) not in cache]
+    if to_probe:
+        pool = ThreadPool(min(len(to_probe), MAX_PROBE_THREADS))
+        try:
+            reasons = pool.map(lambda address: probe(address[0], address[1],
+                                                     timeout), to_probe)
+        finally:
+            pool.close()
+            pool.join()
+        for (host, port), reason in zip(to_probe, reasons):
+            cache['%s:%s' % (host, port)] = {'time': now, 'error': reason}
+        _store_cache(cache)
+
+    unreachable = {}
+    for host, port in addresses:
+        reason = cache['%s:%s' % (host, port)]['error']
+        if reason is not None:
+            unreachable[(host, port)] = reason
+    return unreachable
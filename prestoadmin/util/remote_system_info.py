@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Script run on each node by collect system_info. It prints a JSON report of
+the platform, Java and Presto versions, hardware, resource limits and catalog
+files of the node.
+
+The source of this module is sent to the nodes as is, so it must only use
+the standard library and run with any python the node has, from 2.6 on.
+"""
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+
+NODE_PROPERTIES = '/etc/presto/node.properties'
+DEFAULT_CATALOG_DIR = '/etc/presto/catalog'
+DEFAULT_DATA_DIR = '/var/lib/presto/data'
+DEFAULT_LOG_DIR = '/var/log/presto'
+PRESTO_PACKAGES = ['presto', 'presto-server-rpm']
+PRESTO_SERVER_MAIN_CLASS = 'com.facebook.presto.server.PrestoServer'
+MEMINFO_KEYS = ['MemTotal', 'MemFree', 'MemAvailable', 'SwapTotal',
+                'SwapFree']
+RESOURCE_LIMITS = {'Max open files': 'RLIMIT_NOFILE',
+                   'Max processes': 'RLIMIT_NPROC',
+                   'Max locked memory': 'RLIMIT_MEMLOCK',
+                   'Max address space': 'RLIMIT_AS'}
+
+
+def run_command(args):
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    except OSError:
+        return None, None
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    return process.returncode, output.strip()
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+
+def read_properties(path):
+    properties = {}
+    for line in (read_file(path) or '').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#') and '=' in line:
+            key, value = line.split('=', 1)
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def get_platform_info():
+    distribution = (read_file('/etc/redhat-release') or '').strip()
+    if not distribution:
+        for line in (read_file('/etc/os-release') or '').splitlines():
+            if line.startswith('PRETTY_NAME='):
+                distribution = line.split('=', 1)[1].strip('"')
+    return {'uname': ' '.join(os.uname()),
+            'distribution': distribution,
+            'python': platform.python_version()}
+
+
+def get_java_version():
+    return_code, output = run_command(['java', '-version'])
+    if return_code is None:
+        return None
+    return output
+
+
+def get_rpm_versions():
+    versions = {}
+    for package in PRESTO_PACKAGES:
+        return_code, output = run_command(
+            ['rpm', '-q', '--qf', '%{VERSION}', package])
+        if return_code == 0:
+            versions[package] = output
+    return versions
+
+
+def get_cpu_info():
+    models = [line.split(':', 1)[1].strip() for line in
+              (read_file('/proc/cpuinfo') or '').splitlines()
+              if line.startswith('model name')]
+    return {'count': os.sysconf('SC_NPROCESSORS_ONLN'),
+            'model': models[0] if models else None,
+            'load_average': list(os.getloadavg())}
+
+
+def get_memory_info():
+    memory = {}
+    for line in (read_file('/proc/meminfo') or '').splitlines():
+        key, _, value = line.partition(':')
+        if key in MEMINFO_KEYS:
+            memory[key] = int(value.split()[0]) * 1024
+    return memory
+
+
+def get_disk_info(paths):
+    disks = {}
+    for path in paths:
+        try:
+            stat = os.statvfs(path)
+        except OSError:
+            continue
+        disks[path] = {'total_bytes': stat.f_blocks * stat.f_frsize,
+                       'available_bytes': stat.f_bavail * stat.f_frsize}
+    return disks
+
+
+def find_presto_server_pid():
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        command_line = read_file(os.path.join('/proc', pid, 'cmdline'))
+        if command_line and PRESTO_SERVER_MAIN_CLASS in command_line:
+            return int(pid)
+    return None
+
+
+def get_ulimits(pid):
+    """
+    Return the resource limits of the Presto server process if it is running,
+    otherwise the limits this script runs with.
+    """
+    limits = {}
+    if pid is not None:
+        lines = (read_file('/proc/%d/limits' % pid) or '').splitlines()[1:]
+        for line in lines:
+            name = line[:26].strip()
+            values = line[26:].split()
+            if name in RESOURCE_LIMITS and len(values) >= 2:
+                limits[name] = {'soft': values[0], 'hard': values[1]}
+        return {'source': 'presto server', 'limits': limits}
+
+    for name, limit in RESOURCE_LIMITS.items():
+        soft, hard = resource.getrlimit(getattr(resource, limit))
+        limits[name] = {'soft': _format_limit(soft),
+                        'hard': _format_limit(hard)}
+    return {'source': 'shell', 'limits': limits}
+
+
+def _format_limit(value):
+    if value == resource.RLIM_INFINITY:
+        return 'unlimited'
+    return str(value)
+
+
+def get_catalog_files(catalog_dir):
+    catalogs = {}
+    try:
+        names = sorted(os.listdir(catalog_dir))
+    except OSError:
+        return catalogs
+    for name in names:
+        path = os.path.join(catalog_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            content = f.read()
+        catalogs[name] = {'sha256': hashlib.sha256(content).hexdigest(),
+                          'content': content.decode('utf-8', 'replace')}
+    return catalogs
+
+
+def get_system_report():
+    node_properties = read_properties(NODE_PROPERTIES)
+    catalog_dir = node_properties.get('catalog.config-dir',
+                                      DEFAULT_CATALOG_DIR)
+    data_dir = node_properties.get('node.data-dir', DEFAULT_DATA_DIR)
+    return {'platform': get_platform_info(),
+            'java_version': get_java_version(),
+            'rpm_versions': get_rpm_versions(),
+            'cpu': get_cpu_info(),
+            'memory': get_memory_info(),
+            'disk': get_disk_info(['/', '/tmp', data_dir, DEFAULT_LOG_DIR]),
+            'ulimits': get_ulimits(find_presto_server_pid()),
+            'catalog_dir': catalog_dir,
+            'catalogs': get_catalog_files(catalog_dir)}
+
+
+if __name__ == '__main__':
+    json.dump(get_system_report(), sys.stdout, indent=4, sort_keys=True)
+    sys.stdout.write('\n')
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for the report of a presto-admin run: what each host did and how long
+it took, built from the spans recorded by prestoadmin.util.tracing.
+"""
+import json
+from collections import defaultdict
+
+from prestoadmin.util.stats import percentile
+
+REPORT_FILE_NAME = 'presto-admin-report.json'
+
+SUMMARY_METRICS = ['duration', 'connect_time', 'commands',
+                   'bytes_transferred', 'retries']
+
+
+def _new_host_report():
+    return {'status': 'ok', 'duration': 0.0, 'connect_time': 0.0,
+            'commands': 0, 'bytes_transferred': 0, 'retries': 0,
+            'phases': defaultdict(float)}
+
+
+def build_report(events, command):
+    """
+    Build the report of a run from its trace events.
+
+    Parameters:
+        events - the events returned by tracing.finish()
+        command - the command that was run, e.g. 'server install'
+
+    Returns:
+        a dictionary with the command, a report for each host that the
+        command ran on and, in 'summary', the p50, p95 and max of each
+        metric across the hosts
+    """
+    hosts = defaultdict(_new_host_report)
+    task_times = defaultdict(list)
+    for event in events:
+        args = event.get('args', {})
+        host = args.get('host')
+        if not host or event['ph'] == 'M':
+            continue
+        host_report = hosts[host]
+        category = event.get('cat')
+        if category == 'retry':
+            host_report['retries'] += 1
+            continue
+        seconds = event['dur'] / 1000000.0
+        if category == 'task':
+            task_times[host].append((event['ts'], event['ts'] + event['dur']))
+            if 'error' in args:
+                host_report['status'] = 'failed (%s)' % args['error']
+        elif category == 'ssh':
+            host_report['connect_time'] += seconds
+        elif category == 'command':
+            host_report['commands'] += 1
+        elif category == 'transfer':
+            host_report['bytes_transferred'] += args.get('bytes', 0)
+        if 'phase' in args:
+            host_report['phases'][args['phase']] += seconds
+
+    for host, times in task_times.items():
+        hosts[host]['duration'] = (max(end for start, end in times) -
+                                   min(start for start, end in times)) \
+            / 1000000.0
+    for host_report in hosts.values():
+        host_report['phases'] = dict(host_report['phases'])
+
+    return {'command': command, 'hosts': dict(hosts),
+            'summary': _summarize(hosts.values())}
+
+
+def _summarize(host_reports):
+    metrics = list(SUMMARY_METRICS)
+    for host_report in host_reports:
+        metrics.extend('phases.' + phase for phase in
+                       sorted(host_report['phases'])
+                       if 'phases.' + phase not in metrics)
+
+    summary = {}
+    for metric in metrics:
+        values = [_get_metric(host_report, metric)
+                  for host_report in host_reports]
+        summary[metric] = {'p50': percentile(values, 0.5),
+                           'p95': percentile(values, 0.95),
+                           'max': max(values) if values else None}
+    return summary
+
+
+def _get_metric(host_report, metric):
+    if metric.startswith('phases.'):
+        return host_report['phases'].get(metric[len('phases.'):], 0.0)
+    return host_report[metric]
+
+
+def format_summary(report):
+    """
+    Return the report as a table with a row for each host, slowest first,
+    followed by the p50, p95 and max rows.
+    """
+    phases = sorted(metric[len('phases.'):] for metric in report['summary']
+                    if metric.startswith('phases.'))
+    header = ['Host', 'Status', 'Total(s)', 'Connect(s)', 'Commands',
+              'Bytes', 'Retries'] + ['%s(s)' % phase for phase in phases]
+    rows = []
+    for host, host_report in sorted(report['hosts'].items(),
+                                    key=lambda item: -item[1]['duration']):
+        rows.append([host, host_report['status']] +
+                    _format_metrics(lambda metric: _get_metric(host_report,
+                                                               metric),
+                                    phases))
+    for statistic in ['p50', 'p95', 'max']:
+        rows.append([statistic, ''] + _format_metrics(
+            lambda metric: report['summary'][metric][statistic], phases))
+
+    widths = [max(len(row[i]) for row in [header] + rows)
+              for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in
+                       zip(row, widths)).rstrip()
+             for row in [header] + rows]
+    return '\n'.join(['Run report for %s:' % report['command']] + lines)
+
+
+def _format_metrics(get_metric, phases):
+    cells = []
+    for metric in SUMMARY_METRICS + ['phases.' + phase for phase in phases]:
+        value = get_metric(metric)
+        if isinstance(value, float):
+            cells.append('%.2f' % value)
+        else:
+            cells.append(str(value))
+    return cells
+
+
+def write_report(report, path):
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
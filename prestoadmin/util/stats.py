@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Simple statistics helpers for summarizing timings across hosts
+"""
+import math
+
+
+def percentile(values, fraction):
+    """
+    Return the value below which the given fraction of values fall, using the
+    nearest-rank method. Returns None if there are no values.
+
+    Parameters:
+        values - the values to summarize, in any order
+        fraction - a number between 0 and 1, e.g. 0.99 for the 99th percentile
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(fraction * len(ordered)))
+    return ordered[max(rank, 1) - 1]
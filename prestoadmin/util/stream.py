@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for streaming a local file into a command on the current host, and
+the output of a command on it into a local file, over the SSH channel that
+the command runs on, rather than through a temporary file on the host.
+
+Fabric runs sudo with a pty, which would mangle the bytes of the file, and
+has no way to give a command its stdin. The commands here run on a channel
+of their own, with sudo -n, so they can only be streamed to the hosts that
+the user is root on or may sudo on without a password or a tty. can_stream
+tells whether the current host is one of them, and the callers fall back to
+put or get otherwise.
+"""
+import hashlib
+import logging
+import os
+import pipes
+import socket
+import threading
+
+from fabric.api import env
+from fabric.context_managers import settings, hide
+from fabric.operations import _AttributeString, run
+from fabric.state import connections
+
+from prestoadmin.util import progress, tracing
+
+CHUNK_SIZE = 64 * 1024
+
+_LOGGER = logging.getLogger(__name__)
+
+# host -> whether commands can be streamed to it
+_can_stream = {}
+
+
+def can_stream():
+    """
+    Return whether commands can be streamed to the current host
+    """
+    host = env.host_string
+    if host not in _can_stream:
+        if env.user == 'root':
+            _can_stream[host] = True
+        else:
+            with settings(hide('everything'), warn_only=True):
+                _can_stream[host] = run('sudo -n true', pty=False).succeeded
+        if not _can_stream[host]:
+            _LOGGER.info('Not streaming to %s, which needs a password or a '
+                         'tty for sudo' % host)
+    return _can_stream[host]
+
+
+def stream_in(local_path, command):
+    """
+    Run command as root on the current host with the content of the file at
+    local_path as its stdin. Return its output like sudo does, with the
+    sha256 of the content sent in the sha256 attribute, for the command to
+    be checked against.
+    """
+    size = os.path.getsize(local_path)
+    digest = hashlib.sha256()
+    with tracing.operation_span('stream', 'transfer', env.host_string,
+                                paths=[local_path],
+                                command=command) as span:
+        span.args['bytes'] = size
+        channel = _open_channel(command)
+        channel.set_combine_stderr(True)
+        reader = _Reader(channel.recv)
+        with open(local_path, 'rb') as local_file:
+            try:
+                for chunk in iter(lambda: local_file.read(CHUNK_SIZE), ''):
+                    digest.update(chunk)
+                    channel.sendall(chunk)
+                channel.shutdown_write()
+            except socket.error:
+                # The command exited before reading all of its input, which
+                # its exit status tells about
+                pass
+        result = _finish(channel, reader, command)
+    progress.report(transferred=size)
+    result.sha256 = digest.hexdigest()
+    return result
+
+
+def stream_out(command, local_path):
+    """
+    Run command as root on the current host and write its standard output
+    to the file at local_path. Return its standard error like sudo returns
+    the output.
+    """
+    size = 0
+    with tracing.operation_span('stream', 'transfer', env.host_string,
+                                paths=[local_path],
+                                command=command) as span:
+        channel = _open_channel(command)
+        reader = _Reader(channel.recv_stderr)
+        with open(local_path, 'wb') as local_file:
+            for chunk in iter(lambda: channel.recv(CHUNK_SIZE), ''):
+                local_file.write(chunk)
+                size += len(chunk)
+        span.args['bytes'] = size
+        result = _finish(channel, reader, command)
+    progress.report(transferred=size)
+    return result
+
+
+def _real_command(command):
+    command = '/bin/bash -c ' + pipes.quote(command)
+    if env.user != 'root':
+        command = 'sudo -n ' + command
+    return command
+
+
+def _open_channel(command):
+    channel = connections[env.host_string].get_transport().open_session()
+    channel.exec_command(_real_command(command))
+    return channel
+
+
+class _Reader(threading.Thread):
+    """
+    Read the output of a command while its input is being sent, so that
+    neither side waits for the other to read
+    """
+    def __init__(self, recv):
+        super(_Reader, self).__init__()
+        self.daemon = True
+        self._recv = recv
+        self.output = []
+        self.start()
+
+    def run(self):
+        for chunk in iter(lambda: self._recv(CHUNK_SIZE), ''):
+            self.output.append(chunk)
+
+
+def _finish(channel, reader, command):
+    reader.join()
+    return_code = channel.recv_exit_status()
+    channel.close()
+    result = _AttributeString(''.join(reader.output).strip())
+    result.command = command
+    result.real_command = _real_command(command)
+    result.return_code = return_code
+    result.succeeded = return_code == 0
+    result.failed = not result.succeeded
+    _LOGGER.info('\nSTREAMED COMMAND: %s\nEXIT CODE: %d\nOUTPUT: %s' % (
+        command, return_code, result))
+    return result
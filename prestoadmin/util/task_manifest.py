@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for listing the tasks of the task modules without importing them.
+
+Importing the task modules pulls in most of the dependencies of presto-admin,
+so instead their source is scanned for the functions decorated with @task,
+which gives the names and docstrings needed for the list of commands and for
+--display. The module of a command is only imported when the command runs.
+
+The tasks found are cached in ~/.prestoadmin/task_manifest.json along with
+the modification time of each source file, so a module is only scanned again
+when it changes. A module installed without its source is imported instead.
+"""
+import ast
+import json
+import logging
+import os
+import sys
+
+from fabric.task_utils import _Dict
+from fabric.tasks import Task
+
+from prestoadmin.util.filesystem import ensure_directory_exists
+from prestoadmin.util.local_config_util import get_config_directory
+
+_LOGGER = logging.getLogger(__name__)
+
+TASK_DECORATOR = 'task'
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_FILE_NAME = 'task_manifest.json'
+
+
+def import_module(module_name):
+    """
+    Import the module with the given dotted name and return it, rather than
+    the top-level package that __import__ returns
+    """
+    __import__(module_name)
+    return sys.modules[module_name]
+
+
+class LazyTask(Task):
+    """
+    Stand-in for a task whose module has not been imported yet.
+    """
+    def __init__(self, name, doc, module_name):
+        super(LazyTask, self).__init__(name=name)
+        self.__doc__ = doc
+        self.module_name = module_name
+
+    def resolve(self):
+        return getattr(import_module(self.module_name), self.name)
+
+    def run(self, *args, **kwargs):
+        return self.resolve().run(*args, **kwargs)
+
+
+class LazyTaskModule(_Dict):
+    """
+    Collection of the LazyTasks of a task module, in the format of the
+    collections in fabric.state.commands.
+    """
+    def __init__(self, module_name, tasks):
+        super(LazyTaskModule, self).__init__(tasks)
+        self.module_name = module_name
+
+
+def scan_task_module(path):
+    """
+    Return the (name, docstring) pairs of the top level functions decorated
+    with @task in the given python source file, limited to the names in
+    __all__ if the module defines it.
+    """
+    with open(path) as source:
+        tree = ast.parse(source.read(), path)
+
+    exported = None
+    tasks = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and \
+                any(isinstance(target, ast.Name) and target.id == '__all__'
+                    for target in node.targets):
+            exported = [element.s for element in node.value.elts]
+        elif isinstance(node, ast.FunctionDef) and \
+                any(_is_task_decorator(decorator)
+                    for decorator in node.decorator_list):
+            tasks.append((node.name, ast.get_docstring(node, clean=False)))
+
+    if exported is None:
+        return tasks
+    return [(name, doc) for name, doc in tasks if name in exported]
+
+
+def _is_task_decorator(decorator):
+    if isinstance(decorator, ast.Call):
+        decorator = decorator.func
+    if isinstance(decorator, ast.Attribute):
+        return decorator.attr == TASK_DECORATOR
+    return isinstance(decorator, ast.Name) and decorator.id == TASK_DECORATOR
+
+
+def get_module_path(module_name):
+    """
+    Return the source file of a module of the prestoadmin package, e.g.
+    prestoadmin/yarn_slider/server.py for yarn_slider.server.
+    """
+    return os.path.join(PACKAGE_DIR, *module_name.split('.')) + '.py'
+
+
+def import_module_tasks(module_name):
+    """
+    Return the (name, docstring) pairs of the tasks of the given module by
+    importing it, for a module whose source is not installed
+    """
+    module = import_module(module_name)
+    names = getattr(module, '__all__', None) or sorted(vars(module))
+    return [(name, getattr(module, name).__doc__) for name in names
+            if isinstance(getattr(module, name, None), Task)]
+
+
+def get_cache_path():
+    return os.path.join(get_config_directory(), CACHE_FILE_NAME)
+
+
+def _load_cache():
+    try:
+        with open(get_cache_path()) as cache_file:
+            return json.load(cache_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    cache_path = get_cache_path()
+    try:
+        ensure_directory_exists(os.path.dirname(cache_path))
+        with open(cache_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+    except (IOError, OSError) as e:
+        _LOGGER.debug('Could not store %s: %s', cache_path, e)
+
+
+def load_lazy_task_modules(task_modules):
+    """
+    Return a dictionary of subcommand name to LazyTaskModule for the given
+    (module name, subcommand name) pairs. The module names are relative to
+    the prestoadmin package.
+    """
+    # source path -> {'mtime': modification time, 'tasks': (name, doc) pairs}
+    cache = _load_cache()
+    cache_changed = False
+    commands = {}
+    for module_name, subcommand_name in task_modules:
+        full_module_name = 'prestoadmin.' + module_name
+        path = get_module_path(module_name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if mtime is None:
+            tasks = import_module_tasks(full_module_name)
+        elif path in cache and cache[path]['mtime'] == mtime:
+            tasks = cache[path]['tasks']
+        else:
+            tasks = scan_task_module(path)
+            cache[path] = {'mtime': mtime, 'tasks': tasks}
+            cache_changed = True
+        commands[subcommand_name] = LazyTaskModule(
+            full_module_name,
+            [(name, LazyTask(name, doc, full_module_name))
+             for name, doc in tasks])
+    if cache_changed:
+        _save_cache(cache)
+    return commands
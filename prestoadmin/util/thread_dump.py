@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for summarizing the stack samples taken from the Presto server JVM,
+either as jstack thread dumps or as the execution samples of a Java Flight
+Recorder recording printed by the jfr tool.
+"""
+import re
+
+JSTACK_STATE_REGEX = re.compile(r'^\s*java\.lang\.Thread\.State: (\w+)')
+JSTACK_FRAME_REGEX = re.compile(r'^\s*at ([^(\s]+)\(')
+JFR_STATE_REGEX = re.compile(r'^\s*state = "(\w+)"')
+JFR_FRAME_REGEX = re.compile(r'^\s*([^(\s]+)\(')
+JFR_STACK_START = 'stackTrace = ['
+
+RUNNABLE_STATES = ['RUNNABLE', 'STATE_RUNNABLE']
+
+
+def parse_jstack_top_frames(lines):
+    """
+    Return the top frame of every runnable thread in a jstack thread dump.
+    """
+    frames = []
+    runnable = False
+    for line in lines:
+        match = JSTACK_STATE_REGEX.match(line)
+        if match:
+            runnable = match.group(1) in RUNNABLE_STATES
+            continue
+        match = JSTACK_FRAME_REGEX.match(line)
+        if match and runnable:
+            frames.append(match.group(1))
+            runnable = False
+    return frames
+
+
+def parse_jfr_top_frames(lines):
+    """
+    Return the top frame of every runnable execution sample in the output of
+    jfr print --events jdk.ExecutionSample.
+    """
+    frames = []
+    runnable = True
+    in_stack = False
+    for line in lines:
+        match = JFR_STATE_REGEX.match(line)
+        if match:
+            runnable = match.group(1) in RUNNABLE_STATES
+        elif line.strip() == JFR_STACK_START:
+            in_stack = True
+        elif in_stack:
+            match = JFR_FRAME_REGEX.match(line)
+            if match and runnable:
+                frames.append(match.group(1))
+            in_stack = False
+            runnable = True
+    return frames
+
+
+def hottest_frames(frames_by_host, limit):
+    """
+    Return up to limit (frame, samples, hosts) tuples for the frames seen
+    most often on top of the stack across all hosts, most frequent first.
+
+    Parameters:
+        frames_by_host - dictionary of host to the list of top frames sampled
+                         on that host
+        limit - maximum number of frames to return
+    """
+    samples = {}
+    hosts = {}
+    for host, frames in frames_by_host.items():
+        for frame in frames:
+            samples[frame] = samples.get(frame, 0) + 1
+            hosts.setdefault(frame, set()).add(host)
+    ranked = sorted(samples.items(), key=lambda item: (-item[1], item[0]))
+    return [(frame, count, len(hosts[frame]))
+            for frame, count in ranked[:limit]]
+
+
+def format_hottest_frames(frames_by_host, limit):
+    rows = [('Samples', 'Hosts', 'Frame')]
+    for frame, count, host_count in hottest_frames(frames_by_host, limit):
+        rows.append((str(count), str(host_count), frame))
+    widths = [max(len(row[i]) for row in rows) for i in range(2)]
+    return '\n'.join('%s  %s  %s' % (row[0].ljust(widths[0]),
+                                     row[1].ljust(widths[1]), row[2])
+                     for row in rows)
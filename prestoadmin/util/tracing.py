@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Module for recording where a presto-admin command spends its time.
+
+Spans are recorded as a timeline in the Chrome trace event format, which can
+be opened in chrome://tracing or Perfetto, and each process can also be
+profiled with cProfile.
+
+Fabric runs parallel tasks in forked processes, so every process keeps its
+own spans in memory and writes them to its own file in a temporary directory
+when it finishes. The main process then merges the files into the trace file.
+
+The spans of the SSH operations are also the source of the run report, see
+prestoadmin.util.run_report, so they can be recorded without a trace file.
+Operations done inside phase() are attributed to that phase, e.g. 'install'.
+"""
+import cProfile
+from contextlib import contextmanager
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from fabric.api import env
+
+from prestoadmin.util import progress
+
+_LOGGER = logging.getLogger(__name__)
+
+_trace_file = None
+_trace_dir = None
+_profile_dir = None
+_profiler = None
+_events = []
+_phases = []
+
+
+class _Span(object):
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        end = time.time()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        _events.append({'name': self.name, 'cat': self.category, 'ph': 'X',
+                        'ts': int(self.start * 1000000),
+                        'dur': int((end - self.start) * 1000000),
+                        'pid': os.getpid(),
+                        'tid': threading.current_thread().ident,
+                        'args': self.args})
+        return False
+
+
+class _NoSpan(object):
+    @property
+    def args(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def start(trace_file=None, profile_dir=None, record=False):
+    """
+    Start tracing into trace_file and/or profiling every process into
+    profile_dir. Either can be None. If record is True the spans are
+    recorded for finish() to return even without a trace file.
+    """
+    global _trace_file, _trace_dir, _profile_dir
+    _trace_file = trace_file
+    _profile_dir = profile_dir
+    if trace_file or record:
+        _trace_dir = tempfile.mkdtemp(prefix='presto-admin-trace-')
+    start_process()
+
+
+def is_enabled():
+    return _trace_dir is not None
+
+
+def span(name, category, **args):
+    """
+    Return a context manager that records the time spent in it as a span,
+    or does nothing if tracing is not enabled.
+    """
+    if _trace_dir is None:
+        return _NO_SPAN
+    return _Span(name, category, args)
+
+
+def operation_span(name, category, host, **args):
+    """
+    Return a span for an operation on a host, attributed to the current
+    phase or, outside of any phase, to its category.
+    """
+    return span(name, category, host=host,
+                phase=_phases[-1] if _phases else category, **args)
+
+
+@contextmanager
+def phase(name):
+    """
+    Attribute the operations done in the block to the phase name, e.g.
+    'transfer', 'install', 'configure' or 'verify'.
+    """
+    _phases.append(name)
+    progress.report(phase=name)
+    try:
+        with span(name, 'phase'):
+            yield
+    finally:
+        _phases.pop()
+        progress.report(phase=_phases[-1] if _phases else None)
+
+
+def record_retry(reason):
+    """
+    Record that an operation on the current host is being retried
+    """
+    if _trace_dir is None:
+        return
+    _events.append({'name': 'retry', 'cat': 'retry', 'ph': 'i', 's': 't',
+                    'ts': int(time.time() * 1000000), 'pid': os.getpid(),
+                    'tid': threading.current_thread().ident,
+                    'args': {'host': env.host_string, 'reason': reason}})
+
+
+def retry_wait(wait_ms, reason):
+    """
+    Return a wait_func for the retrying library that waits wait_ms between
+    attempts like wait_fixed, and records each retry.
+    """
+    def wait(attempt_number, delay_since_first_attempt_ms):
+        record_retry(reason)
+        return wait_ms
+    return wait
+
+
+def start_process():
+    """
+    Start recording a new process. Called in the processes forked for
+    parallel tasks, which inherit the spans recorded by their parent.
+    """
+    global _profiler
+    del _events[:]
+    if _profile_dir:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def finish_process(label):
+    """
+    Write the spans and the profile of the current process. The label, e.g.
+    the host a task ran for, names the process in the timeline.
+    """
+    global _profiler
+    pid = os.getpid()
+    if _profiler is not None:
+        _profiler.disable()
+        if not os.path.isdir(_profile_dir):
+            os.makedirs(_profile_dir)
+        _profiler.dump_stats(os.path.join(
+            _profile_dir, 'presto-admin-%s-%d.prof' % (label, pid)))
+        _profiler = None
+
+    if _trace_dir is None:
+        return
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+               'args': {'name': '%s (%d)' % (label, pid)}}] + _events
+    handle, path = tempfile.mkstemp(dir=_trace_dir, suffix='.json')
+    with os.fdopen(handle, 'w') as events_file:
+        json.dump(events, events_file)
+    del _events[:]
+
+
+def finish():
+    """
+    Finish the main process and merge the spans of all the processes into
+    the trace file, if any.
+
+    Returns:
+        the merged events of all the processes
+    """
+    global _trace_file, _trace_dir, _profile_dir
+    finish_process('presto-admin')
+    events = []
+    if _trace_dir is not None:
+        for path in sorted(glob.glob(os.path.join(_trace_dir, '*.json'))):
+            with open(path) as events_file:
+                events.extend(json.load(events_file))
+        shutil.rmtree(_trace_dir, ignore_errors=True)
+    if _trace_file:
+        with open(_trace_file, 'w') as trace:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      trace)
+        _LOGGER.info('Wrote trace with %d events to %s', len(events),
+                     _trace_file)
+    _trace_file = None
+    _trace_dir = None
+    _profile_dir = None
+    return events
@@ -23,6 +23,7 @@ from fabric.operations import put, sudo
 
 from prestoadmin.yarn_slider.config import SliderConfig, \
     DIR, SLIDER_MASTER
+from prestoadmin.util import stream
 from prestoadmin.util.base_config import requires_config
 
 from prestoadmin.util.fabricapi import task_by_rolename
@@ -49,6 +50,17 @@ def deploy_install(slider_tarball):
     slider_parent = os.path.dirname(slider_dir)
     slider_file = os.path.join(slider_parent, os.path.basename(slider_tarball))
 
+    if stream.can_stream():
+        # Unpack the tarball as it arrives rather than from a copy of it
+        result = stream.stream_in(
+            slider_tarball, 'set -o pipefail; mkdir -p %s && gunzip -c | '
+            'tar -x -C %s --strip-components=1' % (slider_dir, slider_dir))
+        if result.failed:
+            abort('Failed to unpack slider tarball %s to directory %s on '
+                  'host %s: %s' % (slider_tarball, slider_dir, env.host,
+                                   result))
+        return
+
     sudo('mkdir -p %s' % (slider_dir))
 
     result = put(slider_tarball, os.path.join(slider_parent, slider_file))
@@ -23,7 +23,7 @@ from nose.plugins.attrib import attr
 from nose.tools import nottest
 
 from prestoadmin.collect import OUTPUT_FILENAME_FOR_LOGS, TMP_PRESTO_DEBUG, \
-    PRESTOADMIN_LOG_NAME, OUTPUT_FILENAME_FOR_SYS_INFO, TMP_PRESTO_DEBUG_REMOTE
+    PRESTOADMIN_LOG_NAME, OUTPUT_FILENAME_FOR_SYS_INFO
 from tests.no_hadoop_bare_image_provider import NoHadoopBareImageProvider
 from tests.product.base_product_case import BaseProductTestCase, PrestoError
 from tests.product.cluster_types import STANDALONE_PRESTO_CLUSTER, STANDALONE_PA_CLUSTER
@@ -80,13 +80,11 @@ class TestCollect(BaseProductTestCase):
         catalog_file_name = path.join(downloaded_sys_info_loc, 'catalog_info.txt')
         self.assert_path_exists(self.cluster.master, catalog_file_name)
 
-        version_file_name = path.join(TMP_PRESTO_DEBUG_REMOTE, 'version_info.txt')
-        for host in hosts:
-            self.assert_path_exists(host, version_file_name)
-
         # collected coordinator info
         coord_system_info_location = path.join(downloaded_sys_info_loc, coordinator)
         self.assert_path_exists(self.cluster.master, coord_system_info_location)
+        self.assert_path_exists(self.cluster.master, path.join(coord_system_info_location, 'version_info.txt'))
+        self.assert_path_exists(self.cluster.master, path.join(coord_system_info_location, 'system_info.json'))
 
         coord_catalog_info_location = path.join(coord_system_info_location, 'catalog')
         self.assert_path_exists(self.cluster.master, coord_catalog_info_location)
@@ -95,7 +93,7 @@ class TestCollect(BaseProductTestCase):
         # collected worker info
         slave0_system_info_loc = path.join(downloaded_sys_info_loc, self.cluster.internal_slaves[0])
         self.assert_path_exists(self.cluster.master, slave0_system_info_loc)
-        self.assert_path_exists(self.cluster.master, slave0_system_info_loc)
+        self.assert_path_exists(self.cluster.master, path.join(slave0_system_info_loc, 'version_info.txt'))
 
         slave0_catalog_info_loc = path.join(slave0_system_info_loc, 'catalog')
         self.assert_path_exists(self.cluster.master, slave0_catalog_info_loc)
@@ -150,18 +150,21 @@ class TestCatalog(BaseUnitCase):
         self.assertRaisesRegexp(OSError, 'Permission denied',
                                 catalog.remove, 'tpch')
 
-    @patch('prestoadmin.catalog.secure_create_directory')
-    @patch('prestoadmin.util.fabricapi.put')
-    def test_deploy_files(self, put_mock, create_dir_mock):
+    @patch('prestoadmin.catalog.deploy_changed')
+    @patch('__builtin__.open')
+    def test_deploy_files(self, open_mock, deploy_mock):
+        file_obj = open_mock.return_value.__enter__.return_value
+        file_obj.read.side_effect = ['connector.name=a', 'connector.name=b']
         local_dir = '/my/local/dir'
         remote_dir = '/my/remote/dir'
         catalog.deploy_files(['a', 'b'], local_dir, remote_dir,
                              PRESTO_STANDALONE_USER_GROUP)
-        create_dir_mock.assert_called_with(remote_dir, PRESTO_STANDALONE_USER_GROUP)
-        put_mock.assert_any_call('/my/local/dir/a', remote_dir, use_sudo=True,
-                                 mode=0600)
-        put_mock.assert_any_call('/my/local/dir/b', remote_dir, use_sudo=True,
-                                 mode=0600)
+        open_mock.assert_any_call('/my/local/dir/a')
+        open_mock.assert_any_call('/my/local/dir/b')
+        deploy_mock.assert_called_with({'a': 'connector.name=a',
+                                        'b': 'connector.name=b'},
+                                       remote_dir,
+                                       PRESTO_STANDALONE_USER_GROUP, 0600)
 
     @patch('prestoadmin.catalog.os.path.isfile')
     @patch("__builtin__.open")
@@ -15,11 +15,13 @@
 """
 Tests the presto diagnostic information using presto-admin collect
 """
+import base64
 import os
 from os import path
 
 import requests
 from fabric.api import env
+from fabric.operations import _AttributeString
 from mock import patch
 
 import prestoadmin
@@ -28,13 +30,15 @@ from prestoadmin.collect import \
     TMP_PRESTO_DEBUG, \
     PRESTOADMIN_LOG_NAME, \
     OUTPUT_FILENAME_FOR_LOGS, \
-    OUTPUT_FILENAME_FOR_SYS_INFO, \
-    TMP_PRESTO_DEBUG_REMOTE
+    OUTPUT_FILENAME_FOR_SYS_INFO
 from prestoadmin.util.local_config_util import get_log_directory
 from tests.unit.base_unit_case import BaseUnitCase, PRESTO_CONFIG
 
 
 class TestCollect(BaseUnitCase):
+    def setUp(self):
+        super(TestCollect, self).setUp(capture_output=True)
+
     @patch('prestoadmin.collect.lookup_launcher_log_file')
     @patch('prestoadmin.collect.lookup_server_log_file')
     @patch('prestoadmin.collect.get_files')
@@ -46,6 +50,7 @@ class TestCollect(BaseUnitCase):
                           launcher_log_mock):
         downloaded_logs_loc = path.join(TMP_PRESTO_DEBUG, "logs")
 
+        self.remove_runs_once_flag(collect.logs)
         collect.logs()
 
         mkdirs_mock.assert_called_with(downloaded_logs_loc)
@@ -58,6 +63,313 @@ class TestCollect(BaseUnitCase):
         tar.add.assert_called_with(downloaded_logs_loc,
                                    arcname=path.basename(downloaded_logs_loc))
 
+    @patch('prestoadmin.collect.store_logs_index')
+    @patch('prestoadmin.collect.load_logs_index')
+    @patch('prestoadmin.collect.execute')
+    @patch("prestoadmin.collect.tarfile.open")
+    @patch("prestoadmin.collect.shutil")
+    @patch("prestoadmin.collect.ensure_directory_exists")
+    def test_collect_logs_incremental(self, mkdirs_mock, shutil_mock,
+                                      tarfile_open_mock, execute_mock,
+                                      load_index_mock, store_index_mock):
+        downloaded_logs_loc = path.join(TMP_PRESTO_DEBUG, "logs-delta")
+        old_index = {'master': {'12': {'path': '/var/log/presto/server.log',
+                                       'size': 10, 'offset': 10}},
+                     'slave1': {'13': {'path': '/var/log/presto/server.log',
+                                       'size': 20, 'offset': 20}}}
+        new_master_index = {'12': {'path': '/var/log/presto/server.log',
+                                   'size': 30, 'offset': 30}}
+        load_index_mock.return_value = old_index
+        execute_mock.return_value = {'master': new_master_index,
+                                     'slave1': Exception('failed')}
+
+        self.remove_runs_once_flag(collect.logs)
+        collect.logs('incremental')
+
+        shutil_mock.rmtree.assert_called_with(downloaded_logs_loc,
+                                              ignore_errors=True)
+        mkdirs_mock.assert_called_with(downloaded_logs_loc)
+        execute_mock.assert_called_with(collect.get_remote_log_deltas,
+                                        downloaded_logs_loc, old_index,
+                                        roles=[])
+        store_index_mock.assert_called_with(
+            {'master': new_master_index,
+             'slave1': {'13': {'path': '/var/log/presto/server.log',
+                               'size': 20, 'offset': 20}}})
+        tar = tarfile_open_mock.return_value
+        tar.add.assert_called_with(downloaded_logs_loc,
+                                   arcname=path.basename(downloaded_logs_loc))
+
+    def test_collect_logs_invalid_mode(self):
+        self.remove_runs_once_flag(collect.logs)
+        self.assertRaisesRegexp(SystemExit, 'Invalid Argument',
+                                collect.logs, 'bogus')
+
+    def test_plan_log_deltas(self):
+        host_index = {'1': {'path': '/log/server.log', 'size': 100,
+                            'offset': 100},
+                      '2': {'path': '/log/launcher.log', 'size': 50,
+                            'offset': 50},
+                      '3': {'path': '/log/old.log', 'size': 70,
+                            'offset': 70}}
+        remote_files = [('1', 150, '/log/server.log'),
+                        ('2', 10, '/log/launcher.log'),
+                        ('3', 70, '/log/server.log-1.log.gz'),
+                        ('4', 30, '/log/server.log-2.log.gz')]
+
+        self.assertEqual([('/log/server.log', '1', 100, 50),
+                          ('/log/launcher.log', '2', 0, 10),
+                          ('/log/server.log-2.log.gz', '4', 0, 30)],
+                         collect.plan_log_deltas(remote_files, host_index))
+
+    @patch('prestoadmin.collect.fetch_log_deltas')
+    @patch('prestoadmin.collect.stat_remote_files')
+    @patch('prestoadmin.collect.lookup_launcher_log_file')
+    @patch('prestoadmin.collect.lookup_server_log_file')
+    def test_get_remote_log_deltas(self, server_log_mock, launcher_log_mock,
+                                   stat_mock, fetch_mock):
+        env.host = 'myhost'
+        server_log_mock.return_value = '/log/server.log'
+        launcher_log_mock.return_value = '/log/launcher.log'
+        stat_mock.return_value = [('1', 150, '/log/server.log')]
+        index = {'myhost': {'1': {'path': '/log/server.log', 'size': 100,
+                                  'offset': 100}}}
+
+        host_index = collect.get_remote_log_deltas('/c/d', index)
+
+        stat_mock.assert_called_with(['/log/server.log*',
+                                      '/log/launcher.log*'])
+        fetch_mock.assert_called_with([('/log/server.log', '1', 100, 50)],
+                                      '/c/d')
+        self.assertEqual({'1': {'path': '/log/server.log', 'size': 150,
+                                'offset': 150}}, host_index)
+
+    @patch('prestoadmin.collect.download_host_archive')
+    @patch('prestoadmin.collect.sudo')
+    def test_fetch_log_deltas_names_parts_by_inode(self, sudo_mock,
+                                                   download_mock):
+        collect.fetch_log_deltas([('/log/server.log', '5', 0, 10),
+                                  ('/log/server.log-1.log', '1', 100, 20)],
+                                 '/c/d')
+
+        command = sudo_mock.call_args[0][0]
+        self.assertTrue('tail -c +1 "/log/server.log" | head -c 10 > '
+                        '"/tmp/presto-debug-remote/logs-delta/server.log.5.0"'
+                        in command)
+        self.assertTrue('tail -c +101 "/log/server.log-1.log" | head -c 20 > '
+                        '"/tmp/presto-debug-remote/logs-delta/'
+                        'server.log-1.log.1.100"' in command)
+
+    @patch('prestoadmin.collect.sudo')
+    @patch('prestoadmin.collect.lookup_launcher_log_file')
+    @patch('prestoadmin.collect.lookup_server_log_file')
+    def test_grep_prefixes_lines_with_host(self, server_log_mock,
+                                           launcher_log_mock, sudo_mock):
+        env.host = 'myhost'
+        server_log_mock.return_value = '/log/server.log'
+        launcher_log_mock.return_value = '/log/launcher.log'
+        sudo_mock.return_value = 'first error\r\nsecond error'
+
+        collect.grep('error', max_matches='2')
+
+        self.assertEqual('[myhost] first error\n[myhost] second error\n'
+                         '[myhost] Stopped after 2 matching lines\n',
+                         self.test_stdout.getvalue())
+        sudo_mock.assert_called_with(collect.build_grep_command(
+            ['/log/server.log', '/log/launcher.log'], 'error', None, None, 2))
+
+    def test_grep_invalid_max_matches(self):
+        self.assertRaisesRegexp(SystemExit, 'Invalid max_matches abc',
+                                collect.grep, 'error', max_matches='abc')
+
+    def test_build_grep_command(self):
+        command = collect.build_grep_command(['/log/server.log'], "it's",
+                                             max_matches=5)
+        self.assertEqual(
+            "files=$( ( find /log -maxdepth 1 -type f -name 'server.log*' ) "
+            "2>/dev/null | sort -u ); [ -n \"$files\" ] || exit 0; "
+            "ls -1tr $files | while read f; do zcat -f \"$f\" 2>/dev/null; "
+            "done | grep -E -e 'it'\"'\"'s' | head -n 5", command)
+
+    def test_build_grep_command_with_time_window(self):
+        command = collect.build_grep_command(
+            ['/log/server.log'], 'error', since='2017-01-31T10:00',
+            until='2017-01-31T11:00')
+        self.assertIn("-name 'server.log*' -newermt 2017-01-31T10:00 ",
+                      command)
+        self.assertIn('{ keep = ($1 >= "2017-01-31T10:00" && '
+                      '$1 < "2017-01-31T11:00") }', command)
+        self.assertIn('head -n %d' % collect.DEFAULT_GREP_MAX_MATCHES,
+                      command)
+
+    @patch('prestoadmin.collect.json.dump')
+    @patch('__builtin__.open')
+    @patch('prestoadmin.collect.ensure_directory_exists')
+    @patch('prestoadmin.collect.execute')
+    def test_gc_analysis(self, execute_mock, mkdirs_mock, open_mock,
+                         dump_mock):
+        statistics = {'pauses': 1, 'total_pause_ms': 10.0,
+                      'p50_pause_ms': 10.0, 'p99_pause_ms': 10.0,
+                      'max_pause_ms': 10.0, 'full_gcs': 0,
+                      'humongous_allocations': 0,
+                      'allocation_rate_mb_per_sec': None}
+        execute_mock.return_value = {'master': statistics, 'slave1': None}
+
+        self.remove_runs_once_flag(collect.gc_analysis)
+        collect.gc_analysis()
+
+        execute_mock.assert_called_with(collect.get_gc_statistics,
+                                        roles=env.roles)
+        mkdirs_mock.assert_called_with(TMP_PRESTO_DEBUG)
+        self.assertEqual({'master': statistics}, dump_mock.call_args[0][0])
+        self.assertIn('master', self.test_stdout.getvalue())
+        self.assertNotIn('slave1', self.test_stdout.getvalue())
+
+    @patch('prestoadmin.collect.execute')
+    def test_gc_analysis_without_gc_logs(self, execute_mock):
+        execute_mock.return_value = {'master': None}
+
+        self.remove_runs_once_flag(collect.gc_analysis)
+        self.assertRaisesRegexp(SystemExit, 'No GC logs were found',
+                                collect.gc_analysis)
+
+    @patch('prestoadmin.collect.warn')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_gc_statistics_not_enabled(self, sudo_mock, warn_mock):
+        env.host = 'myhost'
+        output = _AttributeString('-server\n-Xmx16G')
+        output.succeeded = True
+        sudo_mock.return_value = output
+
+        self.assertIsNone(collect.get_gc_statistics())
+        self.assertTrue('GC logging is not enabled on myhost'
+                        in warn_mock.call_args[0][0])
+        self.assertEqual(1, sudo_mock.call_count)
+
+    @patch('prestoadmin.collect.sudo')
+    def test_get_gc_statistics(self, sudo_mock):
+        env.host = 'myhost'
+        jvm_config = _AttributeString('-server\n'
+                                      '-Xloggc:/var/log/presto/gc.log')
+        jvm_config.succeeded = True
+        sudo_mock.side_effect = [
+            jvm_config,
+            _AttributeString('0.500: [Full GC (System.gc())  '
+                             '100M->10M(1024M), 0.2500000 secs]')]
+
+        statistics = collect.get_gc_statistics()
+
+        self.assertEqual(1, statistics['full_gcs'])
+        self.assertEqual(250.0, statistics['max_pause_ms'])
+        self.assertIn('/var/log/presto/gc.log*', sudo_mock.call_args[0][0])
+        self.assertIn("echo '==> gc log: '\"$f\"",
+                      sudo_mock.call_args[0][0])
+
+    @patch('prestoadmin.collect.make_tarfile')
+    @patch('prestoadmin.collect.glob.glob')
+    @patch('prestoadmin.collect.execute')
+    @patch('prestoadmin.collect.shutil')
+    @patch('prestoadmin.collect.ensure_directory_exists')
+    def test_thread_dumps(self, mkdirs_mock, shutil_mock, execute_mock,
+                          glob_mock, make_tarfile_mock):
+        downloaded_loc = path.join(TMP_PRESTO_DEBUG, 'thread-dumps')
+        pool_sizes = []
+
+        def execute(*args, **kwargs):
+            pool_sizes.append(env.pool_size)
+            return {'master': '/dumps/master', 'slave1': None}
+        execute_mock.side_effect = execute
+        glob_mock.return_value = []
+        env.hosts = ['master', 'slave1']
+
+        self.remove_runs_once_flag(collect.thread_dumps)
+        collect.thread_dumps('2', '1')
+
+        mkdirs_mock.assert_called_with(downloaded_loc)
+        args = execute_mock.call_args[0]
+        self.assertEqual(collect.get_stack_samples, args[0])
+        self.assertEqual('thread-dumps', args[1])
+        self.assertEqual(2, pool_sizes[0])
+        self.assertIn('for i in $(seq 1 2)', args[2])
+        self.assertIn('sleep 1', args[2])
+        glob_mock.assert_called_with('/dumps/master/thread-dump-*.txt')
+        make_tarfile_mock.assert_called_with(
+            collect.OUTPUT_FILENAME_FOR_THREAD_DUMPS, downloaded_loc)
+        self.assertIn('No running stack frames were sampled',
+                      self.test_stdout.getvalue())
+
+    def test_thread_dumps_invalid_count(self):
+        self.remove_runs_once_flag(collect.thread_dumps)
+        self.assertRaisesRegexp(SystemExit, 'Invalid count',
+                                collect.thread_dumps, '0')
+
+    def test_jfr_invalid_seconds(self):
+        self.remove_runs_once_flag(collect.jfr)
+        self.assertRaisesRegexp(SystemExit, 'Invalid seconds',
+                                collect.jfr, 'abc')
+
+    @patch('prestoadmin.collect.warn')
+    @patch('prestoadmin.collect.time.time', return_value=90)
+    @patch('prestoadmin.collect.download_host_archive')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_stack_samples(self, sudo_mock, download_mock, unused_time,
+                               warn_mock):
+        env.host = 'myhost'
+        sudo_mock.return_value = _AttributeString('')
+        sudo_mock.return_value.failed = False
+        download_mock.return_value = '/c/d/myhost'
+
+        self.assertEqual('/c/d/myhost', collect.get_stack_samples(
+            'jfr', 'sampling', 100, '/c/d'))
+
+        self.assertEqual({'user': 'presto'}, sudo_mock.call_args[1])
+        command = sudo_mock.call_args[0][0]
+        self.assertIn('delay=$((100 - $(date +%s)))', command)
+        self.assertIn('; sampling; ', command)
+        download_mock.assert_called_with(
+            '/tmp/presto-debug-remote-jfr.tar.gz', '/c/d')
+        self.assertFalse(warn_mock.called)
+
+    @patch('prestoadmin.collect.warn')
+    @patch('prestoadmin.collect.time.time')
+    @patch('prestoadmin.collect.download_host_archive')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_stack_samples_started_late(self, sudo_mock, download_mock,
+                                            time_mock, warn_mock):
+        env.host = 'myhost'
+        sudo_mock.return_value = _AttributeString(
+            'Started sampling 3 seconds late')
+        sudo_mock.return_value.failed = False
+
+        # Reported by the node
+        time_mock.return_value = 90
+        collect.get_stack_samples('jfr', 'sampling', 100, '/c/d')
+        warn_mock.assert_called_with(
+            'Sampling started 3 seconds late on myhost, so its samples are '
+            'not from the same time as those of the other nodes')
+
+        # Dispatched after the start time
+        time_mock.return_value = 105
+        collect.get_stack_samples('jfr', 'sampling', 100, '/c/d')
+        self.assertIn('5 seconds late', warn_mock.call_args[0][0])
+
+    @patch('prestoadmin.collect.warn')
+    @patch('prestoadmin.collect.download_host_archive')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_stack_samples_server_not_running(self, sudo_mock,
+                                                  download_mock, warn_mock):
+        env.host = 'myhost'
+        sudo_mock.return_value = _AttributeString(
+            'Presto server is not running')
+        sudo_mock.return_value.failed = True
+
+        self.assertIsNone(collect.get_stack_samples(
+            'jfr', 'sampling', 100, '/c/d'))
+
+        self.assertFalse(download_mock.called)
+        warn_mock.assert_called_with('Could not sample the Presto server on '
+                                     'myhost: Presto server is not running')
+
     @patch("prestoadmin.collect.os.makedirs")
     @patch("prestoadmin.collect.get")
     def test_get_files(self, get_mock, makedirs_mock):
@@ -186,46 +498,83 @@ class TestCollect(BaseUnitCase):
         make_tarfile_mock.assert_called_with(OUTPUT_FILENAME_FOR_SYS_INFO,
                                              downloaded_sys_info_loc)
 
-    @patch("prestoadmin.collect.get_files")
-    @patch("prestoadmin.collect.append")
-    @patch("prestoadmin.collect.get_presto_version")
-    @patch("prestoadmin.collect.get_java_version")
-    @patch("prestoadmin.collect.get_platform_information")
-    @patch('prestoadmin.collect.run')
-    def test_get_system_info(self, run_collect_mock,
-                             plat_info_mock, java_version_mock,
-                             server_version_mock,
-                             append_mock, get_files_mock):
-        downloaded_sys_info_loc = path.join(TMP_PRESTO_DEBUG, "sysinfo")
-        version_info_file_name = path.join(TMP_PRESTO_DEBUG_REMOTE,
-                                           "version_info.txt")
-
-        platform_info = "platform abcd"
-        server_version = "dummy_verion"
-        java_version = "java dummy version"
-        plat_info_mock.return_value = platform_info
-        java_version_mock.return_value = java_version
-        server_version_mock.return_value = server_version
-
-        collect.get_system_info(downloaded_sys_info_loc)
-
-        run_collect_mock.assert_any_call('mkdir -p ' + TMP_PRESTO_DEBUG_REMOTE)
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'platform information : ' +
-                                    platform_info + '\n')
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'Java version: ' +
-                                    java_version + '\n')
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'Presto-admin version: ' +
-                                    prestoadmin.__version__ + '\n')
-
-        append_mock.assert_any_call(version_info_file_name,
-                                    'Presto server version: ' +
-                                    server_version + '\n')
-
-        get_files_mock.assert_called_with(version_info_file_name,
-                                          downloaded_sys_info_loc)
+    @patch('prestoadmin.collect.write_system_info')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_system_info(self, sudo_mock, write_mock):
+        env.host = 'myhost'
+        output = _AttributeString('Last login: today\r\n{"catalogs": {}}')
+        output.failed = False
+        sudo_mock.return_value = output
+
+        collect.get_system_info('/c/d')
+
+        sudo_mock.assert_called_with(collect.build_system_info_command())
+        write_mock.assert_called_with(
+            {'catalogs': {},
+             'presto_admin_version': prestoadmin.__version__},
+            '/c/d/myhost')
+
+    @patch('prestoadmin.collect.write_system_info')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_system_info_trailing_output(self, sudo_mock, write_mock):
+        env.host = 'myhost'
+        output = _AttributeString('{"catalogs": {}}\r\nlogout')
+        output.failed = False
+        sudo_mock.return_value = output
+
+        collect.get_system_info('/c/d')
+
+        write_mock.assert_called_with(
+            {'catalogs': {},
+             'presto_admin_version': prestoadmin.__version__},
+            '/c/d/myhost')
+
+    @patch('prestoadmin.collect.warn')
+    @patch('prestoadmin.collect.write_system_info')
+    @patch('prestoadmin.collect.sudo')
+    def test_get_system_info_not_json(self, sudo_mock, write_mock, warn_mock):
+        env.host = 'myhost'
+        for text in ['"$py": command not found', '{"catalogs": ']:
+            output = _AttributeString(text)
+            output.failed = False
+            sudo_mock.return_value = output
+
+            collect.get_system_info('/c/d')
+
+            warn_mock.assert_called_with(
+                'Unable to gather system information on myhost, unexpected '
+                'output: ' + text)
+        self.assertFalse(write_mock.called)
+
+    def test_build_system_info_command(self):
+        command = collect.build_system_info_command()
+        script = command.split('echo ')[1].split(' |')[0]
+
+        self.assertEqual(
+            open(collect.remote_system_info.__file__.replace('.pyc', '.py'))
+            .read(), base64.b64decode(script))
+        self.assertTrue(command.endswith('| base64 -d | "$py" -'))
+
+    @patch('prestoadmin.collect.ensure_directory_exists')
+    @patch('__builtin__.open')
+    def test_write_system_info(self, open_mock, mkdirs_mock):
+        file_obj = open_mock.return_value.__enter__.return_value
+        report = {'platform': {'uname': 'Linux myhost'},
+                  'java_version': 'java version "1.8.0_40"',
+                  'rpm_versions': {'presto-server-rpm': '0.147'},
+                  'presto_admin_version': '2.0',
+                  'catalogs': {'tpch.properties': {
+                      'sha256': 'abc', 'content': 'connector.name=tpch\n'}}}
+
+        collect.write_system_info(report, '/c/d/myhost')
+
+        mkdirs_mock.assert_called_with('/c/d/myhost/catalog')
+        open_mock.assert_any_call('/c/d/myhost/catalog/tpch.properties', 'w')
+        file_obj.write.assert_any_call('connector.name=tpch\n')
+        open_mock.assert_any_call('/c/d/myhost/system_info.json', 'w')
+        self.assertEqual({'sha256': 'abc'},
+                         report['catalogs']['tpch.properties'])
+        open_mock.assert_any_call('/c/d/myhost/version_info.txt', 'w')
+        file_obj.write.assert_any_call(
+            'Java version: java version "1.8.0_40"\n')
+        file_obj.write.assert_any_call('Presto server version: 0.147\n')
@@ -12,59 +12,111 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
+import shutil
+import tarfile
+import tempfile
+from StringIO import StringIO
+from contextlib import closing
 from fabric.state import env
 from mock import patch
-from prestoadmin.util import constants
-from prestoadmin import configure_cmds
+from prestoadmin.util import backup_store, constants, fold
+from prestoadmin import configure_cmds, deploy
 from tests.unit.base_unit_case import BaseUnitCase
 
 
+def sha256(content):
+    return hashlib.sha256(content).hexdigest()
+
+
 class TestConfigureCmds(BaseUnitCase):
+    def setUp(self):
+        super(TestConfigureCmds, self).setUp(capture_output=True)
+
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_show(self, mock_execute):
+        for config_type, file_name in [('Node', 'node.properties'),
+                                       ('jvm', 'jvm.config'),
+                                       ('conFig', 'config.properties'),
+                                       ('log', 'log.properties')]:
+            self.remove_runs_once_flag(configure_cmds.show)
+            configure_cmds.show(config_type)
+            mock_execute.assert_called_with(
+                configure_cmds.gather_configuration, [(file_name, True)],
+                hosts=['master', 'slave1', 'slave2'])
+
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_show_all(self, mock_execute):
+        self.remove_runs_once_flag(configure_cmds.show)
+        configure_cmds.show()
+        mock_execute.assert_called_with(
+            configure_cmds.gather_configuration,
+            [('node.properties', True), ('jvm.config', True),
+             ('config.properties', True), ('log.properties', False)],
+            hosts=['master', 'slave1', 'slave2'])
+
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_show_in_host_order(self, mock_execute):
+        self.remove_runs_once_flag(configure_cmds.show)
+        mock_execute.return_value = {'slave2': 'slave2 conf\n',
+                                     'master': 'master conf\n',
+                                     'slave1': None}
+        configure_cmds.show('config')
+        self.assertEqual('master conf\nslave2 conf\n',
+                         self.test_stdout.getvalue())
+
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_show_folded(self, mock_execute):
+        self.remove_runs_once_flag(configure_cmds.show)
+        mock_execute.return_value = {'slave2': 'a=b\n', 'master': 'a=c\n',
+                                     'slave1': 'a=b\n'}
+        fold.start()
+        self.addCleanup(fold.finish, StringIO())
+        configure_cmds.show('config')
+        output = StringIO()
+        fold.finish(output)
+        self.assertEqual('----------------\nmaster\n----------------\n'
+                         'a=c\n'
+                         '----------------\nslave[1-2]\n----------------\n'
+                         'a=b\n', output.getvalue())
+
     @patch('prestoadmin.configure_cmds.get')
     @patch('prestoadmin.configure_cmds.files.exists')
-    def test_config_show(self, mock_file_exists, mock_get):
-        mock_file_exists.return_value = True
+    def test_gather_configuration(self, mock_file_exists, mock_get):
+        env.host = 'master'
+        mock_file_exists.side_effect = [True, False]
+        mock_get.side_effect = lambda path, buf, use_sudo: buf.write('a=b\n')
 
-        configure_cmds.show("Node")
+        self.assertEqual(
+            '\nmaster: Configuration file at /etc/presto/node.properties:\n'
+            'a=b\n\n',
+            configure_cmds.gather_configuration([('node.properties', True),
+                                                 ('log.properties', False)]))
         file_path_node = os.path.join(constants.REMOTE_CONF_DIR,
                                       "node.properties")
         args, kwargs = mock_get.call_args
         self.assertEqual(args[0], file_path_node)
 
-        configure_cmds.show("jvm")
-        file_path_jvm = os.path.join(constants.REMOTE_CONF_DIR, "jvm.config")
-        args, kwargs = mock_get.call_args
-        self.assertEqual(args[0], file_path_jvm)
-
-        configure_cmds.show("conFig")
-        file_path_config = os.path.join(constants.REMOTE_CONF_DIR,
-                                        "config.properties")
-        args, kwargs = mock_get.call_args
-        self.assertEqual(args[0], file_path_config)
-
-    @patch('prestoadmin.configure_cmds.configuration_show')
-    def test_config_show_all(self, mock_show):
-        configure_cmds.show()
-        mock_show.assert_any_call("node.properties")
-        mock_show.assert_any_call("jvm.config")
-        mock_show.assert_any_call("config.properties")
-        mock_show.assert_any_call("log.properties", should_warn=False)
-
+    @patch('prestoadmin.configure_cmds.execute')
     @patch('prestoadmin.configure_cmds.abort')
     @patch('prestoadmin.configure_cmds.warn')
     @patch('prestoadmin.configure_cmds.files.exists')
-    def test_config_show_fail(self, mock_file_exists, mock_warn, mock_abort):
+    def test_config_show_fail(self, mock_file_exists, mock_warn, mock_abort,
+                              mock_execute):
         mock_file_exists.return_value = False
         env.host = "any_host"
-        configure_cmds.configuration_show("any_path")
+        self.assertEqual(None,
+                         configure_cmds.configuration_show("any_path"))
         file_path = os.path.join(constants.REMOTE_CONF_DIR, "any_path")
         mock_warn.assert_called_with("No configuration file found "
                                      "for %s at %s" % (env.host, file_path))
 
+        self.remove_runs_once_flag(configure_cmds.show)
         configure_cmds.show("invalid_config")
         mock_abort.assert_called_with("Invalid Argument. Possible values: "
                                       "node, jvm, config, log")
+        self.assertFalse(mock_execute.called)
 
     @patch('prestoadmin.configure_cmds.warn')
     @patch('prestoadmin.configure_cmds.files.exists')
@@ -102,3 +154,218 @@ class TestConfigureCmds(BaseUnitCase):
         configure_cmds.deploy("workers")
         mock_workers.assert_called_with()
         assert not mock_coordinator.called
+
+    @patch('prestoadmin.configure_cmds.read_local_catalogs')
+    @patch('prestoadmin.deploy.get_role_conf')
+    @patch('prestoadmin.deploy.prepare_role_confs')
+    @patch('prestoadmin.configure_cmds.execute')
+    def test_config_diff(self, mock_execute, mock_prepare, mock_conf,
+                         mock_catalogs):
+        self.remove_runs_once_flag(configure_cmds.diff)
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2', 'slave3']
+        mock_conf.side_effect = lambda role: {
+            'config.properties': {'coordinator': str(role == 'coordinator')},
+            'node.properties': {'node.environment': 'presto'}}
+        mock_catalogs.return_value = {
+            'catalog/tpch.properties': 'connector.name=tpch'}
+
+        def hashes(config_properties, extra=None):
+            result = {'config.properties': sha256(config_properties),
+                      'node.properties': 'differs with the node.id',
+                      deploy.WITHOUT_NODE_ID:
+                          sha256('node.environment=presto\n'),
+                      'catalog/tpch.properties': sha256('connector.name=tpch')}
+            result.update(extra or {})
+            return result
+
+        hashes_by_host = {
+            'master': hashes('coordinator=True\n'),
+            'slave1': hashes('coordinator=False\n'),
+            'slave2': hashes('coordinator=true\n',
+                             {'catalog/jmx.properties': 'jmx'}),
+            'slave3': hashes('coordinator=true\n',
+                             {'catalog/jmx.properties': 'jmx'})}
+        fetched = {'slave2': {'config.properties': 'coordinator=true\n',
+                              'catalog/jmx.properties': 'connector.name=jmx\n'}}
+        mock_execute.side_effect = [hashes_by_host, fetched]
+
+        configure_cmds.diff()
+
+        mock_execute.assert_called_with(
+            configure_cmds.fetch_files,
+            {'slave2': ['catalog/jmx.properties', 'config.properties']},
+            hosts=['slave2'])
+        self.assertEqual(
+            '----------------\n'
+            'slave[2-3]\n'
+            '----------------\n'
+            '--- /dev/null\n'
+            '+++ slave2/catalog/jmx.properties\n'
+            '@@ -0,0 +1 @@\n'
+            '+connector.name=jmx\n'
+            '--- local/config.properties\n'
+            '+++ slave2/config.properties\n'
+            '@@ -1 +1 @@\n'
+            '-coordinator=False\n'
+            '+coordinator=true\n'
+            'Configuration is up to date on: master, slave1\n',
+            self.test_stdout.getvalue())
+
+    def test_format_diff_leaves_out_node_id(self):
+        self.assertEqual(
+            '--- local/node.properties\n'
+            '+++ slave1/node.properties\n'
+            '@@ -1,2 +1,2 @@\n'
+            ' node.environment=presto\n'
+            '-node.data-dir=/var/lib/presto/data\n'
+            '+node.data-dir=/data\n',
+            configure_cmds.format_diff(
+                'node.properties',
+                'node.environment=presto\n'
+                'node.data-dir=/var/lib/presto/data\n',
+                'node.id=abc\nnode.environment=presto\n'
+                'node.data-dir=/data\n', 'slave1') + '\n')
+
+
+class SudoOutput(str):
+    failed = False
+    succeeded = True
+    return_code = 0
+
+
+class TestConfigurationBackup(BaseUnitCase):
+    def setUp(self):
+        super(TestConfigurationBackup, self).setUp(capture_output=True)
+        self.config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.config_dir)
+        patcher = patch('prestoadmin.util.backup_store.get_config_directory',
+                        return_value=self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env.host = 'slave1'
+
+    @staticmethod
+    def write_tar(path, files):
+        with closing(tarfile.open(path, 'w:gz')) as archive:
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                archive.addfile(info, StringIO(content))
+
+    @patch('prestoadmin.configure_cmds.get')
+    @patch('prestoadmin.configure_cmds.sudo')
+    def test_backup_fetches_new_content_only(self, sudo_mock, get_mock):
+        backup_store.add_blob('coordinator=false\n')
+        sudo_mock.side_effect = [
+            SudoOutput(
+                'd 755 presto:presto catalog\n'
+                'f 600 presto:presto catalog/tpch.properties\n'
+                'f 644 root:root config.properties\n'
+                'l 777 root:root link\n'
+                '--presto-admin-hashes--\n' +
+                '%s  ./catalog/tpch.properties\n' % sha256(
+                    'connector.name=tpch\n') +
+                '%s  ./config.properties\n' % sha256('coordinator=false\n')),
+            SudoOutput('/tmp/presto_backup-abc.tar.gz'),
+            SudoOutput('')]
+        get_mock.side_effect = lambda remote, local, use_sudo: \
+            self.write_tar(local, {'catalog/tpch.properties':
+                                   'connector.name=tpch\n'})
+        snapshot = backup_store.new_snapshot()
+
+        self.assertEqual(snapshot, configure_cmds.backup_host(snapshot))
+
+        self.assertTrue(sudo_mock.call_args_list[1][0][0].endswith(
+            '-- catalog/tpch.properties && echo "${tarfile}"'))
+        sudo_mock.assert_called_with(
+            'rm -f "/tmp/presto_backup-abc.tar.gz"')
+        self.assertEqual(
+            [{'path': 'catalog', 'type': 'd', 'mode': '755',
+              'owner': 'presto:presto'},
+             {'path': 'catalog/tpch.properties', 'type': 'f', 'mode': '600',
+              'owner': 'presto:presto',
+              'sha256': sha256('connector.name=tpch\n')},
+             {'path': 'config.properties', 'type': 'f', 'mode': '644',
+              'owner': 'root:root', 'sha256': sha256('coordinator=false\n')}],
+            backup_store.read_manifest(snapshot, 'slave1'))
+        self.assertEqual('connector.name=tpch\n', backup_store.read_blob(
+            sha256('connector.name=tpch\n')))
+
+    @patch('prestoadmin.configure_cmds.sudo')
+    def test_backup_without_new_content(self, sudo_mock):
+        backup_store.add_blob('coordinator=false\n')
+        sudo_mock.return_value = SudoOutput(
+            'f 600 presto:presto config.properties\n'
+            '--presto-admin-hashes--\n' +
+            '%s  ./config.properties\n' % sha256('coordinator=false\n'))
+        snapshot = backup_store.new_snapshot()
+
+        configure_cmds.backup_host(snapshot)
+
+        self.assertEqual(1, sudo_mock.call_count)
+
+    @patch('prestoadmin.deploy.deploy_bundle')
+    def test_restore(self, deploy_mock):
+        snapshot = backup_store.new_snapshot()
+        backup_store.write_manifest(snapshot, 'slave1', [
+            {'path': 'catalog', 'type': 'd', 'mode': '755',
+             'owner': 'presto:presto'},
+            {'path': 'catalog/tpch.properties', 'type': 'f', 'mode': '600',
+             'owner': 'presto:presto',
+             'sha256': backup_store.add_blob('connector.name=tpch\n')}])
+        members = {}
+
+        def read_bundle(path, remote_dir, keep_existing):
+            with closing(tarfile.open(path)) as archive:
+                for info in archive:
+                    members[info.name] = (
+                        info.type, info.mode, info.uname, info.gname,
+                        archive.extractfile(info).read() if info.isfile()
+                        else None)
+        deploy_mock.side_effect = read_bundle
+
+        configure_cmds.restore(snapshot)
+
+        self.assertEqual(
+            {'catalog': (tarfile.DIRTYPE, 0755, 'presto', 'presto', None),
+             'catalog/tpch.properties': (tarfile.REGTYPE, 0600, 'presto',
+                                         'presto', 'connector.name=tpch\n')},
+            members)
+        self.assertEqual('Restoring configuration snapshot %s on: slave1\n'
+                         % snapshot, self.test_stdout.getvalue())
+
+    def test_restore_without_backups(self):
+        self.assertRaisesRegexp(SystemExit, 'There is no configuration backup',
+                                configure_cmds.prepare_restore)
+        backup_store.new_snapshot()
+        self.assertRaisesRegexp(SystemExit, 'No configuration backup '
+                                '20170131T100000',
+                                configure_cmds.prepare_restore,
+                                '20170131T100000')
+
+    @patch('prestoadmin.configure_cmds.sudo')
+    @patch('prestoadmin.configure_cmds.stream')
+    def test_upgrade_config_is_streamed(self, stream_mock, sudo_mock):
+        stream_mock.can_stream.return_value = True
+        stream_mock.stream_out.side_effect = \
+            lambda command, local_path: self.write_tar(
+                local_path, {'config.properties': 'coordinator=false\n'}) or \
+            SudoOutput('')
+        stream_mock.stream_in.return_value = SudoOutput('')
+
+        with patch('prestoadmin.configure_cmds.get_config_directory',
+                   return_value=self.config_dir):
+            local_tar = configure_cmds.gather_config_directory()
+            self.assertEqual(os.path.join(
+                self.config_dir, configure_cmds.CONFIG_TAR_DIR_NAME,
+                'slave1.tar.gz'), local_tar)
+            stream_mock.stream_out.assert_called_with(
+                'tar -c -z -C /etc/presto .', local_tar)
+
+            configure_cmds.deploy_config_directory(local_tar)
+
+        stream_mock.stream_in.assert_called_with(
+            local_tar, 'tar -C "/etc/presto" -x -z')
+        self.assertFalse(os.path.exists(local_tar))
+        self.assertFalse(sudo_mock.called)
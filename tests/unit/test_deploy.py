@@ -15,15 +15,25 @@
 """
 Tests deploying the presto configuration
 """
+import hashlib
+import shutil
+import tarfile
+import tempfile
+from contextlib import closing
+
 from mock import patch
 
 from fabric.api import env
 from prestoadmin import deploy
+from prestoadmin.util.exception import ConfigurationError
 from tests.base_test_case import BaseTestCase
 from tests.unit import SudoResult
 
 
 class TestDeploy(BaseTestCase):
+    def setUp(self):
+        super(TestDeploy, self).setUp(capture_output=True)
+
     def test_output_format_dict(self):
         conf = {'a': 'b', 'c': 'd'}
         self.assertEqual(deploy.output_format(conf),
@@ -67,56 +77,171 @@ class TestDeploy(BaseTestCase):
         deploy.coordinator()
         assert configure_mock.called
 
-    @patch('prestoadmin.deploy.sudo')
-    def test_deploy(self, sudo_mock):
-        sudo_mock.return_value = SudoResult()
-        files = {"jvm.config": "a=b"}
-        deploy.deploy(files, "/my/remote/dir")
-        sudo_mock.assert_any_call("mkdir -p /my/remote/dir")
-        sudo_mock.assert_any_call("echo 'a=b' > /my/remote/dir/jvm.config")
-
-    @patch('__builtin__.open')
-    @patch('prestoadmin.deploy.exists')
-    @patch('prestoadmin.deploy.files.append')
-    @patch('prestoadmin.deploy.sudo')
-    def test_deploy_node_properties(self, sudo_mock, append_mock, exists_mock, open_mock):
-        sudo_mock.return_value = SudoResult()
-        exists_mock.return_value = True
-        file_manager = open_mock.return_value.__enter__.return_value
-        file_manager.read.return_value = ("key=value")
-        command = (
-            "if ! ( grep -q -s 'node.id' /my/remote/dir/node.properties ); "
-            "then "
-            "uuid=$(uuidgen); "
-            "echo node.id=$uuid >> /my/remote/dir/node.properties;"
-            "fi; "
-            "sed -i '/node.id/!d' /my/remote/dir/node.properties; ")
-        deploy.deploy_node_properties("key=value", "/my/remote/dir")
-        sudo_mock.assert_called_with(command)
-        append_mock.assert_called_with("/my/remote/dir/node.properties",
-                                       "key=value", True, shell=True)
+    @patch('prestoadmin.deploy.configure_presto')
+    @patch('prestoadmin.deploy.w.Worker')
+    @patch('prestoadmin.deploy.coord.Coordinator')
+    def test_prepared_confs_are_shared(self, coord_mock, worker_mock,
+                                       configure_mock):
+        self.addCleanup(deploy._role_confs.clear)
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['slave1', 'slave2']
+        coord_mock.return_value.get_conf.return_value = {'c': 'coordinator'}
+        worker_mock.return_value.get_conf.return_value = {'w': 'worker'}
 
-    @patch('prestoadmin.deploy.sudo')
-    @patch('prestoadmin.deploy.secure_create_file')
-    def test_deploys_as_presto_user(self, secure_create_file_mock, sudo_mock):
-        deploy.deploy({'my_file': 'hello!'}, '/remote/path')
-        secure_create_file_mock.assert_called_with('/remote/path/my_file', 'presto:presto', 600)
-        sudo_mock.assert_called_with("echo 'hello!' > /remote/path/my_file")
-
-    @patch('prestoadmin.deploy.deploy')
-    @patch('prestoadmin.deploy.deploy_node_properties')
-    def test_configure_presto(self, deploy_node_mock, deploy_mock):
+        deploy.prepare_role_confs()
+        for host in ['master', 'slave1', 'slave2']:
+            env.host = host
+            deploy.coordinator()
+            deploy.workers()
+
+        self.assertEqual(1, coord_mock.return_value.get_conf.call_count)
+        self.assertEqual(1, worker_mock.return_value.get_conf.call_count)
+        configure_mock.assert_any_call({'c': 'coordinator'}, '/etc/presto')
+        configure_mock.assert_called_with({'w': 'worker'}, '/etc/presto')
+
+    @patch('prestoadmin.deploy.w.Worker')
+    @patch('prestoadmin.deploy.coord.Coordinator')
+    def test_prepare_only_roles_with_hosts(self, coord_mock, worker_mock):
+        self.addCleanup(deploy._role_confs.clear)
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['master']
+
+        deploy.prepare_role_confs()
+        deploy.prepare_role_confs('coordinator')
+
+        self.assertFalse(worker_mock.called)
+        self.assertEqual(2, coord_mock.return_value.get_conf.call_count)
+
+    @patch('prestoadmin.deploy.coord.Coordinator')
+    def test_prepare_aborts_on_invalid_conf(self, coord_mock):
+        self.addCleanup(deploy._role_confs.clear)
+        env.roledefs['coordinator'] = ['master']
+        env.roledefs['worker'] = ['master']
+        coord_mock.return_value.get_conf.side_effect = ConfigurationError(
+            'Coordinator cannot be false')
+
+        self.assertRaisesRegexp(SystemExit, 'Coordinator cannot be false',
+                                deploy.prepare_role_confs)
+
+    @patch('prestoadmin.deploy.deploy_changed')
+    def test_configure_presto(self, deploy_mock):
         env.host = 'localhost'
         conf = {"node.properties": {"key": "value"}, "jvm.config": ["list"]}
         remote_dir = "/my/remote/dir"
         deploy.configure_presto(conf, remote_dir)
-        deploy_mock.assert_called_with({"jvm.config": "list"}, remote_dir)
+        deploy_mock.assert_called_with({"node.properties": "key=value\n",
+                                        "jvm.config": "list\n"}, remote_dir)
 
-    def test_escape_quotes_do_nothing(self):
-        text = 'basic_text'
-        self.assertEqual('basic_text', deploy.escape_single_quotes(text))
+    @patch('prestoadmin.deploy.sudo')
+    def test_remote_hashes(self, sudo_mock):
+        sudo_mock.return_value = SudoResult()
+        sudo_mock.return_value.splitlines = lambda: [
+            'aaa  ./config.properties', 'bbb  ./catalog/tpch.properties']
+        self.assertEqual({'config.properties': 'aaa',
+                          'catalog/tpch.properties': 'bbb'},
+                         deploy.remote_hashes('/etc/presto'))
+        self.assertTrue(sudo_mock.call_args[0][0].startswith(
+            'cd /etc/presto 2>/dev/null || exit 0; '
+            'find . -type f -exec sha256sum {} +'))
+
+    def test_changed_files(self):
+        same = 'connector.name=tpch\n'
+        node_properties = 'node.environment=presto\n'
+        hashes = {'catalog/tpch.properties': hashlib.sha256(same).hexdigest(),
+                  'jvm.config': hashlib.sha256('-server').hexdigest(),
+                  'node.properties': 'with node.id',
+                  deploy.WITHOUT_NODE_ID:
+                      hashlib.sha256(node_properties).hexdigest()}
+        self.assertEqual(
+            ['config.properties', 'jvm.config'],
+            deploy.changed_files({'catalog/tpch.properties': same,
+                                  'jvm.config': '-Xmx16G\n',
+                                  'node.properties': node_properties,
+                                  'config.properties': 'coordinator=true\n'},
+                                 hashes))
+
+    @patch('prestoadmin.deploy._LOGGER')
+    @patch('prestoadmin.deploy.deploy_bundle')
+    @patch('prestoadmin.deploy.build_bundle')
+    @patch('prestoadmin.deploy.remote_hashes')
+    def test_deploy_changed_up_to_date(self, hashes_mock, build_mock,
+                                       deploy_mock, logger_mock):
+        env.host = 'master'
+        hashes_mock.return_value = {
+            'jvm.config': hashlib.sha256('-server\n').hexdigest()}
+        self.assertEqual([], deploy.deploy_changed({'jvm.config': '-server\n'},
+                                                   '/etc/presto'))
+        self.assertFalse(build_mock.called)
+        self.assertFalse(deploy_mock.called)
+        logger_mock.info.assert_called_with(
+            'Configuration is up to date on: master')
+        self.assertEqual('', self.test_stdout.getvalue())
+
+    @patch('prestoadmin.deploy._LOGGER')
+    @patch('prestoadmin.deploy.deploy_bundle')
+    @patch('prestoadmin.deploy.build_bundle', return_value='bundle.tar.gz')
+    @patch('prestoadmin.deploy.remote_hashes')
+    def test_deploy_changed_sends_changed_files(self, hashes_mock, build_mock,
+                                                deploy_mock, logger_mock):
+        env.host = 'master'
+        hashes_mock.return_value = {
+            'jvm.config': hashlib.sha256('-server\n').hexdigest()}
+        self.assertEqual(['config.properties'], deploy.deploy_changed(
+            {'jvm.config': '-server\n', 'config.properties': 'a=b\n'},
+            '/etc/presto'))
+        build_mock.assert_called_with({'config.properties': 'a=b\n'},
+                                      'presto:presto', 0600)
+        deploy_mock.assert_called_with('bundle.tar.gz', '/etc/presto',
+                                       'presto:presto')
+        logger_mock.info.assert_called_with(
+            'Updating config.properties on: master')
+        self.assertEqual('', self.test_stdout.getvalue())
+
+    @patch('prestoadmin.deploy.get_config_directory')
+    def test_build_bundle(self, config_dir_mock):
+        config_dir_mock.return_value = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_dir_mock.return_value)
+
+        path = deploy.build_bundle({'config.properties': 'a=b\n',
+                                    'catalog/tpch.properties':
+                                        'connector.name=tpch\n'})
+
+        self.assertEqual(path, deploy.build_bundle(
+            {'catalog/tpch.properties': 'connector.name=tpch\n',
+             'config.properties': 'a=b\n'}))
+        with closing(tarfile.open(path)) as archive:
+            members = dict((info.name, info) for info in archive)
+            self.assertEqual(['catalog', 'catalog/tpch.properties',
+                              'config.properties'], sorted(members))
+            self.assertTrue(members['catalog'].isdir())
+            self.assertEqual(0600, members['config.properties'].mode)
+            self.assertEqual('presto', members['config.properties'].uname)
+            self.assertEqual('a=b\n', archive.extractfile(
+                'config.properties').read())
+
+    @patch('prestoadmin.deploy.sudo', return_value=SudoResult())
+    @patch('prestoadmin.deploy.put')
+    def test_deploy_bundle(self, put_mock, sudo_mock):
+        deploy.deploy_bundle('/local/abc.tar.gz', '/etc/presto')
+
+        put_mock.assert_called_with('/local/abc.tar.gz',
+                                    '/tmp/presto-admin-abc.tar.gz')
+        command = sudo_mock.call_args[0][0]
+        self.assertTrue('mktemp -d /etc/.presto.staging-XXXXXX' in command)
+        self.assertTrue('tar -C "$staging" --same-owner -x -z -f '
+                        '/tmp/presto-admin-abc.tar.gz' in command)
+        self.assertTrue('chown --reference=/etc/presto "$staging"' in command)
+        self.assertFalse('presto:presto' in command)
+        self.assertTrue(command.endswith('mv "$staging" /etc/presto; '
+                                         'rm -rf "$staging.old"'))
 
-    def test_escape_quotes_has_quote(self):
-        text = "A quote! ' A quote!"
-        self.assertEqual("A quote! '\\'' A quote!",
-                         deploy.escape_single_quotes(text))
+    @patch('prestoadmin.deploy.sudo')
+    @patch('prestoadmin.deploy.put')
+    def test_deploy_bundle_without_presto_user(self, put_mock, sudo_mock):
+        sudo_mock.return_value = SudoResult()
+        sudo_mock.return_value.return_code = deploy.MISSING_OWNER_CODE
+        sudo_mock.return_value.failed = True
+        env.host = 'localhost'
+        self.assertRaisesRegexp(SystemExit, 'User presto does not exist',
+                                deploy.deploy_bundle, '/local/abc.tar.gz',
+                                '/etc/presto')
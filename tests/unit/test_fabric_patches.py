@@ -13,9 +13,11 @@
 # limitations under the License.
 import sys
 import logging
+import time
+from StringIO import StringIO
 
 from fabric import state
-from fabric.context_managers import hide, settings
+from fabric.context_managers import hide, settings, show
 from fabric.decorators import hosts, parallel, roles, serial
 from fabric.exceptions import NetworkError
 from fabric.tasks import Task
@@ -28,8 +30,13 @@ from mock import call
 from mock import patch
 from tests.base_test_case import BaseTestCase
 
+from prestoadmin.util import progress, tracing
 from prestoadmin.util.application import Application
-from prestoadmin.fabric_patches import execute
+from prestoadmin.util.host_history import HostHistory
+from prestoadmin.util.fabricapi import prepared_by
+from prestoadmin import fabric_patches
+from prestoadmin.fabric_patches import execute, execute_iter, log_output, \
+    LOG_OUTPUT_LIMIT
 
 
 APPLICATION_NAME = 'foo'
@@ -153,6 +160,40 @@ class FabricPatchesTest(BaseTestCase):
                 ]
         )
 
+    @patch('prestoadmin.fabric_patches._LOGGER')
+    def test_log_output_truncates_large_output(self, logger_mock,
+                                               logging_config_mock,
+                                               filesystem_mock):
+        out = fabric.operations._AttributeString(
+            'a' * LOG_OUTPUT_LIMIT + 'bcd')
+        out.command = 'cat big'
+        out.real_command = 'cat big'
+        out.stderr = 'error'
+
+        log_output(out)
+
+        half = 'a' * (LOG_OUTPUT_LIMIT // 2)
+        logger_mock.info.assert_called_with(
+            '\nCOMMAND: cat big\nFULL COMMAND: cat big\nSTDOUT: ' + half +
+            '\n... [3 characters omitted] ...\n' + half[3:] + 'bcd' +
+            '\nSTDERR: error')
+
+    @patch('fabric.operations._run_command')
+    @patch('prestoadmin.fabric_patches.tracing.span')
+    def test_sudo_is_traced(self, span_mock, run_command_mock,
+                            logging_config_mock, filesystem_mock):
+        out = fabric.operations._AttributeString('')
+        out.command = 'ls'
+        out.real_command = 'ls'
+        out.stderr = ''
+        run_command_mock.return_value = out
+
+        fabric.api.env.host_string = 'localhost'
+        fabric.api.sudo('ls')
+
+        span_mock.assert_called_with('sudo', 'command', host='localhost',
+                                     phase='command', command='ls')
+
 
 # Most of these tests were taken or modified from fabric's test_tasks.py
 # Below is the license for the fabric code:
@@ -431,6 +472,176 @@ class TestExecute(BaseTestCase):
         self.assertEqual(retval, {'127.0.0.1:2200': '2200',
                                   '127.0.0.1:2201': '2201'})
 
+    def test_parallel_host_failing_before_its_job(self):
+        """
+        A parallel host that fails before its job is started is still in
+        the results
+        """
+        network_error = NetworkError('Network message')
+        real_to_dict = fabric_patches.to_dict
+
+        def to_dict(host):
+            if host.endswith('2200'):
+                raise network_error
+            return real_to_dict(host)
+
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            return env.host_string.split(':')[1]
+        with patch('prestoadmin.fabric_patches.to_dict', side_effect=to_dict):
+            with settings(hide('everything'), skip_bad_hosts=True):
+                retval = execute(task)
+        self.assertEqual({'127.0.0.1:2200': network_error,
+                          '127.0.0.1:2201': '2201'}, retval)
+
+    def test_execute_iter_yields_in_completion_order(self):
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            port = env.host_string.split(':')[1]
+            if port == '2200':
+                time.sleep(0.5)
+            return port
+        with hide('everything'):
+            retval = list(execute_iter(task))
+        self.assertEqual([('127.0.0.1:2201', '2201'),
+                          ('127.0.0.1:2200', '2200')], retval)
+
+    def test_execute_iter_waits_for_jobs_when_closed(self):
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            if env.host_string.endswith('2200'):
+                time.sleep(0.5)
+        with hide('everything'):
+            results = execute_iter(task)
+            self.assertEqual(('127.0.0.1:2201', None), next(results))
+            start = time.time()
+            results.close()
+        self.assertTrue(time.time() - start >= 0.3)
+
+    @patch('prestoadmin.fabric_patches.reachability.find_unreachable')
+    def test_unreachable_hosts_are_not_run(self, find_unreachable_mock):
+        find_unreachable_mock.return_value = {
+            ('127.0.0.1', '2200'): 'Connection refused'}
+
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            return 'ran'
+        with settings(hide('everything'), skip_bad_hosts=True,
+                      probe_timeout=1):
+            retval = execute(task)
+
+        self.assertEqual('ran', retval['127.0.0.1:2201'])
+        self.assertTrue(isinstance(retval['127.0.0.1:2200'], NetworkError))
+        self.assertEqual('Unable to reach 127.0.0.1 on port 2200: '
+                         'Connection refused',
+                         retval['127.0.0.1:2200'].message)
+        find_unreachable_mock.assert_called_with(
+            [('127.0.0.1', '2200'), ('127.0.0.1', '2201')], 1)
+
+    @patch('prestoadmin.fabric_patches.journal')
+    def test_resume_skips_completed_hosts(self, journal_mock):
+        journal_mock.task_step.return_value = 'task:task'
+        journal_mock.is_done.side_effect = \
+            lambda host, step: host == '127.0.0.1:2200'
+
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            return 'ran'
+        with hide('everything'):
+            retval = execute(task)
+
+        self.assertEqual({'127.0.0.1:2200': None, '127.0.0.1:2201': 'ran'},
+                         retval)
+        self.assertTrue("[127.0.0.1:2200] Skipping task 'task', which "
+                        "already completed" in self.test_stdout.getvalue())
+
+    def test_prepare_runs_once_before_hosts(self):
+        prepared = []
+
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        @prepared_by(lambda value: prepared.append(value))
+        def task(value):
+            return prepared[:]
+        with hide('everything'):
+            retval = execute(task, 'conf')
+
+        self.assertEqual(['conf'], prepared)
+        self.assertEqual({'127.0.0.1:2200': ['conf'],
+                          '127.0.0.1:2201': ['conf']}, retval)
+
+    @patch('prestoadmin.fabric_patches.HostHistory.save')
+    @patch('prestoadmin.fabric_patches.HostHistory.load')
+    def test_longest_hosts_start_first(self, load_mock, save_mock):
+        history = HostHistory({'task': {'127.0.0.1:2200': 1.0,
+                                        '127.0.0.1:2201': 2.0}})
+        load_mock.return_value = history
+
+        @parallel(pool_size=1)
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201', '127.0.0.1:2202')
+        def task():
+            pass
+        with settings(hide('everything'), use_history=True):
+            results = [host for host, _ in execute_iter(task)]
+
+        self.assertEqual(['127.0.0.1:2201', '127.0.0.1:2200',
+                          '127.0.0.1:2202'], results)
+        self.assertTrue(save_mock.called)
+        self.assertTrue('127.0.0.1:2202' in history.durations['task'])
+
+    @patch('prestoadmin.fabric_patches.HostHistory.save')
+    @patch('prestoadmin.fabric_patches.HostHistory.load')
+    def test_time_left_goes_to_stderr(self, load_mock, save_mock):
+        load_mock.return_value = HostHistory({'task': {
+            '127.0.0.1:2200': 1.0, '127.0.0.1:2201': 1.0}})
+
+        class Terminal(StringIO):
+            def isatty(self):
+                return True
+
+        @parallel(pool_size=1)
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            pass
+        stdout, stderr = Terminal(), Terminal()
+        with patch('sys.stdout', stdout), patch('sys.stderr', stderr):
+            with settings(hide('running'), show('status'), use_history=True,
+                          progress=False):
+                execute(task)
+
+        self.assertTrue(stderr.getvalue().startswith(
+            '1 of 2 hosts done, about '))
+        self.assertFalse('hosts done' in stdout.getvalue())
+
+    def test_progress_is_summarized(self):
+        @parallel
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            with tracing.phase('transfer'):
+                progress.report(transferred=1024)
+        with settings(hide('everything'), progress=True):
+            execute(task)
+
+        self.assertTrue('task: 2 of 2 hosts done, 0 running, 0 failed, '
+                        '0 waiting, 0.' in self.test_stderr.getvalue())
+
+    def test_execute_iter_serial(self):
+        @serial
+        @hosts('127.0.0.1:2200', '127.0.0.1:2201')
+        def task():
+            return env.host_string
+        with hide('everything'):
+            results = execute_iter(task)
+            self.assertEqual(('127.0.0.1:2200', '127.0.0.1:2200'),
+                             next(results))
+            self.assertEqual(('127.0.0.1:2201', '127.0.0.1:2201'),
+                             next(results))
+
     @with_fakes
     def test_should_work_with_Task_subclasses(self):
         """
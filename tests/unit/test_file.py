@@ -44,3 +44,13 @@ class TestFile(BaseUnitCase):
             [call('chmod u+x /my/remote/path/script.sh'),
              call('/my/remote/path/script.sh'),
              call('rm /my/remote/path/script.sh')], any_order=False)
+
+    @patch('prestoadmin.file.fold.add_output')
+    @patch('prestoadmin.file.fold.is_enabled', return_value=True)
+    @patch('prestoadmin.file.sudo')
+    @patch('prestoadmin.file.put')
+    def test_script_output_is_folded(self, put_mock, sudo_mock,
+                                     is_enabled_mock, add_output_mock):
+        sudo_mock.return_value = 'script output'
+        file.run('/my/local/path/script.sh')
+        add_output_mock.assert_called_with('script output\n')
@@ -22,6 +22,8 @@ Tests for `prestoadmin` module.
 """
 from optparse import Values
 import os
+import shutil
+import tempfile
 import unittest
 from fabric import state
 
@@ -37,6 +39,7 @@ from prestoadmin import topology
 # require that this import be here in order to work properly.
 from prestoadmin.standalone.config import StandaloneConfig  # noqa
 from prestoadmin.util.exception import ConfigurationError
+from prestoadmin.util.task_manifest import LazyTaskModule
 from tests.unit.base_unit_case import BaseUnitCase
 
 
@@ -90,6 +93,13 @@ class BaseMainCase(BaseUnitCase):
         super(BaseMainCase, self).setUp(capture_output=True, load_config=False)
         # Empty out commands from previous tests.
         fabric.state.commands = {}
+        # Keep the task manifest cache out of the real config directory
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        patcher = patch('prestoadmin.util.task_manifest.get_config_directory',
+                        return_value=cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def _run_command_compare_to_file(self, command, exit_status, filename):
         """
@@ -167,12 +177,85 @@ class TestMain(BaseMainCase):
         commands = main.parse_and_validate_commands(["topology", "show"])
         self.assertEqual(commands[0][0], "topology.show")
 
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_only_module_of_command_is_loaded(self, unused_load_mock):
+        main.parse_and_validate_commands(["topology", "show"])
+
+        self.assertEqual(topology.show, state.commands['topology']['show'])
+        self.assertTrue(isinstance(state.commands['server'],
+                                   LazyTaskModule))
+
     @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
     def test_argument_parsing_with_arguments(self, unused_load_mock):
         commands = main.parse_and_validate_commands(["topology", "show", "f"])
         self.assertEqual(commands[0][0], "topology.show")
         self.assertEqual(commands[0][1], ["f"])
 
+    @patch('prestoadmin.util.journal.load_run')
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_resume_runs_in_recorded_directory(self, unused_load_mock,
+                                               load_run_mock):
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        load_run_mock.return_value = {
+            'arguments': ['topology', 'show', 'test_main.py', 'f'],
+            'cwd': cwd}
+        old_cwd = os.getcwd()
+        self.assertNotEqual(cwd, old_cwd)
+        try:
+            commands = main.parse_and_validate_commands(['--resume'])
+            self.assertEqual(cwd, os.getcwd())
+        finally:
+            os.chdir(old_cwd)
+        self.assertEqual(['test_main.py', 'f'], commands[0][1])
+
+    @patch('prestoadmin.util.journal.load_run')
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_resume_replays_options_and_hosts(self, unused_load_mock,
+                                              load_run_mock):
+        load_run_mock.return_value = {
+            'arguments': ['-H', 'master,slave1', '--nodeps', 'server',
+                          'install', 'rpm'],
+            'cwd': os.getcwd(), 'hosts': ['master', 'slave1'],
+            'exclude_hosts': []}
+        commands = main.parse_and_validate_commands(['--resume'])
+        self.assertEqual('server.install', commands[0][0])
+        self.assertEqual(['rpm'], commands[0][1])
+        self.assertEqual(['master', 'slave1'], env.hosts)
+        self.assertTrue(env.nodeps)
+        self.assertTrue(env.resume)
+
+    @patch('prestoadmin.util.journal.load_run')
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_resume_uses_recorded_hosts(self, unused_load_mock,
+                                        load_run_mock):
+        # The topology had fewer hosts when the command ran
+        load_run_mock.return_value = {
+            'arguments': ['server', 'install', 'rpm'],
+            'cwd': os.getcwd(), 'hosts': ['master'],
+            'exclude_hosts': ['master']}
+        main.parse_and_validate_commands(['--resume'])
+        self.assertEqual(['master'], env.hosts)
+        self.assertEqual(['master'], env.exclude_hosts)
+
+    @patch('prestoadmin.util.journal.load_run')
+    @patch('prestoadmin.main.load_config', side_effect=mock_load_topology())
+    def test_resume_with_hosts(self, unused_load_mock, load_run_mock):
+        load_run_mock.return_value = {
+            'arguments': ['-H', 'master', 'server', 'install', 'rpm'],
+            'cwd': os.getcwd(), 'hosts': ['master'], 'exclude_hosts': []}
+        main.parse_and_validate_commands(
+            ['--resume', '-H', 'slave2', '-x', 'slave1'])
+        self.assertEqual(['slave2'], env.hosts)
+        self.assertEqual(['slave1'], env.exclude_hosts)
+
+    @patch('prestoadmin.util.journal.load_run')
+    def test_resume_aborts_without_recorded_directory(self, load_run_mock):
+        load_run_mock.return_value = {
+            'arguments': ['topology', 'show'],
+            'cwd': '/does/not/exist'}
+        self.assertRaises(SystemExit, main.parse_and_validate_commands,
+                          ['--resume'])
+
     def test_arbitrary_remote_shell_disabled(self):
         self._run_command_compare_to_string(
             ["--", "echo", "hello"],
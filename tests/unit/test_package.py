@@ -12,6 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import os
+import shutil
+import tempfile
+
 from fabric.state import env
 from fabric.operations import _AttributeString
 from mock import patch
@@ -20,12 +25,20 @@ from prestoadmin.util import constants
 from tests.unit.base_unit_case import BaseUnitCase
 
 
+def _succeeded(output='', succeeded=True):
+    result = _AttributeString(output)
+    result.succeeded = succeeded
+    return result
+
+
 class TestPackage(BaseUnitCase):
 
+    @patch('prestoadmin.package.stream.can_stream', return_value=False)
     @patch('prestoadmin.package.os.path.isfile')
     @patch('prestoadmin.package.sudo')
     @patch('prestoadmin.package.put')
-    def test_deploy_is_called(self, mock_put, mock_sudo, mock_isfile):
+    def test_deploy_is_called(self, mock_put, mock_sudo, mock_isfile,
+                              can_stream_mock):
         env.host = 'any_host'
         mock_isfile.return_value = True
         package.deploy('/any/path/rpm')
@@ -102,10 +115,12 @@ class TestPackage(BaseUnitCase):
                                       capture=True)
         mock_abort.assert_called_with('Not an rpm package')
 
+    @patch('prestoadmin.package.stream.can_stream', return_value=False)
     @patch('prestoadmin.package.os.path.isfile')
     @patch('prestoadmin.package.sudo')
     @patch('prestoadmin.package.put')
-    def test_deploy_with_fallback_location(self, mock_put, mock_sudo, mock_isfile):
+    def test_deploy_with_fallback_location(self, mock_put, mock_sudo,
+                                           mock_isfile, can_stream_mock):
         env.host = 'any_host'
         mock_isfile.return_value = True
         package.deploy('/any/path/rpm')
@@ -117,6 +132,38 @@ class TestPackage(BaseUnitCase):
                                     use_sudo=True,
                                     temp_dir='/tmp')
 
+    @patch('prestoadmin.package.stream')
+    @patch('prestoadmin.package.sudo')
+    @patch('prestoadmin.package.put')
+    def test_deploy_streamed(self, mock_put, mock_sudo, mock_stream):
+        env.host = 'any_host'
+        mock_stream.can_stream.return_value = True
+        mock_stream.stream_in.return_value = _succeeded('abc  -')
+        mock_stream.stream_in.return_value.sha256 = 'abc'
+        mock_sudo.return_value = _succeeded()
+        rpm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, rpm_dir)
+        rpm_path = os.path.join(rpm_dir, 'test.rpm')
+        open(rpm_path, 'w').close()
+
+        package.deploy(rpm_path)
+
+        mock_stream.stream_in.assert_called_with(
+            rpm_path, 'set -o pipefail; mkdir -p /opt/prestoadmin/packages '
+            '&& cd /opt/prestoadmin/packages && tee .test.rpm.tmp | '
+            'sha256sum')
+        mock_sudo.assert_called_with('cd /opt/prestoadmin/packages && '
+                                     'mv -f .test.rpm.tmp test.rpm')
+        self.assertFalse(mock_put.called)
+
+        # The rpm is put instead if it did not arrive whole
+        mock_stream.stream_in.return_value.sha256 = 'def'
+        package.deploy(rpm_path)
+        mock_sudo.assert_any_call(
+            'rm -f /opt/prestoadmin/packages/.test.rpm.tmp')
+        mock_put.assert_called_with(rpm_path, constants.REMOTE_PACKAGES_PATH,
+                                    use_sudo=True)
+
     @patch('prestoadmin.package.os.path.isfile')
     def test_deploy_invalid_local_path(self, mock_isfile):
         mock_isfile.return_value = False
@@ -174,3 +221,157 @@ class TestPackage(BaseUnitCase):
         package.rpm_uninstall('anyrpm')
 
         self.assertTrue(mock_sudo.call_count == 0)
+
+
+class TestDeltaDeploy(BaseUnitCase):
+    def setUp(self):
+        super(TestDeltaDeploy, self).setUp(capture_output=True)
+        env.host = 'any_host'
+        self.rpm_dir = tempfile.mkdtemp()
+        self.old_rpm = self._write_rpm('presto-server-rpm-0.1.rpm', 'a')
+        self.new_rpm = self._write_rpm('presto-server-rpm-0.2.rpm', 'b')
+        for target, value in [('get_config_directory', self.rpm_dir),
+                              ('find_executable', '/usr/bin/makedeltarpm')]:
+            patcher = patch('prestoadmin.package.' + target,
+                            return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        package.prepare_delta(self.new_rpm)
+
+    def tearDown(self):
+        shutil.rmtree(self.rpm_dir)
+        super(TestDeltaDeploy, self).tearDown()
+
+    def _write_rpm(self, name, content):
+        path = os.path.join(self.rpm_dir, name)
+        with open(path, 'w') as rpm_file:
+            rpm_file.write(content * 1024)
+        return path
+
+    def _staged(self, *paths):
+        return _succeeded('\n'.join(
+            '%s  %s' % (hashlib.sha256(open(path).read()).hexdigest(),
+                        os.path.basename(path)) for path in paths))
+
+    @staticmethod
+    def _make_delta(command, capture):
+        with open(command.split()[-1], 'w') as delta_file:
+            delta_file.write('delta')
+        return _succeeded()
+
+    @patch('prestoadmin.package.deploy')
+    @patch('prestoadmin.package.local')
+    @patch('prestoadmin.package.put')
+    @patch('prestoadmin.package.sudo')
+    def test_deploy_delta(self, sudo_mock, put_mock, local_mock, deploy_mock):
+        sudo_mock.side_effect = [self._staged(self.old_rpm), _succeeded(),
+                                 self._staged(self.old_rpm), _succeeded()]
+        local_mock.side_effect = self._make_delta
+
+        package.deploy_delta(self.new_rpm)
+        package.deploy_delta(self.new_rpm)
+
+        # The delta is made once, for all of the nodes
+        self.assertEqual(1, local_mock.call_count)
+        self.assertTrue(local_mock.call_args[0][0].startswith(
+            'makedeltarpm %s %s ' % (self.old_rpm, self.new_rpm)))
+        delta_path = put_mock.call_args[0][0]
+        self.assertEqual(os.path.join(self.rpm_dir, package.DELTA_DIR_NAME),
+                         os.path.dirname(delta_path))
+        self.assertEqual(os.path.join(constants.REMOTE_PACKAGES_PATH,
+                                      os.path.basename(delta_path)),
+                         put_mock.call_args[0][1])
+        apply_command = sudo_mock.call_args[0][0]
+        self.assertTrue('applydeltarpm -r presto-server-rpm-0.1.rpm'
+                        in apply_command)
+        self.assertTrue(hashlib.sha256('b' * 1024).hexdigest()
+                        in apply_command)
+        self.assertTrue('presto-server-rpm-0.2.rpm;' in apply_command)
+        self.assertFalse(deploy_mock.called)
+        self.assertEqual('Package deployed as a delta of '
+                         'presto-server-rpm-0.1.rpm on: any_host\n' * 2,
+                         self.test_stdout.getvalue())
+
+    @patch('prestoadmin.package.deploy')
+    @patch('prestoadmin.package.put')
+    @patch('prestoadmin.package.sudo')
+    def test_deploy_delta_already_staged(self, sudo_mock, put_mock,
+                                         deploy_mock):
+        sudo_mock.return_value = self._staged(self.new_rpm, self.old_rpm)
+
+        package.deploy_delta(self.new_rpm)
+
+        self.assertEqual(1, sudo_mock.call_count)
+        self.assertFalse(put_mock.called)
+        self.assertFalse(deploy_mock.called)
+        self.assertEqual('Package already staged on: any_host\n',
+                         self.test_stdout.getvalue())
+
+    @patch('prestoadmin.package.deploy')
+    @patch('prestoadmin.package.local')
+    @patch('prestoadmin.package.sudo')
+    def test_deploy_delta_falls_back(self, sudo_mock, local_mock,
+                                     deploy_mock):
+        # The node has no RPM that is next to the new one locally
+        sudo_mock.return_value = _succeeded(
+            '%s  presto-server-rpm-0.0.rpm' % ('0' * 64))
+        package.deploy_delta(self.new_rpm)
+        deploy_mock.assert_called_with(self.new_rpm)
+
+        # The node cannot apply a delta
+        sudo_mock.return_value = _succeeded('', succeeded=False)
+        package.deploy_delta(self.new_rpm)
+        self.assertEqual(2, deploy_mock.call_count)
+
+        # The delta cannot be made
+        sudo_mock.return_value = self._staged(self.old_rpm)
+        local_mock.return_value = _succeeded(succeeded=False)
+        local_mock.return_value.stderr = 'makedeltarpm failed'
+        package.deploy_delta(self.new_rpm)
+        self.assertEqual(3, deploy_mock.call_count)
+
+    @patch('prestoadmin.package.deploy')
+    @patch('prestoadmin.package.local')
+    @patch('prestoadmin.package.sudo')
+    def test_failed_delta_leaves_no_temp_file(self, sudo_mock, local_mock,
+                                              deploy_mock):
+        def make_partial_delta(command, capture):
+            self._make_delta(command, capture)
+            result = _succeeded(succeeded=False)
+            result.stderr = 'makedeltarpm failed'
+            return result
+        sudo_mock.return_value = self._staged(self.old_rpm)
+        local_mock.side_effect = make_partial_delta
+
+        package.deploy_delta(self.new_rpm)
+
+        deploy_mock.assert_called_with(self.new_rpm)
+        delta_dir = os.path.join(self.rpm_dir, package.DELTA_DIR_NAME)
+        self.assertEqual([], [name for name in os.listdir(delta_dir)
+                              if not name.endswith('.lock')])
+
+    def test_prune_deltas(self):
+        delta_dir = os.path.join(self.rpm_dir, package.DELTA_DIR_NAME)
+        os.mkdir(delta_dir)
+        old, new = [hashlib.sha256(content * 1024).hexdigest()[:16]
+                    for content in ['a', 'b']]
+        gone = '0' * 16
+        kept = ['%s-%s.drpm' % (old, new), '%s-%s.drpm.lock' % (old, new)]
+        pruned = ['%s-%s.drpm' % (gone, new), '%s-%s.drpm.lock' % (gone, new),
+                  '%s-%s.drpm.tmp' % (old, gone)]
+        for name in kept + pruned:
+            open(os.path.join(delta_dir, name), 'w').close()
+
+        package.prepare_delta(self.new_rpm)
+
+        self.assertEqual(sorted(kept), sorted(os.listdir(delta_dir)))
+
+    @patch('prestoadmin.package.deploy')
+    @patch('prestoadmin.package.sudo')
+    def test_deploy_delta_without_makedeltarpm(self, sudo_mock, deploy_mock):
+        with patch('prestoadmin.package.find_executable', return_value=None):
+            package.prepare_delta(self.new_rpm)
+            package.deploy_delta(self.new_rpm)
+
+        self.assertFalse(sudo_mock.called)
+        deploy_mock.assert_called_with(self.new_rpm)
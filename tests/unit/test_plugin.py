@@ -15,6 +15,15 @@
 """
 unit tests for plugin module
 """
+from contextlib import closing
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+
+from fabric.api import env
+from fabric.operations import _AttributeString
 from mock import patch
 from prestoadmin import plugin
 from tests.unit.base_unit_case import BaseUnitCase
@@ -33,3 +42,90 @@ class TestPlugin(BaseUnitCase):
                        '/etc/presto/plugin')
         write_mock.assert_called_with('/my/local/path.jar',
                                       '/etc/presto/plugin/hive-hadoop2')
+
+
+class TestPluginSync(BaseUnitCase):
+    def setUp(self):
+        super(TestPluginSync, self).setUp(capture_output=True)
+        env.host = 'any_host'
+        self.local_dir = tempfile.mkdtemp()
+        for name, content in [('a.jar', 'a'), ('b.jar', 'b')]:
+            with open(os.path.join(self.local_dir, name), 'w') as jar:
+                jar.write(content)
+        self.config_dir = tempfile.mkdtemp()
+        patcher = patch('prestoadmin.plugin.get_config_directory',
+                        return_value=self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        plugin.prepare_sync(self.local_dir, 'my_connector')
+
+    def tearDown(self):
+        shutil.rmtree(self.local_dir)
+        shutil.rmtree(self.config_dir)
+        super(TestPluginSync, self).tearDown()
+
+    @staticmethod
+    def _result(output=''):
+        result = _AttributeString(output)
+        result.failed = False
+        return result
+
+    def _remote_files(self, files):
+        return self._result('\n'.join(
+            '%d %s  ./%s' % (len(content), hashlib.sha256(content).hexdigest(),
+                             name) for name, content in files))
+
+    @patch('prestoadmin.plugin.put')
+    @patch('prestoadmin.plugin.sudo')
+    def test_sync(self, sudo_mock, put_mock):
+        sudo_mock.side_effect = [
+            self._remote_files([('a.jar', 'a'), ('b.jar', 'old'),
+                                ('stale one.jar', 'c')]),
+            self._result()]
+        put_mock.side_effect = self._check_archive
+
+        plugin.sync(self.local_dir, 'my_connector')
+
+        self.assertEqual(1, put_mock.call_count)
+        command = sudo_mock.call_args[0][0]
+        self.assertTrue('"$staging"/\'stale one.jar\'' in command)
+        self.assertTrue('mv "$staging" /usr/lib/presto/lib/plugin/'
+                        'my_connector' in command)
+        self.assertTrue('chown -R --reference="$owner" "$staging"; '
+                        'if [ -d /usr/lib/presto/lib/plugin/my_connector ]; '
+                        'then mv' in command)
+        self.assertEqual('Updating 1 and removing 1 files of plugin '
+                         'my_connector on: any_host\n',
+                         self.test_stdout.getvalue())
+
+    def _check_archive(self, archive_path, remote_path):
+        self.assertEqual('/tmp/presto-admin-' +
+                         os.path.basename(archive_path), remote_path)
+        with closing(tarfile.open(archive_path)) as archive:
+            self.assertEqual(['b.jar'], archive.getnames())
+
+    @patch('prestoadmin.plugin.put')
+    @patch('prestoadmin.plugin.sudo')
+    def test_sync_up_to_date(self, sudo_mock, put_mock):
+        sudo_mock.return_value = self._remote_files([('a.jar', 'a'),
+                                                     ('b.jar', 'b')])
+
+        plugin.sync(self.local_dir, 'my_connector', '/etc/presto/plugin')
+
+        self.assertEqual(1, sudo_mock.call_count)
+        self.assertTrue('/etc/presto/plugin/my_connector' in
+                        sudo_mock.call_args[0][0])
+        self.assertFalse(put_mock.called)
+        self.assertEqual('Plugin my_connector is up to date on: any_host\n',
+                         self.test_stdout.getvalue())
+
+    def test_sync_invalid_local_dir(self):
+        self.assertRaisesRegexp(SystemExit,
+                                'Plugin directory not found at /invalid',
+                                plugin.prepare_sync, '/invalid',
+                                'my_connector')
+        os.remove(os.path.join(self.local_dir, 'a.jar'))
+        os.remove(os.path.join(self.local_dir, 'b.jar'))
+        self.assertRaisesRegexp(SystemExit, 'No files to sync',
+                                plugin.prepare_sync, self.local_dir,
+                                'my_connector')
@@ -25,7 +25,7 @@ from mock import patch, call, MagicMock
 from prestoadmin import server
 from prestoadmin.prestoclient import PrestoClient
 from prestoadmin.server import INIT_SCRIPTS
-from prestoadmin.util import constants
+from prestoadmin.util import constants, fold
 from prestoadmin.util.exception import ConfigFileNotFoundError, \
     ConfigurationError
 from prestoadmin.util.fabricapi import get_host_list
@@ -477,22 +477,78 @@ class TestInstall(BaseUnitCase):
                          'respond.\nServer started successfully on: '
                          'good_node\n', self.test_stdout.getvalue())
 
+    @patch('prestoadmin.server.package.prepare_delta')
+    @patch('prestoadmin.server.backup_store.new_snapshot')
+    @patch('prestoadmin.util.journal._resumed_steps',
+           {(None, 'upgrade snapshot'): '20170131T100000'})
+    def test_resumed_upgrade_reuses_snapshot(self, mock_snapshot,
+                                             unused_mock_delta):
+        self.addCleanup(setattr, server, '_upgrade_snapshot', None)
+
+        server.prepare_upgrade('/path/to/rpm')
+
+        self.assertFalse(mock_snapshot.called)
+        self.assertEqual('20170131T100000', server._upgrade_snapshot)
+
+    @patch('prestoadmin.server.package.deploy_upgrade')
+    @patch('prestoadmin.server.run_step')
+    @patch('prestoadmin.server.backup_store.new_snapshot',
+           return_value='20170131T100000')
+    def test_upgrade_backs_up_config(self, mock_snapshot, mock_run_step,
+                                     mock_upgrade):
+        self.addCleanup(setattr, server, '_upgrade_snapshot', None)
+        mock_run_step.return_value = '/tmp/presto_config-abc.tar'
+
+        server.prepare_upgrade('/path/to/rpm')
+        server.upgrade('/path/to/rpm')
+
+        mock_snapshot.assert_called_once_with()
+        self.assertEqual(
+            [call('stop', server.stop),
+             call('backup config', server.configure_cmds.backup_host,
+                  '20170131T100000'),
+             call('gather config',
+                  server.configure_cmds.gather_config_directory),
+             call('configure', server.configure_cmds.deploy_config_directory,
+                  '/tmp/presto_config-abc.tar')],
+            mock_run_step.call_args_list)
+        mock_upgrade.assert_called_with('/path/to/rpm')
+
+    @patch('prestoadmin.server.add_tpch_catalog')
+    @patch('prestoadmin.server.catalog')
+    @patch('prestoadmin.deploy.prepare_role_confs')
+    @patch('prestoadmin.deploy.role_bundle')
+    def test_update_config_prepared(self, mock_bundle, mock_prepare,
+                                    mock_catalog, mock_add_tpch):
+        self.addCleanup(setattr, server, '_catalog_names', None)
+        mock_catalog.get_catalog_files.return_value = ['tpch.properties']
+
+        server.prepare_configs('/any/path/rpm')
+        server.update_configs()
+        server.update_configs()
+
+        mock_prepare.assert_called_once_with()
+        self.assertEqual(1, mock_add_tpch.call_count)
+        self.assertEqual(1, mock_catalog.get_catalog_files.call_count)
+        mock_bundle.assert_called_with(get_catalog_directory(),
+                                       ['tpch.properties'])
+
     @patch('prestoadmin.server.catalog')
-    @patch('prestoadmin.server.configure_cmds.deploy')
+    @patch('prestoadmin.deploy.role_bundle')
     @patch('prestoadmin.server.os.path.exists')
     @patch('prestoadmin.server.os.makedirs')
     @patch('prestoadmin.server.util.filesystem.os.fdopen')
     @patch('prestoadmin.server.util.filesystem.os.open')
     def test_update_config(self, mock_open, mock_fdopen, mock_makedir,
-                           mock_path_exists, mock_config, mock_connector):
+                           mock_path_exists, mock_bundle, mock_connector):
         e = ConfigFileNotFoundError(
             message='problems', config_path='config_path')
-        mock_connector.add.side_effect = e
+        mock_connector.get_catalog_files.side_effect = e
         mock_path_exists.side_effect = [False, False]
 
         server.update_configs()
 
-        mock_config.assert_called_with()
+        mock_bundle.assert_called_with(get_catalog_directory(), [])
         mock_makedir.assert_called_with(get_catalog_directory())
         mock_open.assert_called_with(os.path.join(get_catalog_directory(),
                                                   'tpch.properties'),
@@ -574,6 +630,56 @@ class TestInstall(BaseUnitCase):
             self.test_stdout.getvalue().splitlines()
         )
 
+    @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
+           return_value=PRESTO_CONFIG)
+    @patch('prestoadmin.server.execute')
+    @patch('prestoadmin.server.get_presto_version')
+    @patch.object(PrestoClient, 'run_sql')
+    def test_status_folded(self, mock_run_sql, mock_get_presto_version,
+                           mock_execute, mock_presto_config):
+        env.roledefs = {
+            'coordinator': ['Node1'],
+            'worker': ['Node2', 'Node3', 'Node4'],
+            'all': ['Node1', 'Node2', 'Node3', 'Node4']
+        }
+        env.hosts = env.roledefs['all']
+        mock_get_presto_version.return_value = '0.97-SNAPSHOT'
+        mock_run_sql.side_effect = [
+            [['select * from system.runtime.nodes']],
+            [['hive'], ['system'], ['tpch']],
+            [['http://node1/statement', 'presto-main:0.97', True]],
+            [['http://node2/statement', 'presto-main:0.97', True]],
+            [['http://node3/statement', 'presto-main:0.97', True]],
+        ]
+        mock_execute.side_effect = [{
+            'Node1': ('IP1', True, ''),
+            'Node2': ('IP2', True, ''),
+            'Node3': ('IP3', True, ''),
+            'Node4': Exception('Timed out trying to connect to Node4')
+        }]
+        env.host = 'Node1'
+        fold.start()
+        server.get_status_from_coordinator()
+        fold.finish()
+
+        self.assertEqual(
+            ['----------------', 'Node1', '----------------',
+             'Server Status:', '\tRoles: coordinator: Running',
+             '\tPresto Version: presto-main:0.97',
+             '\tNode status:    active',
+             '\tCatalogs:     hive, system, tpch',
+             '----------------', 'Node[2-3]', '----------------',
+             'Server Status:', '\tRoles: worker: Running',
+             '\tPresto Version: presto-main:0.97',
+             '\tNode status:    active',
+             '\tCatalogs:     hive, system, tpch',
+             '----------------', 'Node4', '----------------',
+             'Server Status:', '\tRoles: worker: Not Running',
+             '\tTimed out trying to connect to Node4',
+             'Summary:', '\tNot Running: 1 (Node4)',
+             '\tRunning: 3 (Node[1-3])'],
+            self.test_stdout.getvalue().splitlines())
+
     @patch('prestoadmin.util.presto_config.PrestoConfig.coordinator_config',
            return_value=PRESTO_CONFIG)
     @patch('prestoadmin.server.check_presto_version')
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util import backup_store
+from tests.base_test_case import BaseTestCase
+
+
+class TestBackupStore(BaseTestCase):
+    def setUp(self):
+        super(TestBackupStore, self).setUp()
+        self.config_dir = tempfile.mkdtemp()
+        patcher = patch('prestoadmin.util.backup_store.get_config_directory',
+                        return_value=self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+        super(TestBackupStore, self).tearDown()
+
+    def test_blobs_are_stored_once(self):
+        digest = backup_store.add_blob('coordinator=false\n')
+
+        self.assertEqual(hashlib.sha256('coordinator=false\n').hexdigest(),
+                         digest)
+        self.assertEqual(digest, backup_store.add_blob('coordinator=false\n'))
+        self.assertTrue(backup_store.has_blob(digest))
+        self.assertEqual('coordinator=false\n', backup_store.read_blob(digest))
+        self.assertEqual([digest], os.listdir(os.path.join(
+            backup_store.get_backup_directory(), backup_store.BLOB_DIR_NAME)))
+
+    @patch('prestoadmin.util.backup_store.time.strftime',
+           return_value='20170131T100000')
+    def test_snapshots_in_same_second(self, strftime_mock):
+        for _ in range(11):
+            backup_store.new_snapshot()
+
+        backup_store.write_manifest('20170131T100000.10', 'master', [])
+
+        snapshots = backup_store.list_snapshots()
+        self.assertEqual('20170131T100000', snapshots[0])
+        self.assertEqual('20170131T100000.10', snapshots[-1])
+        self.assertEqual('20170131T100000.10', backup_store.latest_snapshot())
+
+    def test_latest_snapshot_skips_snapshots_without_hosts(self):
+        backed_up = backup_store.new_snapshot()
+        backup_store.write_manifest(backed_up, 'master', [])
+        backup_store.write_manifest(backed_up, 'slave1', [])
+        with patch('prestoadmin.util.backup_store.time.strftime',
+                   return_value='99991231T235959'):
+            interrupted = backup_store.new_snapshot()
+
+        self.assertEqual(interrupted, backup_store.list_snapshots()[-1])
+        self.assertEqual([], backup_store.snapshot_hosts(interrupted))
+        self.assertEqual(['master', 'slave1'],
+                         backup_store.snapshot_hosts(backed_up))
+        self.assertEqual(backed_up, backup_store.latest_snapshot())
+
+    def test_manifest(self):
+        snapshot = backup_store.new_snapshot()
+        entries = [{'path': 'jvm.config', 'type': 'f', 'mode': '600',
+                    'owner': 'presto:presto', 'sha256': 'abc'},
+                   {'path': 'catalog', 'type': 'd', 'mode': '755',
+                    'owner': 'presto:presto'}]
+
+        backup_store.write_manifest(snapshot, 'slave1', entries)
+
+        self.assertEqual(sorted(entries, key=lambda entry: entry['path']),
+                         backup_store.read_manifest(snapshot, 'slave1'))
+        self.assertEqual(None, backup_store.read_manifest(snapshot, 'slave2'))
+
+    def test_has_snapshot(self):
+        snapshot = backup_store.new_snapshot()
+
+        self.assertTrue(backup_store.has_snapshot(snapshot))
+        self.assertFalse(backup_store.has_snapshot('20170131T100000'))
+        self.assertFalse(backup_store.has_snapshot('..'))
+
+    def test_no_snapshots(self):
+        self.assertEqual([], backup_store.list_snapshots())
+        self.assertEqual(None, backup_store.latest_snapshot())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from prestoadmin.util.concurrency import ConcurrencyController, \
+    get_resource_limits
+from tests.base_test_case import BaseTestCase
+
+
+class TestConcurrencyController(BaseTestCase):
+    def test_initial_limit_from_cpus_with_high_ulimits(self):
+        controller = ConcurrencyController(1000, cpu_count=4, fd_limit=65536,
+                                           process_limit=65536)
+        self.assertEqual(32, controller.limit)
+        self.assertEqual(1000, controller.max_limit)
+
+    def test_initial_limit_from_fd_limit(self):
+        controller = ConcurrencyController(1000, cpu_count=64, fd_limit=1024,
+                                           process_limit=65536)
+        self.assertEqual(120, controller.limit)
+        self.assertEqual(120, controller.max_limit)
+
+    def test_initial_limit_from_process_limit(self):
+        controller = ConcurrencyController(1000, cpu_count=64,
+                                           fd_limit=65536, process_limit=200)
+        self.assertEqual(100, controller.limit)
+
+    def test_initial_limit_from_host_count(self):
+        controller = ConcurrencyController(3, cpu_count=4, fd_limit=65536,
+                                           process_limit=65536)
+        self.assertEqual(3, controller.limit)
+
+    def test_initial_limit_at_least_one(self):
+        controller = ConcurrencyController(10, cpu_count=1, fd_limit=16,
+                                           process_limit=1)
+        self.assertEqual(1, controller.limit)
+
+    def _record(self, controller, durations, failed=False):
+        for duration in durations:
+            controller.record(duration, failed)
+
+    def test_grows_while_hosts_are_fine(self):
+        controller = ConcurrencyController(1000, cpu_count=1, fd_limit=65536,
+                                           process_limit=65536)
+        self._record(controller, [1.0] * 8)
+        self.assertEqual(10, controller.limit)
+        self._record(controller, [1.0] * 10)
+        self.assertEqual(12, controller.limit)
+
+    def test_never_grows_past_max(self):
+        controller = ConcurrencyController(10, cpu_count=1, fd_limit=65536,
+                                           process_limit=65536)
+        self._record(controller, [1.0] * 8)
+        self.assertEqual(10, controller.limit)
+
+    def test_backs_off_on_errors(self):
+        controller = ConcurrencyController(1000, cpu_count=1, fd_limit=65536,
+                                           process_limit=65536)
+        self._record(controller, [1.0] * 6)
+        self._record(controller, [1.0] * 2, failed=True)
+        self.assertEqual(4, controller.limit)
+
+    def test_backs_off_when_hosts_slow_down(self):
+        controller = ConcurrencyController(1000, cpu_count=1, fd_limit=65536,
+                                           process_limit=65536)
+        self._record(controller, [1.0] * 8)
+        self.assertEqual(10, controller.limit)
+        self._record(controller, [3.0] * 10)
+        self.assertEqual(7, controller.limit)
+
+    def test_get_resource_limits(self):
+        cpu_count, fd_limit, process_limit = get_resource_limits()
+        self.assertTrue(cpu_count >= 1)
+        self.assertTrue(fd_limit > 0)
+        self.assertTrue(process_limit > 0)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import Queue
+from StringIO import StringIO
+
+from fabric.api import env
+
+from prestoadmin.standalone.config import _expand_host
+from prestoadmin.util import fold
+from prestoadmin.util.fold import OutputFolder, compress_hosts
+from tests.base_test_case import BaseTestCase
+
+
+class TestFold(BaseTestCase):
+    def setUp(self):
+        super(TestFold, self).setUp(capture_output=True)
+        self.addCleanup(fold.set_queue, None)
+        self.addCleanup(fold.finish, StringIO())
+
+    def test_compress_hosts(self):
+        self.assertEqual(['master', 'slave[1-3]', 'slave5'],
+                         compress_hosts(['slave2', 'master', 'slave1',
+                                         'slave5', 'slave3']))
+
+    def test_compress_zero_padded_hosts(self):
+        self.assertEqual(['node[08-10]', 'node9'],
+                         compress_hosts(['node08', 'node09', 'node9',
+                                         'node10']))
+        self.assertEqual(['slave[01-12]'],
+                         compress_hosts(['slave%02d' % i
+                                         for i in range(1, 13)]))
+        self.assertEqual(['node97', 'node[098-100]'],
+                         compress_hosts(['node098', 'node099', 'node100',
+                                         'node97']))
+
+    def test_compress_hosts_with_suffix(self):
+        self.assertEqual(['10.0.0.[1-2]', 'slave[1-2].example.com'],
+                         compress_hosts(['slave1.example.com', '10.0.0.2',
+                                         'slave2.example.com', '10.0.0.1']))
+
+    def test_compressed_hosts_expand_back(self):
+        hosts = ['slave%d' % i for i in range(1, 13)] + \
+            ['node%03d' % i for i in range(95, 105)] + \
+            ['worker%02d' % i for i in range(1, 13)] + ['master']
+        expanded = [host for compressed in compress_hosts(hosts)
+                    for host in _expand_host(compressed)]
+        self.assertEqual(sorted(hosts), sorted(expanded))
+
+    def test_identical_output_is_folded(self):
+        folder = OutputFolder()
+        for host in ['slave1', 'slave2', 'slave4']:
+            folder.add(host, 'same\n')
+            folder.end_host(host)
+        folder.add('slave3', 'diff')
+        folder.add('slave3', 'erent\n')
+        stream = StringIO()
+        folder.write(stream)
+
+        self.assertEqual('----------------\n'
+                         'slave[1-2], slave4\n'
+                         '----------------\n'
+                         'same\n'
+                         '----------------\n'
+                         'slave3\n'
+                         '----------------\n'
+                         'different\n', stream.getvalue())
+
+    def test_state_summary(self):
+        folder = OutputFolder()
+        folder.add('slave1', 'up\n', 'Running')
+        folder.add('slave2', 'up\n', 'Running')
+        folder.add('slave3', 'down\n', 'Not Running')
+        stream = StringIO()
+        folder.write(stream)
+
+        self.assertTrue(stream.getvalue().endswith(
+            'Summary:\n'
+            '\tNot Running: 1 (slave3)\n'
+            '\tRunning: 2 (slave[1-2])\n'))
+
+    def test_large_output_is_spooled(self):
+        folder = OutputFolder()
+        for host in ['slave1', 'slave2']:
+            for _ in range(100):
+                folder.add(host, 'x' * 1024)
+            folder.end_host(host)
+        stream = StringIO()
+        folder.write(stream)
+
+        self.assertEqual(100 * 1024, stream.getvalue().count('x'))
+
+    def test_capture(self):
+        fold.start()
+        env.host_string = 'master'
+        with fold.capture('Running'):
+            print('captured')
+        self.assertEqual('', self.test_stdout.getvalue())
+        stream = StringIO()
+        fold.finish(stream)
+
+        self.assertEqual('----------------\nmaster\n----------------\n'
+                         'captured\nSummary:\n\tRunning: 1 (master)\n',
+                         stream.getvalue())
+        self.assertFalse(fold.is_enabled())
+
+    def test_output_is_sent_through_queue(self):
+        queue = Queue.Queue()
+        fold.set_queue(queue)
+        fold.add_output('text', host='master')
+        self.assertEqual({'name': 'master', 'folded': 'text', 'state': None},
+                         queue.get_nowait())
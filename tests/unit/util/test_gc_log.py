@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from prestoadmin.util import gc_log
+from prestoadmin.util.stats import percentile
+from tests.base_test_case import BaseTestCase
+
+JAVA8_DETAILS_LOG = [
+    '2017-01-31T10:00:01.000+0000: 10.000: [GC pause (G1 Evacuation Pause) '
+    '(young), 0.0200000 secs]',
+    '   [Eden: 1024.0M(1024.0M)->0.0B(1024.0M) Survivors: 0.0B->64.0M '
+    'Heap: 1024.0M(4096.0M)->128.0M(4096.0M)]',
+    '2017-01-31T10:00:11.000+0000: 20.000: [GC pause (G1 Humongous '
+    'Allocation) (young) (initial-mark), 0.0500000 secs]',
+    '   [Eden: 1024.0M(1024.0M)->0.0B(1024.0M) Survivors: 64.0M->64.0M '
+    'Heap: 1.1G(4096.0M)->256.0M(4096.0M)]',
+    '2017-01-31T10:00:21.000+0000: 30.000: [GC remark, 0.0100000 secs]',
+    '2017-01-31T10:00:31.000+0000: 40.000: [Full GC (Allocation Failure)  '
+    '4095M->1024M(4096M), 2.0000000 secs]',
+]
+
+UNIFIED_LOG = [
+    '[1.500s][info][gc] GC(0) Pause Young (Normal) (G1 Evacuation Pause) '
+    '24M->4M(256M) 3.123ms',
+    '[2.500s][info][gc] GC(1) Pause Young (Concurrent Start) '
+    '(G1 Humongous Allocation) 124M->8M(256M) 5.000ms',
+    '[3.500s][info][gc] GC(2) Pause Full (System.gc()) 108M->6M(256M) '
+    '40.000ms',
+]
+
+
+class TestGcLog(BaseTestCase):
+    def test_find_gc_log_path(self):
+        self.assertEqual('/var/log/presto/gc.log', gc_log.find_gc_log_path(
+            ['-server', '-Xloggc:/var/log/presto/gc.log',
+             '-XX:+PrintGCDetails']))
+        self.assertEqual('/var/log/presto/gc-*.log', gc_log.find_gc_log_path(
+            ['-Xlog:gc*:file=/var/log/presto/gc-%p.log:time,uptime']))
+        self.assertIsNone(gc_log.find_gc_log_path(['-server', '-Xmx16G']))
+
+    def test_parse_java8_details_log(self):
+        events = gc_log.parse_gc_log(JAVA8_DETAILS_LOG)
+
+        self.assertEqual([10.0, 20.0, 30.0, 40.0],
+                         [event.uptime for event in events])
+        self.assertEqual([20.0, 50.0, 10.0, 2000.0],
+                         [round(event.pause_ms, 3) for event in events])
+        self.assertEqual([1024.0, 1126.4, None, 4095.0],
+                         [event.heap_before_mb for event in events])
+        self.assertEqual([False, True, False, False],
+                         [event.is_humongous() for event in events])
+        self.assertEqual([False, False, False, True],
+                         [event.is_full() for event in events])
+
+    def test_parse_unified_log(self):
+        events = gc_log.parse_gc_log(UNIFIED_LOG)
+
+        self.assertEqual([1.5, 2.5, 3.5], [event.uptime for event in events])
+        self.assertEqual([3.123, 5.0, 40.0],
+                         [event.pause_ms for event in events])
+        self.assertEqual([24.0, 124.0, 108.0],
+                         [event.heap_before_mb for event in events])
+        self.assertEqual([False, False, True],
+                         [event.is_full() for event in events])
+
+    def test_compute_gc_statistics(self):
+        statistics = gc_log.compute_gc_statistics(
+            gc_log.parse_gc_log(UNIFIED_LOG))
+
+        self.assertEqual(3, statistics['pauses'])
+        self.assertEqual(5.0, statistics['p50_pause_ms'])
+        self.assertEqual(40.0, statistics['p99_pause_ms'])
+        self.assertEqual(40.0, statistics['max_pause_ms'])
+        self.assertEqual(1, statistics['full_gcs'])
+        self.assertEqual(1, statistics['humongous_allocations'])
+        # (124 - 4) + (108 - 8) MB allocated over 2 seconds
+        self.assertEqual(110.0, statistics['allocation_rate_mb_per_sec'])
+
+    def test_allocation_rate_is_reset_across_files_and_restarts(self):
+        events = gc_log.parse_gc_log(
+            [gc_log.GC_LOG_FILE_MARKER + '/var/log/presto/gc.log.0'] +
+            UNIFIED_LOG +
+            # The JVM was restarted, so the uptime starts over
+            ['[1.000s][info][gc] GC(0) Pause Young (Normal) '
+             '(G1 Evacuation Pause) 20M->4M(256M) 1.000ms',
+             gc_log.GC_LOG_FILE_MARKER + '/var/log/presto/gc.log.1',
+             '[9.000s][info][gc] GC(5) Pause Young (Normal) '
+             '(G1 Evacuation Pause) 44M->4M(256M) 1.000ms',
+             '[11.000s][info][gc] GC(6) Pause Young (Normal) '
+             '(G1 Evacuation Pause) 24M->4M(256M) 1.000ms'])
+
+        self.assertEqual([1, 1, 1, 2, 3, 3],
+                         [event.segment for event in events])
+        statistics = gc_log.compute_gc_statistics(events)
+        # (124 - 4) + (108 - 8) + (24 - 4) MB allocated over 2 + 2 seconds
+        self.assertEqual(60.0, statistics['allocation_rate_mb_per_sec'])
+
+    def test_compute_gc_statistics_without_pauses(self):
+        statistics = gc_log.compute_gc_statistics([])
+
+        self.assertEqual(0, statistics['pauses'])
+        self.assertIsNone(statistics['p99_pause_ms'])
+        self.assertIsNone(statistics['allocation_rate_mb_per_sec'])
+
+    def test_format_ranking_orders_worst_node_first(self):
+        good = gc_log.compute_gc_statistics(
+            gc_log.parse_gc_log(UNIFIED_LOG[:2]))
+        bad = gc_log.compute_gc_statistics(gc_log.parse_gc_log(UNIFIED_LOG))
+
+        lines = gc_log.format_ranking({'good': good, 'bad': bad}).splitlines()
+
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith('Host'))
+        self.assertTrue(lines[1].startswith('bad '))
+        self.assertTrue(lines[2].startswith('good'))
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(2, percentile([3, 1, 2, 4], 0.5))
+        self.assertEqual(4, percentile([3, 1, 2, 4], 0.99))
+        self.assertEqual(1, percentile([3, 1, 2, 4], 0))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util.host_history import HostHistory, estimate_remaining, \
+    format_duration, record_transfers
+from tests.base_test_case import BaseTestCase
+
+
+class TestHostHistory(BaseTestCase):
+    def setUp(self):
+        super(TestHostHistory, self).setUp()
+        self.config_dir = tempfile.mkdtemp()
+        patcher = patch(
+            'prestoadmin.util.host_history.get_config_directory',
+            return_value=self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+        super(TestHostHistory, self).tearDown()
+
+    def test_load_without_history(self):
+        history = HostHistory.load()
+        self.assertEqual(None, history.estimate('install', 'master'))
+
+    def test_save_and_load(self):
+        history = HostHistory()
+        history.record_duration('install', 'master', 10.0)
+        history.record_transfer('master', 1024 * 1024, 2.0)
+        history.save()
+
+        history = HostHistory.load()
+        self.assertEqual(10.0, history.estimate('install', 'master'))
+        self.assertEqual({'master': 512 * 1024}, history.transfer_rates)
+
+    def test_durations_are_averaged(self):
+        history = HostHistory()
+        history.record_duration('install', 'master', 10.0)
+        history.record_duration('install', 'master', 20.0)
+        self.assertEqual(15.0, history.estimate('install', 'master'))
+
+    def test_small_transfers_are_ignored(self):
+        history = HostHistory()
+        history.record_transfer('master', 100, 1.0)
+        self.assertEqual({}, history.transfer_rates)
+
+    def test_estimate_unknown_host(self):
+        history = HostHistory({'install': {'slave1': 10.0, 'slave2': 20.0,
+                                           'slave3': 30.0}})
+        self.assertEqual(20.0, history.estimate('install', 'slave4'))
+
+    def test_estimate_unknown_host_from_transfer_rate(self):
+        history = HostHistory({'install': {'slave1': 10.0, 'slave2': 10.0}},
+                              {'slave1': 100.0, 'slave2': 100.0,
+                               'slave3': 25.0})
+        self.assertEqual(40.0, history.estimate('install', 'slave3'))
+
+    def test_order_longest_first(self):
+        history = HostHistory({'install': {'slave1': 5.0, 'slave2': 30.0,
+                                           'slave3': 10.0}})
+        self.assertEqual(['slave2', 'slave3', 'slave1'],
+                         history.order('install',
+                                       ['slave1', 'slave2', 'slave3']))
+
+    def test_order_without_history_keeps_order(self):
+        self.assertEqual(['slave2', 'slave1'],
+                         HostHistory().order('install',
+                                             ['slave2', 'slave1']))
+
+    def test_record_transfers(self):
+        record_transfers([
+            {'cat': 'transfer', 'dur': 1000000,
+             'args': {'host': 'master', 'bytes': 1024 * 1024}},
+            {'cat': 'transfer', 'dur': 1000000,
+             'args': {'host': 'master', 'bytes': 1024 * 1024}},
+            {'cat': 'command', 'dur': 1000000, 'args': {'host': 'master'}}])
+
+        self.assertEqual({'master': 1024 * 1024},
+                         HostHistory.load().transfer_rates)
+
+    def test_estimate_remaining(self):
+        # Two slots: the queued jobs go to whichever slot frees up first
+        self.assertEqual(9.0, estimate_remaining([3.0, 5.0], [6.0, 2.0], 2))
+        self.assertEqual(6.0, estimate_remaining([], [6.0, 2.0, 4.0], 2))
+        self.assertEqual(0.0, estimate_remaining([-1.0], [], 1))
+
+    def test_format_duration(self):
+        self.assertEqual('42s', format_duration(41.6))
+        self.assertEqual('2m05s', format_duration(125))
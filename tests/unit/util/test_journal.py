@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from fabric.api import env
+from mock import patch, MagicMock
+
+from prestoadmin.util import journal
+from tests.base_test_case import BaseTestCase
+
+
+class TestJournal(BaseTestCase):
+    def setUp(self):
+        super(TestJournal, self).setUp(capture_output=True)
+        self.config_dir = tempfile.mkdtemp()
+        patcher = patch('prestoadmin.util.journal.get_config_directory',
+                        return_value=self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(journal.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+        super(TestJournal, self).tearDown()
+
+    def test_no_run(self):
+        self.assertEqual(None, journal.load_run())
+        self.assertFalse(journal.is_active())
+
+    def test_start_records_run(self):
+        journal.start(['server', 'install', 'rpm'], ['master'], [])
+
+        run = journal.load_run()
+        self.assertEqual(['server', 'install', 'rpm'], run['arguments'])
+        self.assertEqual(['master'], run['hosts'])
+        self.assertEqual(os.getcwd(), run['cwd'])
+        self.assertTrue(journal.is_active())
+
+    def test_resume_loads_recorded_steps(self):
+        journal.start(['server', 'upgrade', 'rpm'], [], [])
+        journal.record('master', 'stop')
+        journal.record('master', 'gather config', '/tmp/config.tar')
+        journal.record('slave1', 'stop', object())
+        journal.stop()
+
+        steps = journal.resume()
+
+        self.assertEqual({('master', 'stop'): None,
+                          ('master', 'gather config'): '/tmp/config.tar',
+                          ('slave1', 'stop'): None}, steps)
+        self.assertTrue(journal.is_done('slave1', 'stop'))
+        self.assertFalse(journal.is_done('slave1', 'gather config'))
+
+    def test_resume_ignores_cut_short_line(self):
+        journal.start(['server', 'install', 'rpm'], [], [])
+        journal.record('master', 'transfer')
+        with open(os.path.join(journal.get_journal_directory(),
+                               journal.STEPS_FILE_NAME), 'a') as steps_file:
+            steps_file.write('{"host": "slave1", "st')
+        journal.stop()
+
+        self.assertEqual({('master', 'transfer'): None}, journal.resume())
+
+    def test_start_truncates_steps(self):
+        journal.start(['server', 'install', 'rpm'], [], [])
+        journal.record('master', 'transfer')
+        journal.start(['server', 'install', 'rpm'], [], [])
+        journal.stop()
+
+        self.assertEqual({}, journal.resume())
+
+    def test_fresh_run_does_not_skip_repeated_steps(self):
+        env.host_string = 'master'
+        journal.start(['server', 'upgrade', 'rpm'], [], [])
+        step = MagicMock(return_value='/tmp/config.tar')
+        journal.run_step('gather config', step)
+        journal.run_step('gather config', step)
+        self.assertEqual(2, step.call_count)
+        self.assertFalse(journal.is_done('master', 'gather config'))
+
+    def test_record_without_journal(self):
+        journal.record('master', 'transfer')
+        self.assertFalse(os.path.exists(journal.get_journal_directory()))
+
+    def test_run_step_skips_completed_step(self):
+        env.host_string = 'master'
+        journal.start(['server', 'upgrade', 'rpm'], [], [])
+        step = MagicMock(return_value='/tmp/config.tar')
+        self.assertEqual('/tmp/config.tar',
+                         journal.run_step('gather config', step, 'arg'))
+        step.assert_called_once_with('arg')
+        journal.stop()
+
+        journal.resume()
+        self.assertEqual('/tmp/config.tar',
+                         journal.run_step('gather config', step, 'arg'))
+        self.assertEqual(1, step.call_count)
+        self.assertEqual('[master] Skipping gather config, which already '
+                         'completed\n', self.test_stdout.getvalue())
+
+    def test_command_step_skips_completed_step(self):
+        journal.start(['server', 'upgrade', 'rpm'], [], [])
+        step = MagicMock(return_value='20170131T100000')
+        self.assertEqual('20170131T100000',
+                         journal.command_step('upgrade snapshot', step))
+        journal.stop()
+
+        journal.resume()
+        self.assertEqual('20170131T100000',
+                         journal.command_step('upgrade snapshot', step))
+        step.assert_called_once_with()
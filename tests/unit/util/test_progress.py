@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import Queue
+from StringIO import StringIO
+
+from fabric.api import env
+from mock import patch
+
+from prestoadmin.util import progress
+from prestoadmin.util.progress import Dashboard, QueueWriter
+from tests.base_test_case import BaseTestCase
+
+
+class TerminalIO(StringIO):
+    def isatty(self):
+        return True
+
+
+class TestProgress(BaseTestCase):
+    def setUp(self):
+        super(TestProgress, self).setUp(capture_output=True)
+        self.addCleanup(progress.set_queue, None)
+
+    def test_report_without_queue(self):
+        progress.report(phase='install')
+
+    def test_report(self):
+        queue = Queue.Queue()
+        progress.set_queue(queue)
+        env.host_string = 'master'
+        progress.report(phase='install')
+        self.assertEqual({'name': 'master', 'progress': {'phase': 'install'}},
+                         queue.get_nowait())
+
+    def test_queue_writer_sends_lines(self):
+        queue = Queue.Queue()
+        writer = QueueWriter(queue, 'master', 'stdout')
+        writer.write('one\ntw')
+        writer.write('o\nthree')
+        writer.close()
+        self.assertEqual(
+            [{'name': 'master', 'output': 'one\n', 'stream': 'stdout'},
+             {'name': 'master', 'output': 'two\n', 'stream': 'stdout'},
+             {'name': 'master', 'output': 'three\n', 'stream': 'stdout'}],
+            [queue.get_nowait() for _ in range(3)])
+
+    @patch('prestoadmin.util.progress.time.time')
+    def test_lines(self, time_mock):
+        time_mock.return_value = 100.0
+        dashboard = Dashboard('install', ['master', 'slave1', 'slave2',
+                                          'slave3'], StringIO())
+        dashboard.started('master')
+        time_mock.return_value = 101.0
+        dashboard.started('slave1')
+        dashboard.update({'name': 'master',
+                          'progress': {'phase': 'transfer',
+                                       'transferred': 4 * 1024 * 1024}})
+        dashboard.started('slave2')
+        dashboard.finished('slave2', True)
+        time_mock.return_value = 102.0
+
+        self.assertEqual(
+            ['install: 0 of 4 hosts done, 2 running, 1 failed, 1 waiting, '
+             '2.0 MB/s, about 1m05s left',
+             'Slowest: master transfer 2s, slave1 running 1s',
+             'Failed: slave2'],
+            dashboard.lines(65))
+
+    def test_summary_is_printed_every_interval(self):
+        stream = StringIO()
+        dashboard = Dashboard('install', ['master'], stream)
+        self.assertFalse(dashboard.live)
+        dashboard.tick()
+        self.assertEqual('', stream.getvalue())
+        dashboard._last_draw -= progress.SUMMARY_INTERVAL
+        dashboard.tick()
+        self.assertEqual('install: 0 of 1 hosts done, 0 running, 0 failed, '
+                         '1 waiting\n', stream.getvalue())
+
+    def test_live_dashboard_is_redrawn_in_place(self):
+        stream = TerminalIO()
+        dashboard = Dashboard('install', ['master'], stream)
+        self.assertTrue(dashboard.live)
+        dashboard.started('master')
+        dashboard.draw()
+        dashboard.draw()
+        self.assertEqual(2, stream.getvalue().count('Slowest: master'))
+        self.assertEqual(1, stream.getvalue().count('\x1b[2A\x1b[J'))
+
+    def test_output_is_written_in_place_of_dashboard(self):
+        stream = TerminalIO()
+        dashboard = Dashboard('install', ['master'], stream)
+        dashboard.draw()
+        dashboard.update({'name': 'master', 'output': 'hello\n',
+                          'stream': 'stdout'})
+        self.assertEqual('hello\n', self.test_stdout.getvalue())
+        self.assertTrue(stream.getvalue().endswith('\x1b[1A\x1b[J'))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import multiprocessing
+import os
+
+from prestoadmin.util import queue_logging
+from tests.base_test_case import BaseTestCase
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def log_in_child(log_queue):
+    queue_logging.log_to_queue(log_queue)
+    logger = logging.getLogger('child')
+    logger.info('from %s', 'child')
+    try:
+        raise ValueError('failed')
+    except ValueError:
+        logger.exception('with traceback')
+
+
+class TestQueueLogging(BaseTestCase):
+    def setUp(self):
+        super(TestQueueLogging, self).setUp()
+        logging.disable(logging.NOTSET)
+        self.handler = RecordingHandler()
+        self.old_handlers = list(logging.root.handlers)
+        self.old_level = logging.root.level
+        for handler in self.old_handlers:
+            logging.root.removeHandler(handler)
+        logging.root.addHandler(self.handler)
+        logging.root.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        logging.root.removeHandler(self.handler)
+        for handler in self.old_handlers:
+            logging.root.addHandler(handler)
+        logging.root.setLevel(self.old_level)
+        super(TestQueueLogging, self).tearDown()
+
+    def test_child_records_are_handled_by_parent(self):
+        log_queue = multiprocessing.Queue()
+        listener = queue_logging.start_listener(log_queue)
+        child = multiprocessing.Process(target=log_in_child,
+                                        args=(log_queue,))
+        child.start()
+        child.join()
+        listener.stop()
+
+        self.assertEqual([self.handler], logging.root.handlers)
+        self.assertEqual(['from child', 'with traceback'],
+                         [record.getMessage()
+                          for record in self.handler.records])
+        self.assertEqual([child.pid, child.pid],
+                         [record.process for record in self.handler.records])
+        self.assertNotEqual(os.getpid(), child.pid)
+        self.assertTrue('ValueError: failed' in
+                        self.handler.records[1].exc_text)
+
+    def test_listener_respects_handler_level(self):
+        self.handler.setLevel(logging.WARN)
+        log_queue = multiprocessing.Queue()
+        listener = queue_logging.start_listener(log_queue)
+        queue_logging.QueueHandler(log_queue).handle(logging.LogRecord(
+            'name', logging.INFO, 'path', 1, 'message', None, None))
+        listener.stop()
+
+        self.assertEqual([], self.handler.records)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import shutil
+import socket
+import tempfile
+
+from mock import patch
+
+from prestoadmin.util import reachability
+from tests.base_test_case import BaseTestCase
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestReachability(BaseTestCase):
+    def setUp(self):
+        super(TestReachability, self).setUp()
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.open_port = self.listener.getsockname()[1]
+        self.config_dir = tempfile.mkdtemp()
+        patcher = patch('prestoadmin.util.reachability.get_config_directory',
+                        return_value=self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.listener.close()
+        shutil.rmtree(self.config_dir)
+        super(TestReachability, self).tearDown()
+
+    def test_probe_open_port(self):
+        self.assertEqual(None,
+                         reachability.probe('127.0.0.1', self.open_port, 1))
+
+    def test_probe_closed_port(self):
+        self.assertEqual('Connection refused',
+                         reachability.probe('127.0.0.1', closed_port(), 1))
+
+    def test_find_unreachable(self):
+        port = closed_port()
+        unreachable = reachability.find_unreachable(
+            [('127.0.0.1', str(self.open_port)), ('127.0.0.1', str(port))], 1)
+
+        self.assertEqual({('127.0.0.1', str(port)): 'Connection refused'},
+                         unreachable)
+
+    @patch('prestoadmin.util.reachability.probe', return_value=None)
+    def test_results_are_cached(self, probe_mock):
+        reachability.find_unreachable([('master', '22')], 1)
+        reachability.find_unreachable([('master', '22'), ('slave1', '22')], 1)
+
+        self.assertEqual(2, probe_mock.call_count)
+        probe_mock.assert_called_with('slave1', '22', 1)
+
+    @patch('prestoadmin.util.reachability.time.time')
+    @patch('prestoadmin.util.reachability.probe', return_value=None)
+    def test_cache_expires(self, probe_mock, time_mock):
+        time_mock.return_value = 1000
+        reachability.find_unreachable([('master', '22')], 1)
+        time_mock.return_value = 1000 + reachability.CACHE_TTL
+        reachability.find_unreachable([('master', '22')], 1)
+
+        self.assertEqual(2, probe_mock.call_count)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from prestoadmin.util import run_report
+from tests.base_test_case import BaseTestCase
+
+
+def _span(category, ts, dur, **args):
+    return {'name': category, 'cat': category, 'ph': 'X', 'ts': ts,
+            'dur': dur, 'pid': 1, 'tid': 1, 'args': args}
+
+
+EVENTS = [
+    {'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'a'}},
+    _span('execute', 0, 9000000, hosts=2),
+    _span('task', 0, 4000000, host='slave1'),
+    _span('ssh', 0, 500000, host='slave1', port=22),
+    _span('transfer', 500000, 2000000, host='slave1', phase='transfer',
+          bytes=1024),
+    _span('command', 2500000, 1000000, host='slave1', phase='install'),
+    _span('task', 0, 9000000, host='slave2', error='SystemExit'),
+    _span('command', 0, 8000000, host='slave2', phase='install'),
+    {'name': 'retry', 'cat': 'retry', 'ph': 'i', 'ts': 1, 'pid': 1,
+     'tid': 1, 'args': {'host': 'slave2', 'reason': 'put'}},
+]
+
+
+class TestRunReport(BaseTestCase):
+    def test_build_report(self):
+        report = run_report.build_report(EVENTS, 'package install')
+
+        self.assertEqual('package install', report['command'])
+        self.assertEqual(
+            {'status': 'ok', 'duration': 4.0, 'connect_time': 0.5,
+             'commands': 1, 'bytes_transferred': 1024, 'retries': 0,
+             'phases': {'transfer': 2.0, 'install': 1.0}},
+            report['hosts']['slave1'])
+        self.assertEqual(
+            {'status': 'failed (SystemExit)', 'duration': 9.0,
+             'connect_time': 0.0, 'commands': 1, 'bytes_transferred': 0,
+             'retries': 1, 'phases': {'install': 8.0}},
+            report['hosts']['slave2'])
+        self.assertEqual({'p50': 4.0, 'p95': 9.0, 'max': 9.0},
+                         report['summary']['duration'])
+        self.assertEqual({'p50': 0.0, 'p95': 2.0, 'max': 2.0},
+                         report['summary']['phases.transfer'])
+
+    def test_build_report_without_hosts(self):
+        report = run_report.build_report(EVENTS[:2], 'topology show')
+
+        self.assertEqual({}, report['hosts'])
+
+    def test_format_summary(self):
+        report = run_report.build_report(EVENTS, 'package install')
+
+        self.assertEqual(
+            'Run report for package install:\n'
+            'Host    Status               Total(s)  Connect(s)  Commands  '
+            'Bytes  Retries  install(s)  transfer(s)\n'
+            'slave2  failed (SystemExit)  9.00      0.00        1         '
+            '0      1        8.00        0.00\n'
+            'slave1  ok                   4.00      0.50        1         '
+            '1024   0        1.00        2.00\n'
+            'p50                          4.00      0.00        1         '
+            '0      0        1.00        0.00\n'
+            'p95                          9.00      0.50        1         '
+            '1024   1        8.00        2.00\n'
+            'max                          9.00      0.50        1         '
+            '1024   1        8.00        2.00',
+            run_report.format_summary(report))
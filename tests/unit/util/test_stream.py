@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from fabric.api import env
+from fabric.operations import _AttributeString
+from mock import MagicMock, patch
+
+from prestoadmin.util import stream
+from tests.base_test_case import BaseTestCase
+
+
+class FakeChannel(object):
+    """
+    A channel to a command that reads all of its input and then writes
+    output and errors in chunks
+    """
+    def __init__(self, output='', errors='', return_code=0):
+        self.output = [output[i:i + 3] for i in range(0, len(output), 3)]
+        self.errors = [errors]
+        self.return_code = return_code
+        self.command = None
+        self.sent = []
+        self.closed = False
+
+    def exec_command(self, command):
+        self.command = command
+
+    def set_combine_stderr(self, combine):
+        self.output.extend(self.errors)
+        self.errors = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def shutdown_write(self):
+        pass
+
+    def recv(self, size):
+        return self.output.pop(0) if self.output else ''
+
+    def recv_stderr(self, size):
+        return self.errors.pop(0) if self.errors else ''
+
+    def recv_exit_status(self):
+        return self.return_code
+
+    def close(self):
+        self.closed = True
+
+
+class TestStream(BaseTestCase):
+    def setUp(self):
+        super(TestStream, self).setUp()
+        env.host_string = 'any_host'
+        env.user = 'presto'
+        self.temp_dir = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.temp_dir, 'package.rpm')
+        with open(self.local_path, 'wb') as local_file:
+            local_file.write('rpm' * stream.CHUNK_SIZE)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        stream._can_stream.clear()
+        super(TestStream, self).tearDown()
+
+    def _connect(self, channel):
+        client = MagicMock()
+        client.get_transport.return_value.open_session.return_value = channel
+        patcher = patch('prestoadmin.util.stream.connections',
+                        {'any_host': client})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stream_in(self):
+        channel = FakeChannel(output='abc  -\n', errors='warning')
+        self._connect(channel)
+
+        result = stream.stream_in(self.local_path, 'sha256sum')
+
+        self.assertEqual('sudo -n /bin/bash -c sha256sum', channel.command)
+        self.assertEqual('rpm' * stream.CHUNK_SIZE, ''.join(channel.sent))
+        self.assertEqual(3, len(channel.sent))
+        self.assertEqual('abc  -\nwarning', result)
+        self.assertEqual(hashlib.sha256('rpm' * stream.CHUNK_SIZE)
+                         .hexdigest(), result.sha256)
+        self.assertTrue(result.succeeded)
+        self.assertTrue(channel.closed)
+
+    def test_stream_in_failed(self):
+        env.user = 'root'
+        channel = FakeChannel(output='tar: error', return_code=2)
+        self._connect(channel)
+
+        result = stream.stream_in(self.local_path, 'tar -x')
+
+        self.assertEqual("/bin/bash -c 'tar -x'", channel.command)
+        self.assertTrue(result.failed)
+        self.assertEqual(2, result.return_code)
+
+    def test_stream_out(self):
+        channel = FakeChannel(output='archive content', errors='warning')
+        self._connect(channel)
+        local_path = os.path.join(self.temp_dir, 'config.tar.gz')
+
+        result = stream.stream_out('tar -c .', local_path)
+
+        with open(local_path) as local_file:
+            self.assertEqual('archive content', local_file.read())
+        self.assertEqual('warning', result)
+        self.assertTrue(result.succeeded)
+
+    @patch('prestoadmin.util.stream.run')
+    def test_can_stream(self, run_mock):
+        run_mock.return_value = _AttributeString()
+        run_mock.return_value.succeeded = False
+
+        self.assertFalse(stream.can_stream())
+        self.assertFalse(stream.can_stream())
+        run_mock.assert_called_once_with('sudo -n true', pty=False)
+
+        env.host_string = 'root_host'
+        env.user = 'root'
+        self.assertTrue(stream.can_stream())
+        self.assertEqual(1, run_mock.call_count)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from fabric.tasks import Task
+from mock import patch
+
+import prestoadmin
+from prestoadmin.mode import VALID_MODES, for_mode
+from prestoadmin.util import task_manifest
+from tests.base_test_case import BaseTestCase
+
+
+class TestTaskManifest(BaseTestCase):
+    def setUp(self):
+        super(TestTaskManifest, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = patch('prestoadmin.util.task_manifest.get_config_directory',
+                        return_value=self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write_module(self, source):
+        handle, path = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(handle, 'w') as module_file:
+            module_file.write(source)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_scan_task_module(self):
+        path = self._write_module(
+            '__all__ = ["first"]\n'
+            '__all__ = ["first", "second"]\n'
+            '@task\n'
+            'def first():\n'
+            '    """\n    First task\n    """\n'
+            '@fabric.api.task\n'
+            '@runs_once\n'
+            'def second(arg=None):\n'
+            '    pass\n'
+            '@task\n'
+            'def not_exported():\n'
+            '    pass\n'
+            'def helper():\n'
+            '    """Not a task"""\n')
+
+        self.assertEqual([('first', '\n    First task\n    '),
+                          ('second', None)],
+                         task_manifest.scan_task_module(path))
+
+    def test_scan_task_module_without_all(self):
+        path = self._write_module('@task(alias="b")\ndef a():\n    pass\n')
+
+        self.assertEqual([('a', None)], task_manifest.scan_task_module(path))
+
+    def test_manifest_matches_task_modules(self):
+        # The lazy tasks must match what importing the modules would give
+        for mode in VALID_MODES:
+            task_modules = for_mode(mode, prestoadmin.ADDITIONAL_TASK_MODULES)
+            for atm in task_modules:
+                module_name = atm[0] if isinstance(atm, tuple) else atm
+                module = task_manifest.import_module(
+                    'prestoadmin.' + module_name)
+                expected = dict((name, getattr(module, name).__doc__)
+                                for name in getattr(module, '__all__',
+                                                    vars(module).keys())
+                                if isinstance(getattr(module, name), Task))
+
+                lazy_module = task_manifest.load_lazy_task_modules(
+                    [(module_name, 'subcommand')])['subcommand']
+
+                self.assertEqual('prestoadmin.' + module_name,
+                                 lazy_module.module_name)
+                self.assertEqual(
+                    expected, dict((name, lazy_task.__doc__) for name,
+                                   lazy_task in lazy_module.items()))
+
+    def test_lazy_task_resolve(self):
+        lazy_task = task_manifest.LazyTask('show', 'doc',
+                                           'prestoadmin.topology')
+        from prestoadmin import topology
+
+        self.assertEqual(topology.show, lazy_task.resolve())
+        self.assertEqual('doc', lazy_task.__doc__)
+
+    @patch('prestoadmin.util.task_manifest.scan_task_module')
+    def test_scanned_tasks_are_cached(self, scan_mock):
+        path = self._write_module('')
+        scan_mock.return_value = [('show', 'doc')]
+        module_path = 'prestoadmin.util.task_manifest.get_module_path'
+        with patch(module_path, return_value=path):
+            task_manifest.load_lazy_task_modules([('topology', 'topology')])
+            lazy_module = task_manifest.load_lazy_task_modules(
+                [('topology', 'topology')])['topology']
+            self.assertEqual(1, scan_mock.call_count)
+            self.assertEqual('doc', lazy_module['show'].__doc__)
+
+            os.utime(path, (0, 0))
+            task_manifest.load_lazy_task_modules([('topology', 'topology')])
+            self.assertEqual(2, scan_mock.call_count)
+
+    def test_module_without_source_is_imported(self):
+        module_path = 'prestoadmin.util.task_manifest.get_module_path'
+        with patch(module_path, return_value='/nonexistent/topology.py'):
+            lazy_module = task_manifest.load_lazy_task_modules(
+                [('topology', 'topology')])['topology']
+
+        from prestoadmin import topology
+        self.assertEqual(topology.show.__doc__, lazy_module['show'].__doc__)
+        self.assertEqual(['show'], lazy_module.keys())
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from prestoadmin.util import thread_dump
+from tests.base_test_case import BaseTestCase
+
+JSTACK_DUMP = """\
+"20170131_100000_00001_abcde.1.0-3-42" #42 prio=5 os_prio=0 tid=0x1 \
+nid=0x2 runnable [0x3]
+   java.lang.Thread.State: RUNNABLE
+\tat com.facebook.presto.operator.HashAggregationOperator.addInput(\
+HashAggregationOperator.java:400)
+\tat com.facebook.presto.operator.Driver.processInternal(Driver.java:390)
+
+"http-worker-1" #43 prio=5 os_prio=0 tid=0x4 nid=0x5 waiting on condition
+   java.lang.Thread.State: TIMED_WAITING (parking)
+\tat sun.misc.Unsafe.park(Native Method)
+
+"20170131_100000_00001_abcde.1.0-4-43" #44 prio=5 os_prio=0 tid=0x6 \
+nid=0x7 runnable [0x8]
+   java.lang.Thread.State: RUNNABLE
+\tat com.facebook.presto.operator.HashAggregationOperator.addInput(\
+HashAggregationOperator.java:401)
+""".splitlines()
+
+JFR_SAMPLES = """\
+jdk.ExecutionSample {
+  startTime = 10:00:00.100
+  sampledThread = "task-1" (javaThreadId = 42)
+  state = "STATE_RUNNABLE"
+  stackTrace = [
+    com.facebook.presto.spi.block.LongArrayBlock.getLong(int, int) line: 80
+    com.facebook.presto.operator.Driver.processInternal() line: 390
+  ]
+}
+
+jdk.ExecutionSample {
+  startTime = 10:00:00.120
+  sampledThread = "task-2" (javaThreadId = 43)
+  state = "STATE_RUNNABLE"
+  stackTrace = [
+    java.util.HashMap.get(Object) line: 557
+  ]
+}
+""".splitlines()
+
+
+class TestThreadDump(BaseTestCase):
+    def test_parse_jstack_top_frames(self):
+        self.assertEqual(
+            ['com.facebook.presto.operator.HashAggregationOperator.addInput',
+             'com.facebook.presto.operator.HashAggregationOperator.addInput'],
+            thread_dump.parse_jstack_top_frames(JSTACK_DUMP))
+
+    def test_parse_jfr_top_frames(self):
+        self.assertEqual(
+            ['com.facebook.presto.spi.block.LongArrayBlock.getLong',
+             'java.util.HashMap.get'],
+            thread_dump.parse_jfr_top_frames(JFR_SAMPLES))
+
+    def test_hottest_frames(self):
+        frames_by_host = {'master': ['a', 'b', 'a'],
+                          'slave1': ['a', 'c'],
+                          'slave2': ['c']}
+
+        self.assertEqual([('a', 3, 2), ('c', 2, 2)],
+                         thread_dump.hottest_frames(frames_by_host, 2))
+
+    def test_format_hottest_frames(self):
+        self.assertEqual('Samples  Hosts  Frame\n'
+                         '2        1      a\n'
+                         '1        1      b',
+                         thread_dump.format_hottest_frames(
+                             {'master': ['a', 'b', 'a']}, 10))
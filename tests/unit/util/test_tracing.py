@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+
+from prestoadmin.util import tracing
+from tests.base_test_case import BaseTestCase
+
+
+class TestTracing(BaseTestCase):
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.trace_file = os.path.join(self.temp_dir, 'trace.json')
+
+    def _read_trace(self):
+        with open(self.trace_file) as trace:
+            return json.load(trace)['traceEvents']
+
+    def test_span_disabled(self):
+        with tracing.span('run', 'command', command='ls'):
+            pass
+        self.assertFalse(tracing.is_enabled())
+        self.assertEqual([], tracing._events)
+
+    def test_spans_are_written(self):
+        tracing.start(self.trace_file)
+        self.assertTrue(tracing.is_enabled())
+        with tracing.span('run', 'command', command='ls'):
+            pass
+        try:
+            with tracing.span('sudo', 'command', command='false'):
+                raise ValueError()
+        except ValueError:
+            pass
+        tracing.finish()
+
+        self.assertFalse(tracing.is_enabled())
+        events = self._read_trace()
+        self.assertEqual(['process_name', 'run', 'sudo'],
+                         [event['name'] for event in events])
+        self.assertEqual({'command': 'ls'}, events[1]['args'])
+        self.assertEqual('X', events[1]['ph'])
+        self.assertEqual({'command': 'false', 'error': 'ValueError'},
+                         events[2]['args'])
+
+    def test_processes_are_merged(self):
+        tracing.start(self.trace_file)
+        with tracing.span('execute', 'execute'):
+            # What a process forked for a parallel task does
+            tracing.start_process()
+            with tracing.span('task', 'task', host='slave1'):
+                pass
+            tracing.finish_process('slave1')
+        tracing.finish()
+
+        # The files of the processes are merged in no particular order
+        events = self._read_trace()
+        self.assertEqual(
+            ['execute', 'presto-admin', 'slave1', 'task'],
+            sorted(event['args']['name'].split()[0]
+                   if event['ph'] == 'M' else event['name']
+                   for event in events))
+
+    def test_profile(self):
+        profile_dir = os.path.join(self.temp_dir, 'log')
+        tracing.start(profile_dir=profile_dir)
+        self.assertFalse(tracing.is_enabled())
+        tracing.finish()
+
+        self.assertEqual(['presto-admin-presto-admin-%d.prof' % os.getpid()],
+                         os.listdir(profile_dir))
+
+    def test_operations_are_attributed_to_phase(self):
+        tracing.start(record=True)
+        with tracing.operation_span('put', 'transfer', 'slave1'):
+            pass
+        with tracing.phase('install'):
+            with tracing.operation_span('sudo', 'command', 'slave1'):
+                pass
+            tracing.retry_wait(250, 'rpm')(1, 0)
+        events = tracing.finish()
+
+        self.assertFalse(os.path.exists(self.trace_file))
+        self.assertEqual(
+            [('put', 'transfer'), ('sudo', 'install'), ('retry', None),
+             ('install', None)],
+            [(event['name'], event['args'].get('phase'))
+             for event in events if event['ph'] != 'M'])